@@ -0,0 +1,57 @@
+"""
+Latency of autocomplete_place per keystroke.
+
+Every query is a prefix of a random existing name, typed one character at
+a time, as an address form would send it, and is answered by the range
+seek of get_places_by_prefix on the (country_code, place_key) index.
+
+    python -m benchmarks.bench_autocomplete --rows 1500000 --output results/autocomplete.json
+"""
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.results import report, summarize, write_results
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+from services import get_places_by_prefix  # noqa: E402
+
+
+def keystrokes(rows: int, names: int):
+    """(country_code, prefix) of every keystroke typing ``names`` random existing names."""
+    rnd = random.Random(7)
+    sample = rnd.sample([(r[0], r[2]) for r in generate_rows(rows)], names)
+    return [(country, name[:i]) for country, name in sample for i in range(1, len(name) + 1)]
+
+
+async def run(rows: int, names: int, limit: int, output):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        build_database(path, rows)
+        typed = keystrokes(rows, names)
+
+        samples = []
+        async with aiosqlite.connect(f"{path.as_uri()}?mode=ro", uri=True) as db:
+            started = time.perf_counter()
+            for country, prefix in typed:
+                call_started = time.perf_counter()
+                await get_places_by_prefix(db, country, prefix, limit)
+                samples.append((time.perf_counter() - call_started) * 1000)
+            results = {"SQL range seek": summarize(samples, time.perf_counter() - started)}
+        report("SQL range seek", results["SQL range seek"])
+    if output:
+        write_results(output, "autocomplete", {"rows": rows, "names": names, "limit": limit}, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--names", type=int, default=300)
+    parser.add_argument("--limit", type=int, default=10)
+    parser.add_argument("--output", type=pathlib.Path)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.names, args.limit, args.output))
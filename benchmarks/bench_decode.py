@@ -0,0 +1,88 @@
+"""
+Rows per second decoded from SQLite and serialized to JSON, per decoding path.
+
+Every row of a synthetic database is read in windows of --batch rows, as
+lookups read them, through:
+
+- sqlite3.Row + dict + a plain dataclass, as the services did before
+  fetch_records;
+- fetch_records building slotted PostalCode records from tuples;
+- fetch_records building dicts of two fields, as a ``fields`` projection.
+
+The records are then serialized with pydantic_core, as the MCP server does.
+
+    python -m benchmarks.bench_decode --rows 500000
+"""
+import argparse
+import asyncio
+import pathlib
+import tempfile
+import time
+from dataclasses import field, fields, make_dataclass
+
+import aiosqlite
+import pydantic_core
+
+from benchmarks.synthetic import build_database  # noqa: E402
+from services import POSTAL_CODE_COLUMNS, PostalCode, fetch_records  # noqa: E402
+
+WINDOW_QUERY = "SELECT {columns} FROM postal_codes WHERE rowid > ? AND rowid <= ?"
+
+# PostalCode as it was: a dataclass with a __dict__, built from keyword arguments
+LegacyPostalCode = make_dataclass(
+    "LegacyPostalCode", [(f.name, f.type, field(default=None)) for f in fields(PostalCode)])
+
+PROJECTION = ("postal_code", "place_name")
+
+
+async def legacy_window(db, start, end):
+    async with db.execute(WINDOW_QUERY.format(columns=POSTAL_CODE_COLUMNS), (start, end)) as cursor:
+        cursor.row_factory = aiosqlite.Row
+        return [LegacyPostalCode(**dict(row)) for row in await cursor.fetchall()]
+
+
+async def records_window(db, start, end):
+    return await fetch_records(db, WINDOW_QUERY.format(columns=POSTAL_CODE_COLUMNS),
+                               (start, end), PostalCode)
+
+
+async def projected_window(db, start, end):
+    return await fetch_records(db, WINDOW_QUERY.format(columns=", ".join(PROJECTION)), (start, end),
+                               lambda *row: dict(zip(PROJECTION, row)))
+
+
+async def measure(db, rows: int, batch: int, read_window):
+    decoded = serialized = 0.0
+    size = 0
+    for start in range(0, rows, batch):
+        started = time.perf_counter()
+        records = await read_window(db, start, start + batch)
+        decoded += time.perf_counter() - started
+        started = time.perf_counter()
+        size += len(pydantic_core.to_json(records))
+        serialized += time.perf_counter() - started
+    return decoded, serialized, size
+
+
+async def run(rows: int, batch: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        build_database(path, rows)
+        async with aiosqlite.connect(path) as db:
+            # Warm the page cache so the first path is not penalized
+            await measure(db, rows, batch, records_window)
+            for label, read_window in [("Row + dict", legacy_window),
+                                       ("tuple records", records_window),
+                                       (f"{len(PROJECTION)} fields", projected_window)]:
+                decoded, serialized, size = await measure(db, rows, batch, read_window)
+                print(f"{label:>14}: decode {rows / decoded:10,.0f} rows/s  "
+                      f"serialize {rows / serialized:10,.0f} rows/s  "
+                      f"({size / rows:.0f} JSON bytes/row)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--batch", type=int, default=100)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.batch))
@@ -0,0 +1,58 @@
+"""
+Compares the trigram index path of find_cities_by_name with the LIKE scan it replaced.
+
+    python -m benchmarks.bench_find_cities --rows 500000
+"""
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+from services import get_cities  # noqa: E402
+
+LIKE_QUERY = """
+    SELECT * FROM postal_codes
+    WHERE country_code = ? AND (LOWER(place_name) = ? OR LOWER(place_name) LIKE ?)
+    ORDER BY CASE WHEN LOWER(place_name) = ? THEN 0 ELSE 1 END
+    LIMIT ?
+"""
+
+
+async def like_path(db, country, city, top_k):
+    term = city.lower()
+    async with db.execute(LIKE_QUERY, (country, term, f"%{term}%", term, top_k)) as cursor:
+        return await cursor.fetchall()
+
+
+async def run(rows: int, queries: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        build_database(path, rows)
+        print(f"built {rows} rows in {time.perf_counter() - started:.1f}s")
+
+        rnd = random.Random(7)
+        sample = [r for r in generate_rows(rows) if rnd.random() < 0.01]
+        terms = [(r[0], r[2][1:5]) for r in rnd.sample(sample, min(queries, len(sample)))]
+
+        async with aiosqlite.connect(path) as db:
+            for label, fn in (("LIKE scan", like_path), ("trigram FTS5", get_cities)):
+                started = time.perf_counter()
+                for country, term in terms:
+                    await fn(db, country, term, 10)
+                elapsed = time.perf_counter() - started
+                print(f"{label:>14}: {len(terms) / elapsed:8.1f} queries/s "
+                      f"({elapsed / len(terms) * 1000:.2f} ms/query)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.queries))
@@ -0,0 +1,77 @@
+"""
+Recall and latency of the fuzzy city search on a fixed corpus of misspelled names.
+
+The corpus is derived deterministically from the synthetic rows: names are
+picked with a fixed seed and given one typo each (a deleted, doubled,
+swapped or replaced letter). A query is recalled if the original name is
+among the names of its first ``--top-k`` results.
+
+    python -m benchmarks.bench_fuzzy_cities --rows 500000
+"""
+import argparse
+import asyncio
+import pathlib
+import random
+import statistics
+import string
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+from normalize import fold  # noqa: E402
+from services import get_fuzzy_cities  # noqa: E402
+
+
+def misspell(name: str, rnd: random.Random) -> str:
+    i = rnd.randrange(len(name) - 1)
+    kind = rnd.choice(("delete", "double", "swap", "replace"))
+    if kind == "delete":
+        return name[:i] + name[i + 1:]
+    if kind == "double":
+        return name[:i] + name[i] + name[i:]
+    if kind == "swap":
+        return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+    return name[:i] + rnd.choice(string.ascii_lowercase) + name[i + 1:]
+
+
+def corpus(rows: int, queries: int):
+    """(country, misspelled name, folded original name) triples."""
+    rnd = random.Random(11)
+    names = sorted({(r[0], r[2]) for r in generate_rows(rows) if len(fold(r[2])) >= 5})
+    return [(country, misspell(name, rnd), fold(name))
+            for country, name in rnd.sample(names, min(queries, len(names)))]
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(rows: int, queries: int, top_k: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        build_database(path, rows)
+        print(f"built {rows} rows in {time.perf_counter() - started:.1f}s")
+
+        samples, recalled = [], 0
+        async with aiosqlite.connect(path) as db:
+            for country, query, expected in corpus(rows, queries):
+                started = time.perf_counter()
+                results = await get_fuzzy_cities(db, country, query, top_k)
+                samples.append((time.perf_counter() - started) * 1000)
+                recalled += expected in {fold(r.place_name) for r in results}
+        print(f"recall@{top_k}: {recalled / len(samples):.1%}  "
+              f"p50 {statistics.median(samples):.2f} ms  p99 {percentile(samples, 0.99):.2f} ms  "
+              f"({len(samples)} misspelled names)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--top-k", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.queries, args.top_k))
@@ -0,0 +1,91 @@
+"""
+Import speed of initdata.
+
+Compares the bulk import fast path of sync_postal_codes with the
+row-by-row path it replaced, then times a whole build as check_and_sync
+runs it: sync_postal_codes reading a synthetic local copy of the GeoNames
+export, with --workers parsing processes, and create_country_database.
+
+    python -m benchmarks.bench_import --rows 1500000 --output results/import.json
+"""
+import argparse
+import pathlib
+import sqlite3
+import tempfile
+import time
+from itertools import groupby
+
+from benchmarks.results import write_results
+from benchmarks.synthetic import generate_rows, write_source  # noqa: E402
+import initdata  # noqa: E402
+from normalize import fold  # noqa: E402
+
+
+def archive_rows(count: int):
+    """Synthetic rows as read from the archives (all strings), grouped by country."""
+    rows = sorted((tuple(str(v) for v in row) for row in generate_rows(count)),
+                  key=lambda row: row[0])
+    return [(country, list(group)) for country, group in groupby(rows, key=lambda row: row[0])]
+
+
+def raw_import(con, countries):
+    """Untyped rows, default pragmas, every index maintained on each insert."""
+    cur = con.cursor()
+    for country, rows in countries:
+        cur.execute("DELETE FROM postal_codes WHERE country_code = ?", (country,))
+        cur.executemany(initdata.INSERT_POSTAL_CODE,
+                        (row + (fold(row[2]),) for row in rows))
+        con.commit()
+
+
+def fast_import(con, countries):
+    """import_mode with deferred indexes and typed batches."""
+    cur = con.cursor()
+    with initdata.import_mode(con, defer_indexes=True):
+        for country, rows in countries:
+            cur.execute("DELETE FROM postal_codes WHERE country_code = ?", (country,))
+            initdata.insert_postal_codes(cur, rows)
+            con.commit()
+
+
+def full_build(path: pathlib.Path, source: pathlib.Path, workers: int):
+    """A database built from ``source`` the way a first start builds it."""
+    con = sqlite3.connect(path)
+    initdata.create_tables(con)
+    initdata.sync_postal_codes(con, source=str(source), defer_indexes=True, workers=workers)
+    initdata.create_country_database(con, source=str(source))
+    con.close()
+
+
+def run(rows: int, workers: int, output):
+    countries = archive_rows(rows)
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        for label, fn in (("row by row", raw_import), ("import mode", fast_import)):
+            path = pathlib.Path(tmp) / f"{fn.__name__}.db"
+            con = sqlite3.connect(path)
+            initdata.create_tables(con)
+            started = time.perf_counter()
+            fn(con, countries)
+            elapsed = time.perf_counter() - started
+            con.close()
+            print(f"{label:>12}: {rows / elapsed:10.0f} rows/s ({elapsed:.1f}s)")
+            results[label] = {"rows_per_s": round(rows / elapsed, 1), "elapsed_ms": round(elapsed * 1000)}
+
+        source = write_source(pathlib.Path(tmp) / "source", rows)
+        started = time.perf_counter()
+        full_build(pathlib.Path(tmp) / "full.db", source, workers)
+        elapsed = time.perf_counter() - started
+        print(f"{'full build':>12}: {rows / elapsed:10.0f} rows/s ({elapsed:.1f}s, {workers} workers)")
+        results["full build"] = {"rows_per_s": round(rows / elapsed, 1), "elapsed_ms": round(elapsed * 1000)}
+    if output:
+        write_results(output, "import", {"rows": rows, "workers": workers}, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--workers", type=int, default=initdata.IMPORT_WORKERS)
+    parser.add_argument("--output", type=pathlib.Path)
+    args = parser.parse_args()
+    run(args.rows, args.workers, args.output)
@@ -0,0 +1,73 @@
+"""
+Overhead of the metrics recorded around every tool call and query.
+
+Times a no-op coroutine called directly and through Metrics.instrument_tool
+plus observe_query (what a tool running one query records), then compares
+the difference with the latency of a real get_cities lookup.
+
+    python -m benchmarks.bench_metrics --rows 200000
+"""
+import argparse
+import asyncio
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+from metrics import Metrics  # noqa: E402
+from services import get_cities  # noqa: E402
+
+
+async def per_call(call, calls: int) -> float:
+    """Seconds per call of the coroutine function ``call``."""
+    started = time.perf_counter()
+    for _ in range(calls):
+        await call()
+    return (time.perf_counter() - started) / calls
+
+
+async def run(rows: int, calls: int, lookups: int):
+    metrics = Metrics()
+    result = [None] * 10
+
+    async def noop():
+        return result
+
+    @metrics.instrument_tool
+    async def instrumented():
+        started = time.perf_counter()
+        metrics.observe_connection_wait(0.0)
+        metrics.observe_query("noop", time.perf_counter() - started, result)
+        return result
+
+    bare = statistics.median([await per_call(noop, calls) for _ in range(5)])
+    recorded = statistics.median([await per_call(instrumented, calls) for _ in range(5)])
+    overhead = recorded - bare
+    print(f"no-op call: {bare * 1e9:,.0f} ns bare, {recorded * 1e9:,.0f} ns recorded "
+          f"({overhead * 1e9:,.0f} ns of metrics per call)")
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        build_database(path, rows)
+        rnd = random.Random(7)
+        names = [(r[0], r[2]) for r in rnd.sample(list(generate_rows(rows)), lookups)]
+        async with aiosqlite.connect(path) as db:
+            started = time.perf_counter()
+            for country, name in names:
+                await get_cities(db, country, name, 10)
+            lookup = (time.perf_counter() - started) / lookups
+    print(f"get_cities: {lookup * 1e6:,.0f} us per lookup, "
+          f"metrics add {overhead / lookup:.2%}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--calls", type=int, default=100_000)
+    parser.add_argument("--lookups", type=int, default=2_000)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.calls, args.lookups))
@@ -0,0 +1,74 @@
+"""
+Compares resolving N postal codes with get_locations_by_postal_codes against N single calls.
+
+Measured twice: on the services (one query per code vs one per country),
+and through an in-memory MCP client, where each single call is also a
+tool round-trip. The result cache is disabled.
+
+    python -m benchmarks.bench_postal_codes_batch --rows 200000 --codes 500
+"""
+import argparse
+import asyncio
+import pathlib
+import random
+import tempfile
+import time
+
+import aiosqlite
+from fastmcp import Client
+
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+import main  # noqa: E402
+from services import get_postal_code, get_postal_codes  # noqa: E402
+
+
+def report(label, elapsed, codes):
+    print(f"{label:>24}: {elapsed * 1000:9.1f} ms ({codes / elapsed:9.0f} codes/s)")
+
+
+async def bench_services(path, items):
+    async with aiosqlite.connect(path) as db:
+        started = time.perf_counter()
+        for country, code in items:
+            await get_postal_code(db, country, code)
+        report("services, single", time.perf_counter() - started, len(items))
+        started = time.perf_counter()
+        await get_postal_codes(db, items)
+        report("services, batch", time.perf_counter() - started, len(items))
+
+
+async def bench_tools(path, items):
+    main.DB_PATH = path
+    main.CACHE_MAX_ENTRIES = 0
+    main.check_and_sync = lambda on_ready=None, on_imported=None: on_ready() or False
+    async with Client(main.mcp) as client:
+        while main._store is None or not main._store.ready:
+            await asyncio.sleep(0.01)
+        started = time.perf_counter()
+        for country, code in items:
+            await client.call_tool("get_location_by_postal_code",
+                                   {"country_code": country, "postal_code": code})
+        report("MCP tools, single", time.perf_counter() - started, len(items))
+        started = time.perf_counter()
+        await client.call_tool("get_locations_by_postal_codes", {"items": [
+            {"country_code": country, "postal_code": code} for country, code in items]})
+        report("MCP tools, batch", time.perf_counter() - started, len(items))
+
+
+async def run(rows: int, codes: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        build_database(path, rows)
+        rnd = random.Random(7)
+        sample = [(r[0], r[1]) for r in generate_rows(rows) if rnd.random() < 0.05]
+        items = rnd.sample(sample, min(codes, len(sample)))
+        await bench_services(path, items)
+        await bench_tools(path, items)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=100_000)
+    parser.add_argument("--codes", type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.codes))
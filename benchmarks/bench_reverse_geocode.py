@@ -0,0 +1,61 @@
+"""
+Latency of reverse geocoding through the R*Tree against a haversine scan of the whole table.
+
+    python -m benchmarks.bench_reverse_geocode --rows 500000
+"""
+import argparse
+import asyncio
+import heapq
+import pathlib
+import random
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.synthetic import build_database  # noqa: E402
+from geo import haversine_km  # noqa: E402
+from services import get_nearest_postal_codes  # noqa: E402
+
+
+async def full_scan(db, latitude, longitude, limit):
+    async with db.execute("SELECT rowid, latitude, longitude FROM postal_codes") as cursor:
+        rows = await cursor.fetchall()
+    return heapq.nsmallest(limit, rows, key=lambda r: haversine_km(latitude, longitude, r[1], r[2]))
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run(rows: int, queries: int, limit: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        build_database(path, rows)
+        print(f"built {rows} rows in {time.perf_counter() - started:.1f}s")
+
+        rnd = random.Random(7)
+        points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(queries)]
+
+        async with aiosqlite.connect(path) as db:
+            for label, fn, count in (("haversine scan", full_scan, max(1, queries // 20)),
+                                     ("R*Tree", get_nearest_postal_codes, queries)):
+                samples = []
+                for latitude, longitude in points[:count]:
+                    started = time.perf_counter()
+                    await fn(db, latitude, longitude, limit)
+                    samples.append((time.perf_counter() - started) * 1000)
+                print(f"{label:>14}: p50 {statistics.median(samples):8.2f} ms  "
+                      f"p99 {percentile(samples, 0.99):8.2f} ms  ({count} random points)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.queries, args.limit))
@@ -0,0 +1,134 @@
+"""
+Latency of every lookup function of services.py on a synthetic database.
+
+Each function is called --iterations times with arguments drawn from the
+generated rows (existing names, postal codes and coordinates), on one
+connection set up like the pooled ones, and from the snapshot for the
+snapshot lookups. Writes p50/p95/p99 and calls/s per function to --output.
+
+    python -m benchmarks.bench_services --rows 1500000 --output results/services.json
+"""
+import argparse
+import asyncio
+import inspect
+import pathlib
+import random
+import sqlite3
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.results import report, summarize, write_results
+from benchmarks.synthetic import COUNTRY_NAMES, build_database, generate_rows  # noqa: E402
+import initdata  # noqa: E402
+import services  # noqa: E402
+from snapshot import Snapshot  # noqa: E402
+
+
+def sample_rows(rows: int, count: int, seed: int = 7):
+    """``count`` (rowid, row) pairs of the synthetic data, at random but always the same."""
+    rnd = random.Random(seed)
+    picked = set(rnd.sample(range(rows), min(count, rows)))
+    sample = [(i + 1, row) for i, row in enumerate(generate_rows(rows)) if i in picked]
+    rnd.shuffle(sample)
+    return sample
+
+
+def misspell(name: str, rnd: random.Random) -> str:
+    """``name`` with two adjacent letters swapped."""
+    if len(name) < 4:
+        return name
+    i = rnd.randrange(1, len(name) - 2)
+    return name[:i] + name[i + 1] + name[i] + name[i + 2:]
+
+
+def cases(db, snapshot, sample, batch: int):
+    """Name and call of each benchmarked function; a call takes one sampled (rowid, row)."""
+    rnd = random.Random(11)
+    typos = {rowid: misspell(row[2], rnd) for rowid, row in sample}
+    codes = [(row[0], row[1]) for _, row in sample]
+
+    def batch_of(rowid):
+        start = rowid % max(1, len(codes) - batch)
+        return codes[start:start + batch]
+
+    def box(row):
+        lat, lon = row[9], row[10]
+        return (max(lat - 0.5, -90), max(lon - 0.5, -180), min(lat + 0.5, 90), min(lon + 0.5, 180))
+
+    def country_term(row):
+        return COUNTRY_NAMES[row[0]]["en"][:3].lower()
+
+    return {
+        "countries": lambda rowid, row: services.countries(db, country_term(row), "en"),
+        "get_countries": lambda rowid, row: services.get_countries(db, country_term(row), "en"),
+        "get_data_generation": lambda rowid, row: services.get_data_generation(db),
+        "get_cities": lambda rowid, row: services.get_cities(db, row[0], row[2], 10),
+        "get_cities (substring)": lambda rowid, row: services.get_cities(db, row[0], row[2][1:5], 10),
+        "get_cities (fields)": lambda rowid, row: services.get_cities(
+            db, row[0], row[2], 10, ["postal_code", "place_name"]),
+        "get_places_by_name": lambda rowid, row: services.get_places_by_name(db, row[0], row[2], 10),
+        "get_cities_from_snapshot": lambda rowid, row: services.get_cities_from_snapshot(
+            snapshot, row[0], row[2], 10),
+        "get_fuzzy_cities": lambda rowid, row: services.get_fuzzy_cities(db, row[0], typos[rowid], 10),
+        "get_places_by_prefix": lambda rowid, row: services.get_places_by_prefix(
+            db, row[0], row[2][:3], 10),
+        "get_postal_code": lambda rowid, row: services.get_postal_code(db, row[0], row[1]),
+        "get_postal_code_from_snapshot": lambda rowid, row: services.get_postal_code_from_snapshot(
+            snapshot, row[0], row[1]),
+        f"get_postal_codes ({batch})": lambda rowid, row: services.get_postal_codes(db, batch_of(rowid)),
+        "nearest_rowids": lambda rowid, row: services.nearest_rowids(db, row[9], row[10], 10),
+        "get_nearest_postal_codes": lambda rowid, row: services.get_nearest_postal_codes(
+            db, row[9], row[10], 10),
+        "get_places_near": lambda rowid, row: services.get_places_near(db, row[9], row[10], 25.0, None, 20),
+        "get_places_in_box": lambda rowid, row: services.get_places_in_box(db, *box(row), None, 20),
+    }
+
+
+async def run(rows: int, iterations: int, batch: int, only: str, output):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = pathlib.Path(tmp) / "bench.db"
+        started = time.perf_counter()
+        build_database(path, rows)
+        with sqlite3.connect(path) as con:
+            snapshot_path = initdata.export_snapshot(con, pathlib.Path(tmp) / "bench.snap")
+        con.close()
+        print(f"built {rows} rows and their snapshot in {time.perf_counter() - started:.1f}s")
+
+        sample = sample_rows(rows, iterations)
+        snapshot = Snapshot(snapshot_path)
+        results = {}
+        try:
+            async with aiosqlite.connect(f"{path.as_uri()}?mode=ro", uri=True) as db:
+                for name, call in cases(db, snapshot, sample, batch).items():
+                    if only and only not in name:
+                        continue
+                    samples = []
+                    started = time.perf_counter()
+                    for rowid, row in sample:
+                        call_started = time.perf_counter()
+                        result = call(rowid, row)
+                        if inspect.isawaitable(result):
+                            result = await result
+                        samples.append((time.perf_counter() - call_started) * 1000)
+                        if isinstance(result, str):
+                            raise RuntimeError(f"{name}: {result}")
+                    results[name] = summarize(samples, time.perf_counter() - started)
+                    report(name, results[name])
+        finally:
+            snapshot.close()
+    if output:
+        write_results(output, "services", {"rows": rows, "iterations": iterations, "batch": batch},
+                      results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--iterations", type=int, default=500)
+    parser.add_argument("--batch", type=int, default=100, help="postal codes per get_postal_codes call")
+    parser.add_argument("--only", default="", help="run the functions whose name contains this")
+    parser.add_argument("--output", type=pathlib.Path)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.iterations, args.batch, args.only, args.output))
@@ -0,0 +1,117 @@
+"""
+Cold start and lookup latency of the memory-mapped snapshot against SQLite.
+
+Exports a snapshot of a synthetic database, then times opening it, the
+startup of a DataStore with and without it, and the postal code / city /
+autocomplete lookups of both backends. Finally starts ``--workers``
+processes that each map the same file, as separate server workers would,
+and reports how long each took to open it and answer its first lookup.
+
+    python -m benchmarks.bench_snapshot --rows 1500000
+"""
+import argparse
+import asyncio
+import multiprocessing
+import pathlib
+import random
+import sqlite3
+import statistics
+import tempfile
+import time
+
+import aiosqlite
+
+from benchmarks.synthetic import build_database, generate_rows  # noqa: E402
+from datastore import DataStore  # noqa: E402
+from initdata import export_snapshot  # noqa: E402
+from services import get_cities, get_cities_from_snapshot, get_places_by_prefix, \
+    get_places_by_prefix_from_snapshot, get_postal_code, get_postal_code_from_snapshot  # noqa: E402
+from snapshot import Snapshot  # noqa: E402
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def report(label, samples):
+    print(f"{label:>26}: p50 {statistics.median(samples):8.3f} ms  "
+          f"p99 {percentile(samples, 0.99):8.3f} ms  ({len(samples)} lookups)")
+
+
+def cold_start(path, country, code):
+    started = time.perf_counter()
+    snapshot = Snapshot(path)
+    opened = time.perf_counter()
+    snapshot.postal_code(country, code)
+    answered = time.perf_counter()
+    snapshot.close()
+    return (opened - started) * 1000, (answered - started) * 1000
+
+
+async def store_startup(db_path, snapshot_path, pool_size, runs=5):
+    """Milliseconds to open and close a DataStore, the best of ``runs``."""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        store = await DataStore(db_path, pool_options={"size": pool_size},
+                                snapshot_path=snapshot_path).open()
+        timings.append((time.perf_counter() - started) * 1000)
+        await store.close()
+    return min(timings)
+
+
+async def run(rows: int, queries: int, workers: int, pool_size: int):
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = pathlib.Path(tmp) / "bench.db"
+        build_database(db_path, rows)
+        started = time.perf_counter()
+        with sqlite3.connect(db_path) as con:
+            snapshot_path = export_snapshot(con, pathlib.Path(tmp) / "bench.snap")
+        con.close()
+        print(f"exported {rows} rows in {time.perf_counter() - started:.2f}s: "
+              f"snapshot {snapshot_path.stat().st_size / 1024 / 1024:.1f} MiB, "
+              f"database {db_path.stat().st_size / 1024 / 1024:.1f} MiB")
+
+        for label, path in (("without snapshot", None), ("with snapshot", snapshot_path)):
+            print(f"DataStore startup {label}: {await store_startup(db_path, path, pool_size):.3f} ms")
+
+        rnd = random.Random(7)
+        sample = rnd.sample(list(generate_rows(rows)), queries)
+        codes = [(r[0], r[1]) for r in sample]
+        cities = [(r[0], r[2].split()[0][:rnd.randint(3, 8)]) for r in sample]
+        prefixes = [(r[0], r[2][:rnd.randint(1, 6)]) for r in sample]
+
+        snapshot = Snapshot(snapshot_path)
+        async with aiosqlite.connect(db_path) as db:
+            for label, lookups, by_sqlite, by_snapshot in (
+                    ("postal code", codes, get_postal_code, get_postal_code_from_snapshot),
+                    ("city", cities, get_cities, get_cities_from_snapshot),
+                    ("autocomplete", prefixes, get_places_by_prefix, get_places_by_prefix_from_snapshot)):
+                sqlite_samples, snapshot_samples = [], []
+                for args in lookups:
+                    started = time.perf_counter()
+                    await by_sqlite(db, *args)
+                    sqlite_samples.append((time.perf_counter() - started) * 1000)
+                    started = time.perf_counter()
+                    by_snapshot(snapshot, *args)
+                    snapshot_samples.append((time.perf_counter() - started) * 1000)
+                report(f"{label}, SQLite", sqlite_samples)
+                report(f"{label}, snapshot", snapshot_samples)
+        snapshot.close()
+
+        with multiprocessing.get_context("spawn").Pool(workers) as pool:
+            starts = pool.starmap(cold_start, [(snapshot_path, *codes[i % len(codes)])
+                                               for i in range(workers)])
+        for worker, (opened, answered) in enumerate(starts):
+            print(f"worker {worker}: opened in {opened:.3f} ms, first lookup after {answered:.3f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=500_000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--pool-size", type=int, default=4)
+    args = parser.parse_args()
+    asyncio.run(run(args.rows, args.queries, args.workers, args.pool_size))
@@ -0,0 +1,37 @@
+"""
+Compares two benchmark result files, e.g. of the same benchmark on two commits.
+
+Exits with status 1 if a metric got worse by more than --threshold.
+
+    python -m benchmarks.compare results/base.json results/new.json --threshold 0.1
+"""
+import argparse
+import json
+import pathlib
+import sys
+
+from benchmarks.results import compare
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("base", type=pathlib.Path)
+    parser.add_argument("new", type=pathlib.Path)
+    parser.add_argument("--threshold", type=float, default=0.1)
+    args = parser.parse_args()
+    base = json.loads(args.base.read_text("utf-8"))
+    new = json.loads(args.new.read_text("utf-8"))
+    if base["benchmark"] != new["benchmark"]:
+        print(f"different benchmarks: {base['benchmark']} and {new['benchmark']}")
+        return 2
+    print(f"{base['environment']['commit'] or '?'} -> {new['environment']['commit'] or '?'}")
+    rows = compare(base, new, args.threshold)
+    for row in rows:
+        flag = "  REGRESSION" if row["regression"] else ""
+        print(f"{row['case']:>34} {row['metric']:>16}: {row['base']:12.3f} -> {row['new']:12.3f} "
+              f"({row['change']:+.1%}){flag}")
+    return 1 if any(row["regression"] for row in rows) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
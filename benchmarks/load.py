@@ -0,0 +1,137 @@
+"""
+Concurrent load on the MCP tools over streamable-http.
+
+Starts benchmarks.serve in another process on a synthetic database of
+--rows rows, or targets a server already running at --url. Then
+--concurrency clients, each with its own MCP session, call the countries,
+find_cities_by_name and get_location_by_postal_code tools in turn for
+--duration seconds. Their arguments come from the same synthetic rows the
+server holds. Reports throughput and p50/p95/p99 latency per tool.
+
+    python -m benchmarks.load --rows 1500000 --concurrency 16 --duration 30 --output results/load.json
+"""
+import argparse
+import asyncio
+import itertools
+import pathlib
+import socket
+import subprocess
+import sys
+import time
+from collections import defaultdict
+
+import httpx
+from fastmcp import Client
+
+from benchmarks.bench_services import sample_rows
+from benchmarks.results import REPOSITORY, report, summarize, write_results
+from benchmarks.synthetic import COUNTRY_NAMES
+
+# Seconds given to the server to build its database and start listening
+STARTUP_TIMEOUT = 1800
+
+
+def tool_calls(rows: int, count: int):
+    """(tool, arguments) pairs cycling through the three tools."""
+    calls = []
+    for _, row in sample_rows(rows, count):
+        calls += [
+            ("countries", {"search_term": COUNTRY_NAMES[row[0]]["en"][:3], "lang": "en"}),
+            ("find_cities_by_name", {"country_code": row[0], "city_name": row[2], "limit": 10}),
+            ("get_location_by_postal_code", {"country_code": row[0], "postal_code": row[1]}),
+        ]
+    return calls
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_server(rows: int, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "benchmarks.serve", "--rows", str(rows), "--port", str(port)],
+        cwd=REPOSITORY,
+    )
+
+
+async def wait_until_ready(base_url: str, server: subprocess.Popen = None):
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            if server is not None and server.poll() is not None:
+                raise RuntimeError(f"the server exited with status {server.returncode}")
+            try:
+                if (await http.get(f"{base_url}/health/ready")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.5)
+    raise TimeoutError(f"{base_url} not ready after {STARTUP_TIMEOUT}s")
+
+
+async def worker(url: str, calls, stop_at: float, latencies, errors):
+    async with Client(url) as client:
+        while time.perf_counter() < stop_at:
+            tool, arguments = next(calls)
+            started = time.perf_counter()
+            result = await client.call_tool(tool, arguments, raise_on_error=False)
+            latencies[tool].append((time.perf_counter() - started) * 1000)
+            content = result.structured_content or {}
+            if result.is_error or isinstance(content.get("result"), str):
+                errors[tool] += 1
+
+
+async def drive(url: str, rows: int, concurrency: int, duration: float, warmup: float):
+    calls = itertools.cycle(tool_calls(rows, 2000))
+    if warmup:
+        await asyncio.gather(*(worker(url, calls, time.perf_counter() + warmup,
+                                      defaultdict(list), defaultdict(int))
+                               for _ in range(concurrency)))
+    latencies, errors = defaultdict(list), defaultdict(int)
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(url, calls, started + duration, latencies, errors)
+                           for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    results = {}
+    for tool, samples in sorted(latencies.items()):
+        results[tool] = {**summarize(samples, elapsed), "errors": errors[tool]}
+        report(tool, results[tool])
+    everything = [sample for samples in latencies.values() for sample in samples]
+    results["all"] = {**summarize(everything, elapsed), "errors": sum(errors.values())}
+    report("all", results["all"])
+    return results
+
+
+async def run(args):
+    server = None
+    url = args.url
+    if not url:
+        port = free_port()
+        server = start_server(args.rows, port)
+        url = f"http://127.0.0.1:{port}/mcp"
+    try:
+        await wait_until_ready(url.rsplit("/mcp", 1)[0], server)
+        results = await drive(url, args.rows, args.concurrency, args.duration, args.warmup)
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(30)
+    if args.output:
+        write_results(args.output, "load", {
+            "rows": args.rows, "concurrency": args.concurrency, "duration": args.duration,
+            "external_server": bool(args.url),
+        }, results)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--url", help="MCP endpoint of a running server (built with the same --rows)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--warmup", type=float, default=2.0)
+    parser.add_argument("--output", type=pathlib.Path)
+    asyncio.run(run(parser.parse_args()))
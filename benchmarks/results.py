@@ -0,0 +1,102 @@
+"""
+Latency summaries and JSON results shared by the benchmarks.
+
+A result file records what was measured, with which parameters, and on
+which commit and machine, so that runs can be compared with
+benchmarks.compare. Metric names end with their unit: ``_ms`` (lower is
+better) or ``_per_s`` (higher is better).
+"""
+import datetime
+import json
+import os
+import pathlib
+import platform
+import sqlite3
+import statistics
+import subprocess
+from typing import Any, Dict, List, Optional, Sequence
+
+REPOSITORY = pathlib.Path(__file__).parent.parent
+
+
+def percentile(samples: Sequence[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def summarize(samples_ms: Sequence[float], elapsed: Optional[float] = None) -> Dict[str, float]:
+    """Latency percentiles of ``samples_ms``, and the throughput if they took ``elapsed`` seconds."""
+    summary = {
+        "count": len(samples_ms),
+        "mean_ms": round(statistics.fmean(samples_ms), 4),
+        "p50_ms": round(percentile(samples_ms, 0.50), 4),
+        "p95_ms": round(percentile(samples_ms, 0.95), 4),
+        "p99_ms": round(percentile(samples_ms, 0.99), 4),
+        "max_ms": round(max(samples_ms), 4),
+    }
+    if elapsed:
+        summary["throughput_per_s"] = round(len(samples_ms) / elapsed, 2)
+    return summary
+
+
+def report(label: str, summary: Dict[str, float]):
+    throughput = summary.get("throughput_per_s")
+    print(f"{label:>34}: p50 {summary['p50_ms']:9.3f} ms  p95 {summary['p95_ms']:9.3f} ms  "
+          f"p99 {summary['p99_ms']:9.3f} ms"
+          + (f"  {throughput:10,.1f}/s" if throughput is not None else ""))
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=REPOSITORY, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def environment() -> Dict[str, Any]:
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "sqlite": sqlite3.sqlite_version,
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def write_results(path, benchmark: str, parameters: Dict[str, Any],
+                  results: Dict[str, Dict[str, float]]) -> pathlib.Path:
+    """Writes the ``results`` of a run (metrics per case) to ``path`` as JSON."""
+    path = pathlib.Path(path)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    document = {
+        "benchmark": benchmark,
+        "created": datetime.datetime.now(datetime.timezone.utc).isoformat(timespec="seconds"),
+        "environment": environment(),
+        "parameters": parameters,
+        "results": results,
+    }
+    path.write_text(json.dumps(document, indent=2) + "\n", "utf-8")
+    print(f"results written to {path}")
+    return path
+
+
+def compare(base: Dict[str, Any], new: Dict[str, Any], threshold: float) -> List[Dict[str, Any]]:
+    """
+    The metrics of two result documents, with their relative change.
+
+    A change worse than ``threshold`` (0.1 = 10%) in the direction given by
+    the unit of the metric is flagged as a regression. Metrics without a
+    known unit, or missing from one run, are skipped.
+    """
+    rows = []
+    for case, metrics in new["results"].items():
+        for metric, value in metrics.items():
+            before = base["results"].get(case, {}).get(metric)
+            if before is None or not metric.endswith(("_ms", "_per_s")):
+                continue
+            change = (value - before) / before if before else 0.0
+            worse = change > threshold if metric.endswith("_ms") else change < -threshold
+            rows.append({"case": case, "metric": metric, "base": before, "new": value,
+                         "change": change, "regression": worse})
+    return rows
@@ -0,0 +1,42 @@
+"""
+Runs the MCP server over streamable-http on a synthetic database, for benchmarks.load.
+
+The data is built up front (or read from --db), so the server is ready as
+soon as it listens; nothing is downloaded.
+
+    python -m benchmarks.serve --rows 1500000 --port 8765
+"""
+import argparse
+import pathlib
+import tempfile
+
+import uvicorn
+
+from benchmarks.synthetic import build_database  # noqa: E402
+import main  # noqa: E402
+
+
+def serve(path: pathlib.Path, host: str, port: int):
+    def check_and_sync(on_ready=None, on_imported=None):
+        on_ready()
+        return False
+
+    main.DB_PATH = path
+    main.check_and_sync = check_and_sync
+    uvicorn.run(main.mcp.http_app(), host=host, port=port, log_level="warning")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--rows", type=int, default=200_000)
+    parser.add_argument("--db", type=pathlib.Path, help="serve this database instead of building one")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+    if args.db:
+        serve(args.db, args.host, args.port)
+    else:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = pathlib.Path(tmp) / "bench.db"
+            build_database(path, args.rows)
+            serve(path, args.host, args.port)
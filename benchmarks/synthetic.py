@@ -0,0 +1,109 @@
+"""
+Deterministic synthetic GeoNames data for benchmarks.
+
+Rows have the same shape as the postal code dumps published on
+download.geonames.org, so they can be fed to the same import code: either
+straight into a database (build_database) or as a local copy of the export
+that initdata imports like the real one (write_source). The same seed and
+count always give the same data, so runs on different commits compare;
+the full GeoNames export has about 1.5M rows.
+"""
+import json
+import random
+import sqlite3
+import sys
+import pathlib
+from io import TextIOWrapper
+from zipfile import ZIP_DEFLATED, ZipFile
+
+sys.path.insert(0, str(pathlib.Path(__file__).parent.parent / "src"))
+
+import initdata  # noqa: E402
+
+SYLLABLES = [
+    "ro", "ma", "mi", "la", "no", "to", "ri", "na", "ber", "lin", "mün", "chen",
+    "bo", "lo", "gna", "fi", "ren", "ze", "pa", "ris", "ly", "on", "ham", "burg",
+    "san", "ta", "vil", "le", "sur", "mer", "forl", "ì", "ca", "sa", "del", "mon",
+]
+COUNTRIES = ["IT", "DE", "FR", "ES", "US", "JP", "GB", "NL", "AT", "CH"]
+# Names of the countries in the languages of the countries table
+COUNTRY_NAMES = {
+    "IT": {"it": "Italia", "en": "Italy"},
+    "DE": {"it": "Germania", "en": "Germany"},
+    "FR": {"it": "Francia", "en": "France"},
+    "ES": {"it": "Spagna", "en": "Spain"},
+    "US": {"it": "Stati Uniti", "en": "United States"},
+    "JP": {"it": "Giappone", "en": "Japan"},
+    "GB": {"it": "Regno Unito", "en": "United Kingdom"},
+    "NL": {"it": "Paesi Bassi", "en": "Netherlands"},
+    "AT": {"it": "Austria", "en": "Austria"},
+    "CH": {"it": "Svizzera", "en": "Switzerland"},
+}
+
+
+def place_name(rnd: random.Random) -> str:
+    name = "".join(rnd.choice(SYLLABLES) for _ in range(rnd.randint(2, 4)))
+    if rnd.random() < 0.15:
+        name += " " + "".join(rnd.choice(SYLLABLES) for _ in range(2))
+    return name.capitalize()
+
+
+def generate_rows(count: int, seed: int = 42):
+    """Yields ``count`` postal code rows as tuples in the postal_codes column order."""
+    rnd = random.Random(seed)
+    for i in range(count):
+        country = COUNTRIES[i % len(COUNTRIES)]
+        yield (
+            country,
+            f"{rnd.randint(0, 99999):05}",
+            place_name(rnd),
+            f"State {rnd.randint(1, 20)}", f"{rnd.randint(1, 20):02}",
+            f"County {rnd.randint(1, 100)}", f"{rnd.randint(1, 100):03}",
+            "", "",
+            round(rnd.uniform(-60, 70), 4), round(rnd.uniform(-180, 180), 4),
+            rnd.choice([1, 4, 6]),
+        )
+
+
+def country_rows():
+    """Rows of the countries table: (country_code, country_name, lang)."""
+    return [(code, name, lang) for code, names in COUNTRY_NAMES.items() for lang, name in names.items()]
+
+
+def build_database(path, count: int, seed: int = 42):
+    """Creates a database at ``path`` with the real schema and ``count`` synthetic rows."""
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        con.executemany("INSERT INTO countries (country_code, country_name, lang) VALUES (?, ?, ?)",
+                        country_rows())
+        initdata.insert_postal_codes(con.cursor(), generate_rows(count, seed))
+        con.commit()
+    con.close()
+
+
+def write_source(directory, count: int, seed: int = 42) -> pathlib.Path:
+    """
+    Writes ``count`` synthetic rows as a local copy of the GeoNames export.
+
+    One zip per country (IT.zip holding IT.txt, tab separated) and the
+    countryInfo-<lang>.json answers, as initdata reads them from
+    POSTAL_CODES_SOURCE. Rows are streamed to the zips, so any count fits in
+    memory.
+    """
+    directory = pathlib.Path(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    archives = {code: ZipFile(directory / f"{code}.zip", "w", ZIP_DEFLATED) for code in COUNTRIES}
+    files = {code: TextIOWrapper(archive.open(f"{code}.txt", "w"), "utf-8")
+             for code, archive in archives.items()}
+    try:
+        for row in generate_rows(count, seed):
+            files[row[0]].write("\t".join(str(value) for value in row) + "\n")
+    finally:
+        for code in COUNTRIES:
+            files[code].close()
+            archives[code].close()
+    for lang in ("it", "en"):
+        geonames = [{"country_code": code, "country_name": names[lang]}
+                    for code, names in COUNTRY_NAMES.items()]
+        (directory / f"countryInfo-{lang}.json").write_text(json.dumps({"geonames": geonames}), "utf-8")
+    return directory
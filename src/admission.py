@@ -0,0 +1,173 @@
+"""
+Admission control and deadlines for the tool calls.
+
+A CallLimiter runs a bounded number of tool calls at once and queues a
+bounded number more; past that, calls are refused straight away with an
+error message. During a traffic spike, answering some calls quickly
+beats answering all of them late. Each admitted call gets a deadline,
+waiting in the queue included. Past it, the call is cancelled and its
+running query is stopped by the progress handler of its connection (see
+run_interruptible); a call cancelled by the client stops its query the
+same way, instead of keeping a pooled connection busy for nothing.
+"""
+import asyncio
+import time
+from collections import deque
+from contextvars import ContextVar
+from functools import wraps
+from typing import TYPE_CHECKING, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+
+if TYPE_CHECKING:
+    # profiling imports this module: the tracer is only needed for its type
+    from profiling import QueryTracer
+
+T = TypeVar("T")
+
+# time.monotonic() deadline of the tool call running in the current task, None without one
+_deadline: ContextVar[Optional[float]] = ContextVar("deadline", default=None)
+
+
+class DeadlineExceeded(Exception):
+    """A query was stopped because the deadline of its tool call passed."""
+
+
+def current_deadline() -> Optional[float]:
+    return _deadline.get()
+
+
+def parse_timeouts(value: str) -> Dict[str, float]:
+    """Per-tool timeouts from "tool=seconds,tool=seconds" (e.g. an environment variable)."""
+    timeouts = {}
+    for item in filter(None, (item.strip() for item in value.split(","))):
+        name, _, seconds = item.partition("=")
+        if not seconds:
+            raise ValueError(f"Invalid tool timeout {item!r}, expected tool=seconds")
+        timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+async def run_interruptible(tracer: Optional["QueryTracer"], query: Awaitable[T],
+                            deadline: Optional[float] = None) -> T:
+    """
+    Awaits ``query``, which runs on the connection of ``tracer``, within ``deadline``.
+
+    ``deadline`` (a time.monotonic() value) defaults to the one of the
+    current tool call. Raises DeadlineExceeded if the progress handler
+    stopped the query at the deadline. If the caller is cancelled, the query is stopped too, and this
+    returns (raising CancelledError) only once the connection's thread is
+    done with it, so that the connection is free when it goes back to the
+    pool. Without a tracer the query just runs to completion.
+    """
+    if tracer is None:
+        return await query
+    tracer.start(deadline if deadline is not None else current_deadline())
+    # A task of its own, so that a cancellation can reach the query without unwinding it first
+    task = asyncio.ensure_future(query)
+    try:
+        result = await asyncio.shield(task)
+    except asyncio.CancelledError:
+        tracer.cancel()
+        await asyncio.wait([task])
+        if not task.cancelled():
+            task.exception()
+        raise
+    except Exception as e:
+        if tracer.interrupted:
+            raise DeadlineExceeded(str(e)) from e
+        raise
+    finally:
+        tracer.stop()
+    if tracer.interrupted:
+        # The service reported the interruption as an error message
+        raise DeadlineExceeded(result)
+    return result
+
+
+class CallLimiter:
+    """
+    Runs at most ``max_concurrent`` tool calls at once, with at most ``max_waiting`` queued.
+
+    Calls are admitted in arrival order. Each call has ``timeout`` seconds,
+    or those of its tool in ``timeouts``, from its arrival to its result;
+    0 means no deadline. Refused and timed-out calls return an error
+    message, like the tools do for invalid arguments.
+    """
+
+    def __init__(self, max_concurrent: int, max_waiting: int, timeout: float = 0.0,
+                 timeouts: Optional[Dict[str, float]] = None):
+        if max_concurrent < 1:
+            raise ValueError("At least one call must be allowed to run")
+        self.max_concurrent = max_concurrent
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.timeouts = dict(timeouts or {})
+        self.running = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def timeout_of(self, name: str) -> float:
+        return self.timeouts.get(name, self.timeout)
+
+    async def _acquire(self):
+        if self.running < self.max_concurrent and not self._waiters:
+            self.running += 1
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            # _release hands its slot over: running is not decremented in between
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+            raise
+
+    def _release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.running -= 1
+
+    async def _admitted(self, tool: Callable, deadline: Optional[float], args, kwargs):
+        await self._acquire()
+        token = _deadline.set(deadline)
+        try:
+            return await tool(*args, **kwargs)
+        finally:
+            _deadline.reset(token)
+            self._release()
+
+    def instrument_tool(self, tool: Callable) -> Callable:
+        """Wraps an async tool so that its calls are admitted by the limiter."""
+        name = tool.__name__
+
+        @wraps(tool)
+        async def limited(*args, **kwargs):
+            if self.running >= self.max_concurrent and self.waiting >= self.max_waiting:
+                self.rejected += 1
+                return (f"Server busy: {self.running} calls running and {self.waiting} waiting. "
+                        f"Retry later.")
+            timeout = self.timeout_of(name)
+            deadline = time.monotonic() + timeout if timeout > 0 else None
+            try:
+                return await asyncio.wait_for(self._admitted(tool, deadline, args, kwargs),
+                                              timeout if timeout > 0 else None)
+            except (asyncio.TimeoutError, DeadlineExceeded):
+                self.timed_out += 1
+                return (f"{name} took longer than {timeout:g}s and was stopped: narrow the search "
+                        f"(e.g. a longer name, a country_code or a lower limit).")
+
+        return limited
+
+    def status(self) -> Dict[str, int]:
+        return {"running": self.running, "waiting": self.waiting,
+                "rejected": self.rejected, "timed_out": self.timed_out}
@@ -0,0 +1,168 @@
+import sys
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, fields, is_dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, List, Optional, Tuple, Union
+
+
+def estimate_size(value: Any) -> int:
+    """Approximate memory footprint of a cached result, in bytes."""
+    if isinstance(value, (list, tuple)):
+        return sys.getsizeof(value) + sum(estimate_size(v) for v in value)
+    if isinstance(value, dict):
+        return sys.getsizeof(value) + sum(sys.getsizeof(v) for v in value.values())
+    if is_dataclass(value):
+        return sys.getsizeof(value) + sum(
+            sys.getsizeof(getattr(value, f.name)) for f in fields(value)
+        )
+    return sys.getsizeof(value)
+
+
+@dataclass
+class _Entry:
+    value: Any
+    size: int
+    generation: int
+    expires_at: Optional[float]
+
+
+class ResultCache:
+    """
+    Bounded LRU cache of query results, with optional TTL.
+
+    Entries are tagged with the data generation they were computed from;
+    moving the cache to a new generation (see set_generation) drops every
+    entry, so results never outlive the data they were read from. The cache
+    is bounded both by number of entries and by estimated size in bytes.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 10_000,
+            max_bytes: int = 64 * 1024 * 1024,
+            ttl: Optional[float] = None,
+            generation: int = 0,
+            clock: Callable[[], float] = time.monotonic,
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl or None
+        self.generation = generation
+        self._clock = clock
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _drop(self, key: Hashable):
+        entry = self._entries.pop(key)
+        self.bytes -= entry.size
+
+    def clear(self):
+        self._entries.clear()
+        self.bytes = 0
+
+    def set_generation(self, generation: int):
+        """Moves the cache to a new data generation, invalidating every entry."""
+        if generation != self.generation:
+            self.generation = generation
+            self.clear()
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """Returns (True, value) on a hit, (False, None) on a miss."""
+        entry = self._entries.get(key)
+        if entry is not None and entry.generation != self.generation:
+            self._drop(key)
+            entry = None
+        if entry is not None and entry.expires_at is not None \
+                and entry.expires_at <= self._clock():
+            self._drop(key)
+            self.expirations += 1
+            entry = None
+        if entry is None:
+            self.misses += 1
+            return False, None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return True, entry.value
+
+    def put(self, key: Hashable, value: Any):
+        size = estimate_size(value)
+        if self.max_entries <= 0 or size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._drop(key)
+        expires_at = self._clock() + self.ttl if self.ttl else None
+        self._entries[key] = _Entry(value, size, self.generation, expires_at)
+        self.bytes += size
+        while len(self._entries) > self.max_entries or self.bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+            self.evictions += 1
+
+    async def get_or_compute(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Returns the cached value for ``key``, computing and storing it on a miss.
+
+        Only list results are stored: the services return a plain string to
+        report errors, and those must not be served again from the cache.
+        """
+        hit, value = self.get(key)
+        if hit:
+            return list(value)
+        generation = self.generation
+        value = await compute()
+        # Results read while the data changed generation belong to the old data
+        if isinstance(value, list) and generation == self.generation:
+            self.put(key, tuple(value))
+        return value
+
+    async def get_or_compute_many(
+            self,
+            keys: List[Hashable],
+            compute: Callable[[List[Hashable]], Awaitable[Union[Dict[Hashable, list], str]]],
+    ) -> Union[Dict[Hashable, list], str]:
+        """
+        Batch get_or_compute: returns {key: value} for ``keys``.
+
+        The keys missing from the cache are computed with a single
+        ``compute(missing)`` call, which returns {key: list} for them, or a
+        string to report an error; the error is returned as is.
+        """
+        values, missing = {}, []
+        for key in dict.fromkeys(keys):
+            hit, value = self.get(key)
+            if hit:
+                values[key] = list(value)
+            else:
+                missing.append(key)
+        if missing:
+            generation = self.generation
+            computed = await compute(missing)
+            if isinstance(computed, str):
+                return computed
+            for key, value in computed.items():
+                values[key] = value
+                if generation == self.generation:
+                    self.put(key, tuple(value))
+        return values
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "generation": self.generation,
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "max_entries": self.max_entries,
+            "max_bytes": self.max_bytes,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
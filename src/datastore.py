@@ -0,0 +1,241 @@
+import asyncio
+import logging
+import pathlib
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Dict, Optional, Set
+
+from cache import ResultCache
+from indexes import CountryIndex
+from pool import ConnectionPool
+from services import get_data_generation
+from snapshot import Snapshot
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class RefreshStatus:
+    state: str = "idle"  # idle | running | failed
+    started_at: Optional[float] = None
+    finished_at: Optional[float] = None
+    published: Optional[bool] = None
+    error: Optional[str] = None
+
+
+@dataclass
+class WarmingUp:
+    """Answer of the tools while the data they need is still being imported."""
+    status: str
+    message: str
+    countries_imported: int
+    countries_total: Optional[int] = None
+
+
+class DataStore:
+    """
+    The data generation currently served by the tools.
+
+    Holds the read-only connection pool and the in-memory country index built
+    from the database file. After a refresh has atomically replaced that file,
+    reload() opens a pool on the new file, swaps it in for new requests and
+    only then closes the old pool, once its in-flight queries have finished.
+
+    initialize() prepares the data in a worker thread, so the server can
+    accept connections meanwhile: the store goes from "starting" (nothing
+    readable yet) to "warming_up" (database open, postal codes of the
+    countries in ``imported`` available) to "ready", or to "failed".
+    """
+
+    def __init__(
+            self,
+            path: pathlib.Path,
+            pool_options: Optional[Dict[str, Any]] = None,
+            cache: Optional[ResultCache] = None,
+            drain_timeout: float = 60.0,
+            snapshot_path: Optional[pathlib.Path] = None,
+    ):
+        self.path = pathlib.Path(path)
+        self.pool_options = pool_options or {}
+        self.cache = cache
+        self.drain_timeout = drain_timeout
+        self.snapshot_path = pathlib.Path(snapshot_path) if snapshot_path else None
+        self.pool: Optional[ConnectionPool] = None
+        self.countries: Optional[CountryIndex] = None
+        self.snapshot: Optional[Snapshot] = None
+        self.generation = 0
+        self.refresh_status = RefreshStatus()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self.state = "starting"
+        self.error: Optional[str] = None
+        self.imported: Set[str] = set()
+        self.countries_total: Optional[int] = None
+
+    async def _load(self):
+        # With a snapshot most lookups never reach SQLite: connect only when needed
+        options = {"lazy": self.snapshot_path is not None, **self.pool_options}
+        pool = await ConnectionPool(self.path, **options).open()
+        async with pool.acquire() as db:
+            # Countries are few and rarely change: serve them from memory
+            countries = await CountryIndex.load(db)
+            generation = await get_data_generation(db)
+        return pool, countries, self._open_snapshot(generation), generation
+
+    def _open_snapshot(self, generation: int) -> Optional[Snapshot]:
+        """The snapshot at snapshot_path, if there is one of ``generation``."""
+        if self.snapshot_path is None or not self.snapshot_path.is_file():
+            return None
+        try:
+            snapshot = Snapshot(self.snapshot_path)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Ignoring snapshot {self.snapshot_path}: {e}")
+            return None
+        if snapshot.generation != generation:
+            logger.warning(f"Ignoring snapshot {self.snapshot_path} of generation "
+                           f"{snapshot.generation}, the database is at {generation}")
+            snapshot.close()
+            return None
+        return snapshot
+
+    def _publish(self, pool, countries, snapshot, generation):
+        old_snapshot = self.snapshot
+        self.pool, self.countries, self.generation = pool, countries, generation
+        self.snapshot = snapshot
+        # Lookups on a snapshot never wait on anything: none can be running now
+        if old_snapshot is not None:
+            old_snapshot.close()
+        if self.cache is not None:
+            self.cache.set_generation(generation)
+
+    async def open(self) -> "DataStore":
+        self._publish(*await self._load())
+        if self.state == "starting":
+            self.state = "ready"
+        return self
+
+    @property
+    def ready(self) -> bool:
+        return self.state == "ready"
+
+    def _mark_imported(self, country_code: str, total: int):
+        self.imported.add(country_code)
+        self.countries_total = total
+
+    async def initialize(self, check_and_sync: Callable[..., bool]):
+        """
+        Runs ``check_and_sync`` (see initdata.check_and_sync) in a worker thread.
+
+        The store is opened as soon as the database becomes readable, and
+        reloaded once a newly built database is complete.
+        """
+        self.state = "warming_up"
+        loop = asyncio.get_running_loop()
+
+        def on_ready():
+            asyncio.run_coroutine_threadsafe(self.open(), loop).result()
+
+        def on_imported(country_code: str, total: int):
+            loop.call_soon_threadsafe(self._mark_imported, country_code, total)
+
+        try:
+            built = await asyncio.to_thread(
+                check_and_sync, on_ready=on_ready, on_imported=on_imported)
+            if self.pool is None:
+                await self.open()
+            elif built:
+                await self.reload()
+        except Exception as e:
+            logger.error(f"Data initialization failed: {e}", exc_info=True)
+            self.state = "failed"
+            self.error = str(e)
+        else:
+            self.state = "ready"
+            logger.info(f"Data ready (generation {self.generation})")
+
+    def warming_up(self, country_code: Optional[str] = None) -> Optional[WarmingUp]:
+        """
+        None if a request can be answered now, otherwise the answer to give instead.
+
+        Requests without ``country_code`` need the database to be open; those
+        for a country need that country to be imported.
+        """
+        if self.ready:
+            return None
+        if self.pool is not None and self.state == "warming_up" and (
+                country_code is None or country_code.upper() in self.imported):
+            return None
+        if self.state == "failed":
+            return WarmingUp("failed", f"Data initialization failed: {self.error}",
+                             len(self.imported), self.countries_total)
+        return WarmingUp(
+            "warming_up",
+            "The GeoNames data is still being imported, retry in a few seconds.",
+            len(self.imported), self.countries_total,
+        )
+
+    async def reload(self):
+        """Switches new requests to the current database file and retires the old pool."""
+        old_pool = self.pool
+        self._publish(*await self._load())
+        logger.info(f"Serving data generation {self.generation}")
+        if old_pool is not None:
+            await old_pool.close(self.drain_timeout)
+
+    async def close(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
+        if self.pool is not None:
+            await self.pool.close(self.drain_timeout)
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    async def refresh(self, refresh_database: Callable[[], bool]):
+        """
+        Runs ``refresh_database`` in a worker thread and reloads if it published new data.
+
+        ``refresh_database`` builds and swaps in the new file (see
+        initdata.refresh_database) and returns True when it did.
+        """
+        self.refresh_status = RefreshStatus(state="running", started_at=time.time())
+        try:
+            published = await asyncio.to_thread(refresh_database)
+            if published:
+                await self.reload()
+        except Exception as e:
+            logger.error(f"Data refresh failed: {e}", exc_info=True)
+            self.refresh_status.state = "failed"
+            self.refresh_status.error = str(e)
+        else:
+            self.refresh_status.state = "idle"
+            self.refresh_status.published = published
+        finally:
+            self.refresh_status.finished_at = time.time()
+
+    def start_refresh(self, refresh_database: Callable[[], bool]) -> bool:
+        """Starts a background refresh; returns False if one is running or the data is not ready."""
+        if not self.ready:
+            return False
+        if self._refresh_task is not None and not self._refresh_task.done():
+            return False
+        self._refresh_task = asyncio.create_task(self.refresh(refresh_database))
+        return True
+
+    async def refresh_periodically(self, refresh_database: Callable[[], bool], interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            self.start_refresh(refresh_database)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "state": self.state,
+            "error": self.error,
+            "countries_imported": len(self.imported),
+            "countries_total": self.countries_total,
+            "generation": self.generation,
+            "path": str(self.path),
+            "pool_size": self.pool.size if self.pool else 0,
+            "snapshot": str(self.snapshot.path) if self.snapshot else None,
+            "snapshot_bytes": self.snapshot.nbytes if self.snapshot else 0,
+            "refresh": asdict(self.refresh_status),
+        }
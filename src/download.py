@@ -0,0 +1,235 @@
+import asyncio
+import hashlib
+import logging
+import queue
+import tempfile
+import threading
+from dataclasses import dataclass
+from typing import BinaryIO, Dict, Iterator, List, NamedTuple, Optional
+
+import httpx
+from bs4 import BeautifulSoup
+
+logger = logging.getLogger(__name__)
+
+# Archives on the GeoNames index page that are not per-country dumps
+EXCLUDED_DATASETS = ["GB_full.csv.zip", "allCountries.zip"]
+
+_DONE = object()
+
+
+class Validators(NamedTuple):
+    """HTTP cache validators of a previously downloaded archive."""
+    etag: Optional[str] = None
+    last_modified: Optional[str] = None
+
+
+class Fetched(NamedTuple):
+    file: BinaryIO
+    sha256: str
+    validators: Validators
+
+
+@dataclass
+class Archive:
+    """
+    A downloaded country archive, or the error that prevented its download.
+
+    ``file`` is a spooled temporary file positioned at the start of the zip;
+    whoever consumes the archive must close it. When the server answered a
+    conditional request with 304 Not Modified, ``not_modified`` is set and
+    there is no file. Countries split out of a multi-country dump (see
+    mirror.split_all_countries) have no file either but ``lines``, chunks of
+    their TSV rows, valid until the next archive is taken; their ``total``
+    is unknown.
+    """
+    name: str
+    total: Optional[int]
+    file: Optional[BinaryIO] = None
+    error: Optional[Exception] = None
+    sha256: Optional[str] = None
+    validators: Validators = Validators()
+    not_modified: bool = False
+    lines: Optional[Iterator[List[str]]] = None
+
+    @property
+    def country_code(self) -> str:
+        return self.name.replace(".zip", "")
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+
+
+def parse_dataset_index(html: str) -> List[str]:
+    """Names of the per-country archives linked from the GeoNames index page."""
+    links_all = BeautifulSoup(html, "html.parser").find_all("a")
+    return [
+        el["href"] for el in links_all
+        if el.get("href", "").endswith(".zip") and el["href"] not in EXCLUDED_DATASETS
+    ]
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, httpx.HTTPStatusError):
+        return error.response.status_code >= 500 or error.response.status_code == 429
+    return isinstance(error, (httpx.TransportError, asyncio.TimeoutError))
+
+
+async def fetch_archive(
+        client: httpx.AsyncClient,
+        url: str,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 300.0,
+        spool_max_size: int = 4 * 1024 * 1024,
+        validators: Optional[Validators] = None,
+) -> Optional[Fetched]:
+    """
+    Downloads one archive, retrying transient failures with exponential backoff.
+
+    The body is streamed chunk by chunk into a SpooledTemporaryFile, which
+    stays in memory up to ``spool_max_size`` bytes and rolls over to disk
+    beyond that, so large countries never sit whole in memory; its SHA-256
+    is computed on the way. ``timeout`` bounds the whole transfer of a single
+    attempt, on top of the connect/read timeouts of the client.
+
+    With ``validators`` the request is conditional (If-None-Match /
+    If-Modified-Since) and None is returned if the server reports the
+    archive as not modified.
+    """
+    headers = {}
+    if validators is not None:
+        if validators.etag:
+            headers["If-None-Match"] = validators.etag
+        if validators.last_modified:
+            headers["If-Modified-Since"] = validators.last_modified
+    attempt = 0
+    while True:
+        spool = tempfile.SpooledTemporaryFile(max_size=spool_max_size)
+        try:
+            async def transfer():
+                async with client.stream("GET", url, headers=headers) as r:
+                    if r.status_code == 304:
+                        return None
+                    r.raise_for_status()
+                    digest = hashlib.sha256()
+                    async for chunk in r.aiter_bytes():
+                        digest.update(chunk)
+                        spool.write(chunk)
+                    return digest.hexdigest(), Validators(
+                        r.headers.get("ETag"), r.headers.get("Last-Modified"))
+
+            result = await asyncio.wait_for(transfer(), timeout)
+            if result is None:
+                spool.close()
+                return None
+            spool.seek(0)
+            return Fetched(spool, *result)
+        except Exception as e:
+            spool.close()
+            if attempt >= retries or not is_retryable(e):
+                raise
+            delay = backoff * 2 ** attempt
+            attempt += 1
+            logger.warning(f"Retrying {url} in {delay:.1f}s ({attempt}/{retries}): {e!r}")
+            await asyncio.sleep(delay)
+
+
+async def _download(
+        base_url: str,
+        archives: queue.Queue,
+        stop: threading.Event,
+        concurrency: int,
+        retries: int,
+        backoff: float,
+        timeout: float,
+        spool_max_size: int,
+        known: Dict[str, Validators],
+):
+    async def put(item):
+        await asyncio.to_thread(archives.put, item)
+
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    try:
+        async with httpx.AsyncClient(limits=limits, timeout=httpx.Timeout(60.0)) as client:
+            res = await client.get(base_url)
+            res.raise_for_status()
+            datasets = parse_dataset_index(res.content.decode("utf-8"))
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def download(name_zip: str):
+                async with semaphore:
+                    if stop.is_set():
+                        return
+                    try:
+                        fetched = await fetch_archive(
+                            client, f"{base_url}{name_zip}", retries, backoff, timeout,
+                            spool_max_size, known.get(name_zip))
+                        if fetched is None:
+                            archive = Archive(name_zip, len(datasets), not_modified=True,
+                                              validators=known[name_zip])
+                        else:
+                            archive = Archive(name_zip, len(datasets), file=fetched.file,
+                                              sha256=fetched.sha256,
+                                              validators=fetched.validators)
+                    except Exception as e:
+                        archive = Archive(name_zip, len(datasets), error=e)
+                    # Holding the semaphore while the writer is busy is the back-pressure
+                    await put(archive)
+
+            await asyncio.gather(*(download(name_zip) for name_zip in datasets))
+    except Exception as e:
+        await put(e)
+    finally:
+        await put(_DONE)
+
+
+def iter_archives(
+        base_url: str,
+        concurrency: int = 8,
+        retries: int = 3,
+        backoff: float = 1.0,
+        timeout: float = 300.0,
+        spool_max_size: int = 4 * 1024 * 1024,
+        known: Optional[Dict[str, Validators]] = None,
+) -> Iterator[Archive]:
+    """
+    Downloads every country archive listed at ``base_url`` and yields them as they complete.
+
+    Downloads run on an asyncio loop in a background thread with at most
+    ``concurrency`` transfers in flight over a shared connection pool, while
+    the caller consumes the archives in its own thread: the caller stays the
+    only writer of the database. At most ``concurrency`` finished archives wait
+    for the caller, each holding at most ``spool_max_size`` bytes in memory.
+    Errors on the index page are raised; errors on a single archive are
+    reported through Archive.error.
+
+    ``known`` maps archive names to the validators of their last download:
+    those archives are requested conditionally.
+    """
+    archives: queue.Queue = queue.Queue(maxsize=concurrency)
+    stop = threading.Event()
+    thread = threading.Thread(
+        target=asyncio.run,
+        args=(_download(base_url, archives, stop, concurrency, retries, backoff, timeout,
+                        spool_max_size, known or {}),),
+        name="geonames-download",
+        daemon=True,
+    )
+    thread.start()
+    try:
+        while (item := archives.get()) is not _DONE:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Unblock and wind down the downloader if the caller stopped early
+        stop.set()
+        while thread.is_alive() or not archives.empty():
+            try:
+                item = archives.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            if isinstance(item, Archive):
+                item.close()
@@ -0,0 +1,53 @@
+"""
+String similarity used to rank misspelled place names.
+
+All functions expect folded text (see normalize.fold).
+"""
+from typing import List, Set
+
+
+def trigrams(text: str) -> Set[str]:
+    """The trigrams the FTS5 trigram tokenizer indexes for ``text``."""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def chunks(text: str, parts: int) -> List[str]:
+    """``text`` cut into ``parts`` consecutive pieces whose lengths differ by one at most."""
+    size, extra = divmod(len(text), parts)
+    bounds = [i * size + min(i, extra) for i in range(parts + 1)]
+    return [text[start:end] for start, end in zip(bounds, bounds[1:])]
+
+
+def padded_trigrams(text: str) -> Set[str]:
+    """Trigrams of the words of ``text`` padded with blanks, as pg_trgm does."""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def trigram_similarity(a: Set[str], b: Set[str]) -> float:
+    """Shared trigrams over all the trigrams of two names (0 to 1)."""
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def levenshtein(a: str, b: str) -> int:
+    """Edit distance (insertions, deletions, substitutions) between two strings."""
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        previous = current
+    return previous[-1]
+
+
+def score(edit_distance: int, similarity: float, a: str, b: str) -> float:
+    """Ranking score of a candidate name (0 to 1): edit distance and trigram similarity weigh alike."""
+    closeness = 1 - edit_distance / max(len(a), len(b), 1)
+    return round((closeness + similarity) / 2, 3)
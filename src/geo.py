@@ -0,0 +1,44 @@
+"""
+Great-circle distances and the bounding boxes used to query the spatial index.
+"""
+import math
+from typing import List, Tuple
+
+EARTH_RADIUS_KM = 6371.0088
+# Farthest two points on the globe can be
+MAX_DISTANCE_KM = math.pi * EARTH_RADIUS_KM
+
+# (min_lat, max_lat, min_lon, max_lon)
+Box = Tuple[float, float, float, float]
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+    """Great-circle distance between two points, in kilometres."""
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    d_phi = phi2 - phi1
+    d_lambda = math.radians(lon2 - lon1)
+    a = math.sin(d_phi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(d_lambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_boxes(latitude: float, longitude: float, radius_km: float) -> List[Box]:
+    """
+    Latitude/longitude boxes containing every point within ``radius_km`` of a point.
+
+    A box crossing the antimeridian is returned as two boxes; near the poles
+    the box spans every longitude.
+    """
+    delta = radius_km / EARTH_RADIUS_KM
+    min_lat = latitude - math.degrees(delta)
+    max_lat = latitude + math.degrees(delta)
+    if min_lat <= -90 or max_lat >= 90:
+        # The circle contains a pole: every longitude is in reach
+        return [(max(min_lat, -90.0), min(max_lat, 90.0), -180.0, 180.0)]
+    # Widest longitude difference of a point within the radius
+    d_lon = math.degrees(math.asin(math.sin(delta) / math.cos(math.radians(latitude))))
+    min_lon, max_lon = longitude - d_lon, longitude + d_lon
+    if min_lon < -180:
+        return [(min_lat, max_lat, min_lon + 360, 180.0), (min_lat, max_lat, -180.0, max_lon)]
+    if max_lon > 180:
+        return [(min_lat, max_lat, min_lon, 180.0), (min_lat, max_lat, -180.0, max_lon - 360)]
+    return [(min_lat, max_lat, min_lon, max_lon)]
@@ -0,0 +1,48 @@
+from types import MappingProxyType
+from typing import Dict, List, Tuple
+
+from aiosqlite import Connection
+
+from normalize import fold
+from services import Country
+
+
+class CountryIndex:
+    """
+    Immutable in-memory copy of the countries table, grouped by language.
+
+    The table holds a few hundred rows per language, so searching a tuple of
+    precomputed folded names is faster than any round-trip to SQLite. A new
+    index is built from the database every time the data is (re)loaded; an
+    existing one is never modified.
+    """
+
+    def __init__(self, countries: Dict[str, List[Country]]):
+        self._by_lang = MappingProxyType({
+            lang: tuple((fold(c.country_name), c) for c in items)
+            for lang, items in countries.items()
+        })
+
+    @classmethod
+    async def load(cls, db: Connection) -> "CountryIndex":
+        countries: Dict[str, List[Country]] = {}
+        query = "SELECT country_code, country_name, lang FROM countries ORDER BY lang, country_code"
+        async with db.execute(query) as cursor:
+            async for country_code, country_name, lang in cursor:
+                countries.setdefault(lang, []).append(Country(country_code, country_name))
+        return cls(countries)
+
+    @property
+    def languages(self) -> Tuple[str, ...]:
+        return tuple(self._by_lang)
+
+    def __len__(self) -> int:
+        return sum(len(items) for items in self._by_lang.values())
+
+    def search(self, search_term: str = "", lang: str = "it") -> List[Country]:
+        """Countries of ``lang`` whose name contains ``search_term``, ignoring case and accents."""
+        items = self._by_lang.get(lang, ())
+        term = fold(search_term)
+        if not term:
+            return [country for _, country in items]
+        return [country for key, country in items if term in key]
@@ -1,14 +1,25 @@
 import csv
+import json
 import logging
+import multiprocessing
 import os
 import pathlib
 import sqlite3
-from io import BytesIO, TextIOWrapper
+from collections import deque
+from concurrent.futures import Executor, ProcessPoolExecutor
+from contextlib import closing, contextmanager
+from io import TextIOWrapper
+from itertools import islice
+from typing import Callable, Dict, Optional, Tuple
 from zipfile import ZipFile
 
 import httpx  # Sostituito requests con httpx
-from bs4 import BeautifulSoup
-import logging
+
+from download import Archive, Validators, iter_archives
+from mirror import is_local_source, iter_local_archives
+from normalize import fold
+from snapshot import Snapshot, write_snapshot
+
 # --- Configurazione ---
 
 logger = logging.getLogger(__name__)
@@ -18,18 +29,43 @@ GEONAMES_USERNAME = os.getenv("GEONAMES_USERNAME", "demo")
 
 # Percorsi dei dati
 DATA_DIR = pathlib.Path(__file__).parent.resolve()
-POSTAL_CODES_DIR = DATA_DIR / "data"
+POSTAL_CODES_DIR = pathlib.Path(os.getenv("POSTAL_CODES_DIR", DATA_DIR / "data"))
 DB_PATH = DATA_DIR / "countries.db"
 
 # URL delle API
 GEONAMES_ZIP_URL = "http://download.geonames.org/export/zip/"
 GEONAMES_API_URL = "http://api.geonames.org/"
 
+# Origine dei CAP: l'URL dell'export di GeoNames o una directory locale con una sua copia
+POSTAL_CODES_SOURCE = os.getenv("POSTAL_CODES_SOURCE", GEONAMES_ZIP_URL)
+
+# Download dei dataset: trasferimenti paralleli, tentativi e timeout per file (secondi)
+DOWNLOAD_CONCURRENCY = int(os.getenv("DOWNLOAD_CONCURRENCY", "8"))
+DOWNLOAD_RETRIES = int(os.getenv("DOWNLOAD_RETRIES", "3"))
+DOWNLOAD_BACKOFF = float(os.getenv("DOWNLOAD_BACKOFF", "1.0"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "300"))
+# Oltre questa dimensione (byte) un archivio scaricato passa dalla memoria al disco
+DOWNLOAD_SPOOL_MAX_SIZE = int(os.getenv("DOWNLOAD_SPOOL_MAX_SIZE", str(4 * 1024 * 1024)))
+
+# Import massivo: righe per executemany e cache di SQLite (KiB) durante il caricamento
+IMPORT_BATCH_SIZE = int(os.getenv("IMPORT_BATCH_SIZE", "10000"))
+IMPORT_CACHE_SIZE_KIB = int(os.getenv("IMPORT_CACHE_SIZE_KIB", str(256 * 1024)))
+# Processi che analizzano gli archivi (1 = nel processo stesso) e batch analizzati in attesa di scrittura
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", str(max(1, (os.cpu_count() or 1) - 1))))
+IMPORT_QUEUE_SIZE = int(os.getenv("IMPORT_QUEUE_SIZE", "8"))
+
+# Snapshot mappato in memoria dei CAP, condiviso da tutti i processi che servono i dati ("" = disabilitato);
+# di default accanto al database, così anche l'autocompletamento è servito dalla memoria
+SNAPSHOT_PATH = os.getenv("SNAPSHOT_PATH", str(DB_PATH.with_suffix(".snap")))
+
+# Un database aggiornato non viene pubblicato se ha meno di questa frazione delle righe attuali
+REFRESH_MIN_ROW_RATIO = float(os.getenv("REFRESH_MIN_ROW_RATIO", "0.9"))
+
 
 # --- Funzioni di Inizializzazione ---
 
 def create_tables(con):
-    """Creates all necessary tables in the database."""
+    """Creates all necessary tables in the database and brings them to the latest schema."""
     cur = con.cursor()
     # Countries table
     cur.execute("""
@@ -60,84 +96,825 @@ def create_tables(con):
     # Create an index for faster lookups by postal code
     cur.execute("CREATE INDEX IF NOT EXISTS idx_postal_code ON postal_codes (postal_code)")
     con.commit()
+    migrate(con)
+
 
+# --- Migrazioni dello schema ---
 
-def sync_postal_codes(con):
+def get_schema_version(con) -> int:
+    """Returns the schema version of the database, 0 if it was never migrated."""
+    con.execute("CREATE TABLE IF NOT EXISTS schema_version (version INTEGER NOT NULL)")
+    row = con.execute("SELECT MAX(version) FROM schema_version").fetchone()
+    return row[0] or 0
+
+
+def create_search_index(cur):
     """
-    Downloads postal code data from GeoNames and inserts it into the SQLite database.
+    Creates the FTS5 trigram index on folded place names used by substring searches.
+
+    The index is an external-content table over postal_codes, so it only stores
+    the trigrams; triggers keep it aligned with every insert/delete on the base
+    table, including the per-country replace done by sync_postal_codes.
+    """
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS postal_codes_fts USING fts5 (
+            place_key,
+            content='postal_codes',
+            content_rowid='rowid',
+            tokenize='trigram'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_ai AFTER INSERT ON postal_codes BEGIN
+            INSERT INTO postal_codes_fts (rowid, place_key) VALUES (new.rowid, new.place_key);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_ad AFTER DELETE ON postal_codes BEGIN
+            INSERT INTO postal_codes_fts (postal_codes_fts, rowid, place_key)
+            VALUES ('delete', old.rowid, old.place_key);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_au AFTER UPDATE OF place_key ON postal_codes BEGIN
+            INSERT INTO postal_codes_fts (postal_codes_fts, rowid, place_key)
+            VALUES ('delete', old.rowid, old.place_key);
+            INSERT INTO postal_codes_fts (rowid, place_key) VALUES (new.rowid, new.place_key);
+        END
+    """)
+
+
+def drop_search_index(cur):
+    for trigger in ("postal_codes_ai", "postal_codes_ad", "postal_codes_au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute("DROP TABLE IF EXISTS postal_codes_fts")
+
+
+def rebuild_search_index(con):
+    """Rebuilds the trigram index from the current content of postal_codes."""
+    con.execute("INSERT INTO postal_codes_fts (postal_codes_fts) VALUES ('rebuild')")
+
+
+def create_spatial_index(cur):
     """
-    logger.info(f"Starting postal code sync from {GEONAMES_ZIP_URL}")
+    Creates the R*Tree over postal code coordinates used by reverse geocoding.
+
+    Each row with coordinates is a point box keyed by its postal_codes rowid;
+    triggers keep the tree aligned with the base table like the trigram index.
+    """
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS postal_codes_rtree USING rtree (
+            id, min_lat, max_lat, min_lon, max_lon
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_rtree_ai AFTER INSERT ON postal_codes
+        WHEN new.latitude IS NOT NULL AND new.longitude IS NOT NULL BEGIN
+            INSERT INTO postal_codes_rtree VALUES (
+                new.rowid, new.latitude, new.latitude, new.longitude, new.longitude);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_rtree_ad AFTER DELETE ON postal_codes BEGIN
+            DELETE FROM postal_codes_rtree WHERE id = old.rowid;
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS postal_codes_rtree_au
+        AFTER UPDATE OF latitude, longitude ON postal_codes BEGIN
+            DELETE FROM postal_codes_rtree WHERE id = old.rowid;
+            INSERT INTO postal_codes_rtree
+            SELECT new.rowid, new.latitude, new.latitude, new.longitude, new.longitude
+            WHERE new.latitude IS NOT NULL AND new.longitude IS NOT NULL;
+        END
+    """)
+
+
+def drop_spatial_index(cur):
+    for trigger in ("postal_codes_rtree_ai", "postal_codes_rtree_ad", "postal_codes_rtree_au"):
+        cur.execute(f"DROP TRIGGER IF EXISTS {trigger}")
+    cur.execute("DROP TABLE IF EXISTS postal_codes_rtree")
+
+
+def rebuild_spatial_index(con):
+    """Fills the R*Tree from the current content of postal_codes."""
+    con.execute("DELETE FROM postal_codes_rtree")
+    con.execute("""
+        INSERT INTO postal_codes_rtree
+        SELECT rowid, latitude, latitude, longitude, longitude FROM postal_codes
+        WHERE latitude IS NOT NULL AND longitude IS NOT NULL
+    """)
+
+
+def create_places_table(cur):
+    """
+    Creates the places table: one row per place name and admin hierarchy of a country.
+
+    A city with dozens of postal codes is a single place, holding the list of
+    its postal codes, their centroid and bounding box. The table is derived
+    from postal_codes by rebuild_places; like postal_codes it has a trigram
+    index on the folded name, kept aligned by triggers.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS places (
+            id INTEGER PRIMARY KEY,
+            country_code TEXT NOT NULL,
+            place_name TEXT NOT NULL,
+            place_key TEXT NOT NULL,
+            state_name TEXT,
+            state_code TEXT,
+            county_name TEXT,
+            county_code TEXT,
+            community_name TEXT,
+            community_code TEXT,
+            postal_codes TEXT NOT NULL,
+            postal_code_count INTEGER NOT NULL,
+            latitude REAL,
+            longitude REAL,
+            min_latitude REAL,
+            min_longitude REAL,
+            max_latitude REAL,
+            max_longitude REAL
+        )
+    """)
+    cur.execute("CREATE INDEX IF NOT EXISTS idx_places_country_place_key ON places (country_code, place_key)")
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS places_fts USING fts5 (
+            place_key,
+            content='places',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS places_ai AFTER INSERT ON places BEGIN
+            INSERT INTO places_fts (rowid, place_key) VALUES (new.id, new.place_key);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS places_ad AFTER DELETE ON places BEGIN
+            INSERT INTO places_fts (places_fts, rowid, place_key) VALUES ('delete', old.id, old.place_key);
+        END
+    """)
+
+
+def create_place_names_table(cur):
+    """
+    Creates place_names: the distinct folded names of each country, with their trigram index.
+
+    The fuzzy search reads its candidates here rather than among the postal
+    codes: one entry per name, and the country is matched by the trigram
+    index itself, through country_tag, so that the names of the other
+    countries are never read. The table is derived from places by
+    rebuild_place_names.
+    """
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS place_names (
+            id INTEGER PRIMARY KEY,
+            country_code TEXT NOT NULL,
+            place_key TEXT NOT NULL,
+            country_tag TEXT GENERATED ALWAYS AS (lower(country_code) || '~') VIRTUAL,
+            UNIQUE (country_code, place_key)
+        )
+    """)
+    # 'it~' is the one trigram of the country_tag of IT: a column filter on it selects the country
+    cur.execute("""
+        CREATE VIRTUAL TABLE IF NOT EXISTS place_names_fts USING fts5 (
+            country_tag,
+            place_key,
+            content='place_names',
+            content_rowid='id',
+            tokenize='trigram'
+        )
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS place_names_ai AFTER INSERT ON place_names BEGIN
+            INSERT INTO place_names_fts (rowid, country_tag, place_key)
+            VALUES (new.id, new.country_tag, new.place_key);
+        END
+    """)
+    cur.execute("""
+        CREATE TRIGGER IF NOT EXISTS place_names_ad AFTER DELETE ON place_names BEGIN
+            INSERT INTO place_names_fts (place_names_fts, rowid, country_tag, place_key)
+            VALUES ('delete', old.id, old.country_tag, old.place_key);
+        END
+    """)
+
+
+def rebuild_place_names(cur, country_code: Optional[str] = None):
+    """Derives the distinct names of ``country_code`` (every country if None) from places."""
+    if country_code is None:
+        cur.execute("DELETE FROM place_names")
+        cur.execute("INSERT INTO place_names (country_code, place_key) "
+                    "SELECT DISTINCT country_code, place_key FROM places")
+    else:
+        cur.execute("DELETE FROM place_names WHERE country_code = ?", (country_code,))
+        cur.execute("INSERT INTO place_names (country_code, place_key) "
+                    "SELECT DISTINCT country_code, place_key FROM places WHERE country_code = ?",
+                    (country_code,))
+
+
+# The postal codes of a group are concatenated in postal code order
+REBUILD_PLACES = """
+    INSERT INTO places (
+        country_code, place_name, place_key,
+        state_name, state_code, county_name, county_code, community_name, community_code,
+        postal_codes, postal_code_count,
+        latitude, longitude, min_latitude, min_longitude, max_latitude, max_longitude
+    )
+    SELECT
+        country_code, place_name, place_key,
+        state_name, state_code, county_name, county_code, community_name, community_code,
+        group_concat(DISTINCT postal_code), COUNT(DISTINCT postal_code),
+        AVG(latitude), AVG(longitude), MIN(latitude), MIN(longitude), MAX(latitude), MAX(longitude)
+    FROM (
+        SELECT * FROM postal_codes
+        WHERE {where} AND place_key IS NOT NULL AND postal_code IS NOT NULL
+        ORDER BY postal_code
+    )
+    GROUP BY country_code, place_name, place_key, state_name, state_code,
+             county_name, county_code, community_name, community_code
+"""
+
+
+def rebuild_places(cur, country_code: Optional[str] = None, after_rowid: int = 0):
+    """
+    Derives the places of ``country_code`` (every country if None) from postal_codes.
+
+    With ``after_rowid`` only postal codes with a greater rowid are read: an
+    import passes the last rowid before its inserts, so that the rows are
+    found by rowid even while the secondary indexes are dropped. The
+    place_names of the country follow.
+    """
+    if country_code is None:
+        cur.execute("DELETE FROM places")
+        cur.execute(REBUILD_PLACES.format(where="rowid > ?"), (after_rowid,))
+    else:
+        cur.execute("DELETE FROM places WHERE country_code = ?", (country_code,))
+        cur.execute(REBUILD_PLACES.format(where="rowid > ? AND country_code = ?"),
+                    (after_rowid, country_code))
+    rebuild_place_names(cur, country_code)
+
+
+def _migration_2(con):
+    """Folded place_key column, country-first composite indexes, trigram index on place_key."""
+    cur = con.cursor()
+    columns = {row[1] for row in cur.execute("PRAGMA table_info(postal_codes)")}
+    if "place_key" not in columns:
+        cur.execute("ALTER TABLE postal_codes ADD COLUMN place_key TEXT")
+    # The old index is dropped first so that the UPDATE does not maintain it
+    drop_search_index(cur)
+    con.create_function("fold", 1, fold, deterministic=True)
+    cur.execute("UPDATE postal_codes SET place_key = fold(place_name)")
+    cur.execute("DROP INDEX IF EXISTS idx_postal_code")
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_postal_codes_country_postal_code
+        ON postal_codes (country_code, postal_code)
+    """)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_postal_codes_country_place_key
+        ON postal_codes (country_code, place_key)
+    """)
+    create_search_index(cur)
+    rebuild_search_index(con)
+
+
+def _migration_3(con):
+    """Key/value metadata table, holding the data generation."""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS metadata (
+            key TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+    """)
+    con.execute("INSERT OR IGNORE INTO metadata (key, value) VALUES ('generation', '0')")
+
+
+def _migration_4(con):
+    """Per-country state of the last import, used by incremental refreshes."""
+    con.execute("""
+        CREATE TABLE IF NOT EXISTS sync_state (
+            country_code TEXT PRIMARY KEY,
+            etag TEXT,
+            last_modified TEXT,
+            sha256 TEXT NOT NULL,
+            row_count INTEGER NOT NULL,
+            synced_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def _migration_5(con):
+    """Typed postal code columns: empty strings stored by older imports become NULL."""
+    con.execute("""
+        UPDATE postal_codes SET
+            state_name = NULLIF(state_name, ''),
+            state_code = NULLIF(state_code, ''),
+            county_name = NULLIF(county_name, ''),
+            county_code = NULLIF(county_code, ''),
+            community_name = NULLIF(community_name, ''),
+            community_code = NULLIF(community_code, ''),
+            latitude = CAST(NULLIF(latitude, '') AS REAL),
+            longitude = CAST(NULLIF(longitude, '') AS REAL),
+            accuracy = CAST(NULLIF(accuracy, '') AS INTEGER)
+        WHERE typeof(latitude) != 'real' OR typeof(longitude) != 'real'
+           OR typeof(accuracy) NOT IN ('integer', 'null')
+           OR '' IN (state_name, state_code, county_name, county_code,
+                     community_name, community_code)
+    """)
+
+
+def _migration_6(con):
+    """R*Tree spatial index on postal code coordinates."""
+    cur = con.cursor()
+    create_spatial_index(cur)
+    rebuild_spatial_index(con)
 
-    try:
-        res = httpx.get(GEONAMES_ZIP_URL)
-        res.raise_for_status()
-    except httpx.RequestError as e:
-        logger.error(f"Could not access the dataset list: {e}")
-        return
 
-    txt = res.content.decode("utf-8")
-    links_all = BeautifulSoup(txt, "html.parser").find_all("a")
-    datasets = [
-        el["href"] for el in links_all
-        if el["href"].endswith(".zip") and el["href"] not in ["GB_full.csv.zip",
-                                                              "allCountries.zip"]
-    ]
+def _migration_7(con):
+    """Places table: postal codes grouped by place name and admin hierarchy."""
+    cur = con.cursor()
+    create_places_table(cur)
+    create_place_names_table(cur)
+    rebuild_places(cur)
+
 
-    logger.info(f"Found {len(datasets)} datasets to sync.")
+def _migration_8(con):
+    """Distinct place names per country, with a trigram index, for the fuzzy search."""
     cur = con.cursor()
+    create_place_names_table(cur)
+    # Coming from version 6 the rebuild of migration 7 has already filled it
+    if cur.execute("SELECT 1 FROM place_names LIMIT 1").fetchone() is None:
+        rebuild_place_names(cur)
+
+
+# Ordered (version, migration) pairs; version 1 is the schema created by create_tables.
+MIGRATIONS = [
+    (2, _migration_2),
+    (3, _migration_3),
+    (4, _migration_4),
+    (5, _migration_5),
+    (6, _migration_6),
+    (7, _migration_7),
+    (8, _migration_8),
+]
+
+SCHEMA_VERSION = MIGRATIONS[-1][0]
 
-    for idx, name_zip in enumerate(datasets):
-        country_code = name_zip.replace(".zip", "")
+
+def migrate(con):
+    """Applies, in order and each in its own transaction, every migration not yet applied."""
+    current = get_schema_version(con)
+    for version, migration in MIGRATIONS:
+        if version <= current:
+            continue
+        logger.info(f"Migrating database schema to version {version}...")
+        con.commit()
+        con.execute("BEGIN")
         try:
-            url = f"{GEONAMES_ZIP_URL}{name_zip}"
-            with httpx.stream("GET", url) as r:
-                r.raise_for_status()
-                zip_content = BytesIO(r.read())
-
-            # Process the zip file entirely in memory
-            with ZipFile(zip_content) as zf:
-                name_txt = f"{country_code}.txt"
-                # Open the text file from the zip and wrap it for text-mode reading
-                with zf.open(name_txt, "r") as fh_in_binary:
-                    fh_in_text = TextIOWrapper(fh_in_binary, 'utf-8')
-                    # Use csv.reader for robust TSV parsing
-                    reader = csv.reader(fh_in_text, delimiter='\t')
-
-                    # Delete old data for this country for a clean import
-                    cur.execute("DELETE FROM postal_codes WHERE country_code = ?",
-                                (country_code,))
-
-                    # Use executemany for a fast bulk insert
-                    cur.executemany(
-                        """INSERT INTO postal_codes (
-                            country_code, postal_code, place_name,
-                            state_name, state_code,
-                            county_name, county_code,
-                            community_name, community_code,
-                            latitude, longitude, accuracy
-                        ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
-                        reader
-                    )
+            migration(con)
+            con.execute("INSERT INTO schema_version (version) VALUES (?)", (version,))
+            con.commit()
+        except sqlite3.Error:
+            con.rollback()
+            raise
+        current = version
+    return current
+
+
+def get_generation(con) -> int:
+    """Returns the data generation: a counter bumped by every sync of the data."""
+    row = con.execute("SELECT value FROM metadata WHERE key = 'generation'").fetchone()
+    return int(row[0]) if row else 0
+
+
+def bump_generation(con) -> int:
+    con.execute(
+        "UPDATE metadata SET value = CAST(value AS INTEGER) + 1 WHERE key = 'generation'"
+    )
+    return get_generation(con)
+
+
+def is_build_complete(con) -> bool:
+    """False while the first import of a new database has not finished; older databases are complete."""
+    row = con.execute("SELECT value FROM metadata WHERE key = 'build_complete'").fetchone()
+    return row is None or row[0] == "1"
+
+
+def set_build_complete(con, complete: bool):
+    con.execute("INSERT OR REPLACE INTO metadata (key, value) VALUES ('build_complete', ?)",
+                (str(int(complete)),))
 
-            logger.info(
-                f"  .. [{idx + 1:02}/{len(datasets)}] Synced {cur.rowcount} records for {country_code}")
 
-        except httpx.RequestError as e:
-            logger.error(f"Error downloading {name_zip}: {e}")
-        except KeyError:
-            logger.warning(f"File .txt not found in zip {name_zip}")
-        except Exception as e:
-            logger.error(f"An unexpected error occurred with {name_zip}: {e}")
+INSERT_POSTAL_CODE = """INSERT INTO postal_codes (
+    country_code, postal_code, place_name,
+    state_name, state_code,
+    county_name, county_code,
+    community_name, community_code,
+    latitude, longitude, accuracy,
+    place_key
+) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"""
 
+
+def _real(value) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+
+def _coordinate(value, limit: float) -> Optional[float]:
+    number = _real(value)
+    if number is None or not -limit <= number <= limit:
+        return None
+    return number
+
+
+def _integer(value) -> Optional[int]:
+    if value is None or value == "":
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        return None
+
+
+def coerce_row(row) -> tuple:
+    """
+    Types a GeoNames TSV row for postal_codes and appends its folded search key.
+
+    Empty fields become NULL, coordinates REAL and accuracy INTEGER, instead
+    of the strings read from the archive; out of range coordinates are NULL.
+    """
+    if len(row) < 12:
+        row = (*row, *("",) * (12 - len(row)))
+    (country_code, postal_code, place_name, state_name, state_code, county_name,
+     county_code, community_name, community_code, latitude, longitude, accuracy) = row[:12]
+    return (
+        country_code, postal_code, place_name,
+        state_name or None, state_code or None,
+        county_name or None, county_code or None,
+        community_name or None, community_code or None,
+        _coordinate(latitude, 90), _coordinate(longitude, 180), _integer(accuracy),
+        fold(place_name),
+    )
+
+
+def iter_batches(rows, size: int = None):
+    """Coerces rows with coerce_row and groups them in lists of at most ``size``."""
+    size = size or IMPORT_BATCH_SIZE
+    batch = []
+    for row in rows:
+        batch.append(coerce_row(row))
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def insert_postal_codes(cur, rows) -> int:
+    """
+    Bulk inserts GeoNames rows into postal_codes; returns the number of rows inserted.
+
+    The places of the countries of the rows are rebuilt afterwards.
+    """
+    count = 0
+    countries = set()
+    for batch in iter_batches(rows):
+        cur.executemany(INSERT_POSTAL_CODE, batch)
+        countries.update(row[0] for row in batch)
+        count += len(batch)
+    for country_code in sorted(countries):
+        rebuild_places(cur, country_code)
+    return count
+
+
+# Indexes on postal_codes other than the trigram and spatial indexes, dropped by a bulk load
+SECONDARY_INDEXES = {
+    "idx_postal_codes_country_postal_code": "postal_codes (country_code, postal_code)",
+    "idx_postal_codes_country_place_key": "postal_codes (country_code, place_key)",
+}
+
+
+def drop_secondary_indexes(cur):
+    for name in SECONDARY_INDEXES:
+        cur.execute(f"DROP INDEX IF EXISTS {name}")
+    drop_search_index(cur)
+    drop_spatial_index(cur)
+
+
+def create_secondary_indexes(con):
+    cur = con.cursor()
+    for name, target in SECONDARY_INDEXES.items():
+        cur.execute(f"CREATE INDEX IF NOT EXISTS {name} ON {target}")
+    if not cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'postal_codes_fts'").fetchone():
+        create_search_index(cur)
+        rebuild_search_index(con)
+    if not cur.execute(
+            "SELECT 1 FROM sqlite_master WHERE name = 'postal_codes_rtree'").fetchone():
+        create_spatial_index(cur)
+        rebuild_spatial_index(con)
+
+
+def set_journal_mode(con, mode: str) -> str:
+    """Switches journal mode if possible; other open connections can prevent it."""
+    try:
+        return con.execute(f"PRAGMA journal_mode = {mode}").fetchone()[0]
+    except sqlite3.OperationalError as e:
+        current = con.execute("PRAGMA journal_mode").fetchone()[0]
+        logger.info(f"Keeping journal_mode={current}, cannot switch to {mode}: {e}")
+        return current
+
+
+@contextmanager
+def import_mode(con, defer_indexes: bool = False):
+    """
+    Tunes ``con`` for a bulk load of postal codes for the duration of the block.
+
+    The load runs in WAL mode with synchronous=OFF and a large page cache: a
+    crash mid-build just means building again. With ``defer_indexes`` the
+    secondary, trigram and spatial indexes are dropped before the load and
+    rebuilt once after it, instead of being updated row by row; only do that
+    when nobody queries the database during the load. On exit the database
+    goes back to the rollback journal, so that the file can be published by
+    a rename, unless readers still hold it open.
+    """
     con.commit()
-    logger.info("Postal code sync complete.")
+    set_journal_mode(con, "WAL")
+    con.execute("PRAGMA synchronous = OFF")
+    con.execute(f"PRAGMA cache_size = -{int(IMPORT_CACHE_SIZE_KIB)}")
+    con.execute("PRAGMA temp_store = MEMORY")
+    if defer_indexes:
+        drop_secondary_indexes(con.cursor())
+        con.commit()
+    try:
+        yield con
+    finally:
+        if defer_indexes:
+            logger.info("Building indexes...")
+            create_secondary_indexes(con)
+        con.commit()
+        con.execute("PRAGMA synchronous = FULL")
+        con.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        set_journal_mode(con, "DELETE")
+
+
+def iter_archive_lines(archive, country_code: str, size: int = None):
+    """
+    Yields the lines of the country file of a GeoNames zip, in lists of ``size``.
+
+    ``archive`` is a path or a binary file object of the zip.
+    """
+    size = size or IMPORT_BATCH_SIZE
+    with ZipFile(archive) as zf:
+        # Open the text file from the zip and wrap it for text-mode reading
+        with zf.open(f"{country_code}.txt", "r") as fh_in_binary:
+            fh_in_text = TextIOWrapper(fh_in_binary, 'utf-8')
+            while lines := list(islice(fh_in_text, size)):
+                yield lines
+
+
+def parse_lines(lines) -> list:
+    """
+    Parses GeoNames TSV lines into typed rows for postal_codes (see coerce_row).
+
+    Runs in the import worker processes: it only depends on its argument.
+    The dumps are plain TSV, so quotes are data and a row never spans lines.
+    """
+    reader = csv.reader(lines, delimiter='\t', quoting=csv.QUOTE_NONE)
+    return [coerce_row(row) for row in reader if row]
+
+
+def iter_parsed(chunks, pool: Executor, ahead: int):
+    """
+    Parses chunks of lines in ``pool``, yielding the batches in order.
+
+    At most ``ahead`` chunks are submitted before the oldest is consumed, so
+    a slow writer holds back the readers instead of letting parsed rows pile
+    up in memory.
+    """
+    pending = deque()
+    try:
+        for lines in chunks:
+            pending.append(pool.submit(parse_lines, lines))
+            if len(pending) >= ahead:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+
+@contextmanager
+def import_pool(workers: int):
+    """
+    Process pool parsing the archives of an import; None with a single worker.
+
+    Workers are spawned rather than forked: the downloader threads are
+    already running when the pool starts.
+    """
+    if workers <= 1:
+        yield None
+        return
+    pool = ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        yield pool
+    finally:
+        pool.shutdown(cancel_futures=True)
 
 
-def create_country_database(con):
+def import_country_lines(cur, country_code: str, chunks,
+                         pool: Optional[Executor] = None) -> int:
+    """
+    Replaces the rows of one country with ``chunks``, lists of its GeoNames TSV lines.
+
+    The lines are parsed in ``pool`` when given, otherwise here; either way
+    the rows are inserted through ``cur`` only, in file order. Returns the
+    number of rows imported. The places of the country are rebuilt from
+    the new rows.
+    """
+    if pool is None:
+        batches = map(parse_lines, chunks)
+    else:
+        batches = iter_parsed(chunks, pool, ahead=IMPORT_QUEUE_SIZE)
+
+    # Delete old data for this country for a clean import
+    cur.execute("DELETE FROM postal_codes WHERE country_code = ?", (country_code,))
+    # New rows get rowids above the current maximum
+    last_rowid = cur.execute("SELECT COALESCE(MAX(rowid), 0) FROM postal_codes").fetchone()[0]
+    count = 0
+    for batch in batches:
+        cur.executemany(INSERT_POSTAL_CODE, batch)
+        count += len(batch)
+    rebuild_places(cur, country_code, last_rowid)
+    return count
+
+
+def import_country_archive(cur, country_code: str, archive,
+                           pool: Optional[Executor] = None) -> int:
+    """
+    Replaces the rows of one country with the content of its GeoNames archive.
+
+    ``archive`` is a path or a binary file object of the zip; see
+    import_country_lines.
+    """
+    return import_country_lines(cur, country_code, iter_archive_lines(archive, country_code), pool)
+
+
+def load_sync_state(con) -> Dict[str, Tuple[Validators, str]]:
+    """Validators and SHA-256 of the last imported archive of each country."""
+    return {
+        country_code: (Validators(etag, last_modified), sha256)
+        for country_code, etag, last_modified, sha256 in con.execute(
+            "SELECT country_code, etag, last_modified, sha256 FROM sync_state")
+    }
+
+
+def save_sync_state(con, archive: Archive, row_count: Optional[int] = None):
+    """Records the archive just seen for a country; row_count None keeps the current one."""
+    con.execute("""
+        INSERT INTO sync_state (country_code, etag, last_modified, sha256, row_count)
+        VALUES (?, ?, ?, ?, COALESCE(?, 0))
+        ON CONFLICT (country_code) DO UPDATE SET
+            etag = excluded.etag,
+            last_modified = excluded.last_modified,
+            sha256 = excluded.sha256,
+            row_count = COALESCE(?, row_count),
+            synced_at = CURRENT_TIMESTAMP
+    """, (archive.country_code, archive.validators.etag, archive.validators.last_modified,
+          archive.sha256, row_count, row_count))
+
+
+def sync_postal_codes(con, source: str = None, concurrency: int = None,
+                      refresh: bool = False,
+                      on_imported: Optional[Callable[[str, int], None]] = None,
+                      defer_indexes: bool = False, workers: int = None) -> bool:
+    """
+    Downloads postal code data from GeoNames and inserts it into the SQLite database.
+
+    ``source`` is the URL of the GeoNames export or a local directory with a
+    copy of it (see mirror.iter_local_archives); POSTAL_CODES_SOURCE by
+    default. Archives are downloaded concurrently (see download.iter_archives)
+    and imported one at a time, in completion order, through this connection.
+    Every country is committed as soon as it is imported, so readers can
+    use it while the others are still loading; ``on_imported(country_code,
+    total)`` is called after each commit.
+
+    The ETag, Last-Modified and SHA-256 of every imported archive are stored
+    in sync_state. With ``refresh`` those are used to skip unchanged
+    countries: archives are requested conditionally, and one downloaded with
+    the same SHA-256 as last time is not imported again.
+
+    The load runs under import_mode; ``defer_indexes`` is meant for full
+    builds that nobody reads until they complete. Archive lines are parsed
+    by a pool of ``workers`` processes (IMPORT_WORKERS by default), while
+    this thread remains the only writer of the database.
+
+    Returns True if every country was imported or found unchanged, False if
+    the dataset list could not be read or some archives failed.
+    """
+    source = source or POSTAL_CODES_SOURCE
+    logger.info(f"Starting postal code {'refresh' if refresh else 'sync'} from {source}")
+    cur = con.cursor()
+    state = load_sync_state(con) if refresh else {}
+    imported = unchanged = failed = 0
+    if is_local_source(source):
+        archives = iter_local_archives(pathlib.Path(source), IMPORT_BATCH_SIZE)
+    else:
+        archives = iter_archives(
+            source,
+            concurrency=concurrency or DOWNLOAD_CONCURRENCY,
+            retries=DOWNLOAD_RETRIES,
+            backoff=DOWNLOAD_BACKOFF,
+            timeout=DOWNLOAD_TIMEOUT,
+            spool_max_size=DOWNLOAD_SPOOL_MAX_SIZE,
+            known={f"{cc}.zip": validators for cc, (validators, _) in state.items()},
+        )
+    with import_mode(con, defer_indexes), import_pool(workers or IMPORT_WORKERS) as pool:
+        try:
+            for idx, archive in enumerate(archives):
+                if idx == 0 and archive.total is not None:
+                    logger.info(f"Found {archive.total} datasets to sync.")
+                name_zip = archive.name
+                try:
+                    if archive.error is not None:
+                        raise archive.error
+                    if archive.not_modified or (
+                            archive.country_code in state
+                            and state[archive.country_code][1] == archive.sha256):
+                        if not archive.not_modified:
+                            save_sync_state(con, archive)
+                        unchanged += 1
+                        logger.info(
+                            f"  .. [{idx + 1:02}/{archive.total or '?'}] {archive.country_code} unchanged")
+                        continue
+                    if archive.lines is not None:
+                        count = import_country_lines(cur, archive.country_code, archive.lines, pool)
+                    else:
+                        # The zip is read from its spool file and its rows streamed into the insert
+                        count = import_country_archive(cur, archive.country_code, archive.file, pool)
+                    save_sync_state(con, archive, count)
+                    con.commit()
+                    imported += 1
+                    if on_imported is not None:
+                        on_imported(archive.country_code, archive.total)
+                    logger.info(
+                        f"  .. [{idx + 1:02}/{archive.total or '?'}] Synced {count} records for {archive.country_code}")
+
+                except httpx.HTTPError as e:
+                    failed += 1
+                    logger.error(f"Error downloading {name_zip}: {e}")
+                except KeyError:
+                    failed += 1
+                    con.rollback()
+                    logger.warning(f"File .txt not found in zip {name_zip}")
+                except Exception as e:
+                    failed += 1
+                    # Do not let a half-imported country be committed with the next one
+                    con.rollback()
+                    logger.error(f"An unexpected error occurred with {name_zip}: {e}")
+                finally:
+                    archive.close()
+        except (httpx.HTTPError, OSError, ValueError) as e:
+            # ValueError: an allCountries dump that is not ordered by country
+            logger.error(f"Could not access the dataset list: {e}")
+            return False
+
+    generation = bump_generation(con) if imported else get_generation(con)
+    con.commit()
+    logger.info(f"Postal code sync complete: {imported} countries imported, "
+                f"{unchanged} unchanged, {failed} failed (data generation {generation}).")
+    return failed == 0
+
+
+def load_country_info(lang: str, source: str) -> dict:
+    """
+    The countryInfoJSON answer of the GeoNames API for ``lang``.
+
+    With a local ``source`` it is read from the countryInfo-<lang>.json file
+    saved there instead.
+    """
+    if is_local_source(source):
+        return json.loads((pathlib.Path(source) / f"countryInfo-{lang}.json").read_text("utf-8"))
+    params = {'lang': lang, 'username': GEONAMES_USERNAME}
+    # Usa httpx per la chiamata API
+    res = httpx.get(f"{GEONAMES_API_URL}countryInfoJSON", params=params)
+    res.raise_for_status()
+    return res.json()
+
+
+def create_country_database(con, source: str = None):
     """
     Crea il database SQLite 'countries.db' e lo popola con i dati
-    delle nazioni in italiano e inglese, chiamando l'API di GeoNames.
+    delle nazioni in italiano e inglese, chiamando l'API di GeoNames
+    (o leggendone le risposte salvate in una ``source`` locale).
     """
+    source = source or POSTAL_CODES_SOURCE
     logger.info(f"Start creation and population database SQLite  {DB_PATH}")
 
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
@@ -146,12 +923,8 @@ def create_country_database(con):
         cur = con.cursor()
         for lang in ['it', 'en']:
             logger.info(f"Retreive nations pfor lang: '{lang}'")
-            params = {'lang': lang, 'username': GEONAMES_USERNAME}
             try:
-                # Usa httpx per la chiamata API
-                res = httpx.get(f"{GEONAMES_API_URL}countryInfoJSON", params=params)
-                res.raise_for_status()
-                data = res.json()
+                data = load_country_info(lang, source)
 
                 countries_to_insert = [
                     (c['country_code'], c['country_name'], lang)
@@ -178,20 +951,209 @@ def create_country_database(con):
         logger.error(f"Errore del database SQLite: {e}")
 
 
+# --- Snapshot mappato in memoria ---
+
+def snapshot_is_current(con, snapshot_path: pathlib.Path) -> bool:
+    """True if ``snapshot_path`` is a readable snapshot of the current generation of ``con``."""
+    try:
+        current = Snapshot(snapshot_path)
+    except (OSError, ValueError):
+        return False
+    try:
+        return current.generation == get_generation(con)
+    finally:
+        current.close()
+
+
+def export_snapshot(con, snapshot_path: pathlib.Path) -> pathlib.Path:
+    """
+    Exports the postal codes of ``con`` to a memory-mapped snapshot (see snapshot.py).
+
+    The file is written next to ``snapshot_path`` and renamed over it, so
+    processes that have the old one mapped keep reading it until they reopen
+    the path.
+    """
+    snapshot_path = pathlib.Path(snapshot_path)
+    partial_path = snapshot_path.with_name(snapshot_path.name + ".partial")
+    try:
+        write_snapshot(con, partial_path, get_generation(con))
+        os.replace(partial_path, snapshot_path)
+    finally:
+        partial_path.unlink(missing_ok=True)
+    logger.info(f"Exported snapshot {snapshot_path} ({snapshot_path.stat().st_size} bytes).")
+    return snapshot_path
+
+
+def sync_snapshot(con, snapshot_path: str = None):
+    """Exports the snapshot to ``snapshot_path`` (default SNAPSHOT_PATH) unless it is disabled or current."""
+    snapshot_path = SNAPSHOT_PATH if snapshot_path is None else snapshot_path
+    if snapshot_path and not snapshot_is_current(con, pathlib.Path(snapshot_path)):
+        export_snapshot(con, pathlib.Path(snapshot_path))
+
+
+# --- Aggiornamento a caldo ---
+
+def verify_database(path: pathlib.Path, min_postal_codes: int = 1):
+    """Raises ValueError if the database at ``path`` is corrupt or has too few rows."""
+    with closing(sqlite3.connect(path)) as con:
+        result = con.execute("PRAGMA integrity_check").fetchone()[0]
+        if result != "ok":
+            raise ValueError(f"integrity_check failed on {path}: {result}")
+        postal_codes = con.execute("SELECT COUNT(*) FROM postal_codes").fetchone()[0]
+        countries = con.execute("SELECT COUNT(*) FROM countries").fetchone()[0]
+    if postal_codes < max(min_postal_codes, 1):
+        raise ValueError(f"{path} has {postal_codes} postal codes, expected {min_postal_codes}")
+    if countries < 1:
+        raise ValueError(f"{path} has no countries")
+
+
+def refresh_database(db_path: pathlib.Path = DB_PATH, source: str = None) -> bool:
+    """
+    Refreshes the data without touching the live database until the new one is ready.
+
+    The live file is copied with the SQLite backup API into a shadow file next
+    to it, the shadow is refreshed incrementally and verified (integrity_check,
+    and at least REFRESH_MIN_ROW_RATIO of the live postal codes), then renamed
+    over the live file. The rename is atomic: readers keep the old file open
+    until they reopen the path. Returns True if a new generation was published.
+    """
+    shadow_path = db_path.with_name(db_path.name + ".shadow")
+    shadow_path.unlink(missing_ok=True)
+    try:
+        with closing(sqlite3.connect(db_path)) as live, \
+                closing(sqlite3.connect(shadow_path)) as shadow:
+            live_rows = live.execute("SELECT COUNT(*) FROM postal_codes").fetchone()[0]
+            live.backup(shadow)
+            migrate(shadow)
+            generation = get_generation(shadow)
+            sync_postal_codes(shadow, source, refresh=True)
+            if get_generation(shadow) == generation:
+                logger.info("Refresh found no changes, keeping the live database.")
+                return False
+        verify_database(shadow_path, int(live_rows * REFRESH_MIN_ROW_RATIO))
+        os.replace(shadow_path, db_path)
+        logger.info(f"Published refreshed database {db_path}.")
+        with closing(sqlite3.connect(db_path)) as live:
+            sync_snapshot(live)
+        return True
+    finally:
+        shadow_path.unlink(missing_ok=True)
+
+
 # --- Esecuzione Principale ---
 
+def resume_build(con, on_ready: Optional[Callable[[], None]] = None,
+                 on_imported: Optional[Callable[[str, int], None]] = None,
+                 source: str = None):
+    """
+    Finishes the first import of a database that was interrupted, e.g. by a killed process.
+
+    Every country is committed together with its sync_state row, so the
+    import resumes as a refresh: the countries without one are imported,
+    the others only if their archive changed since. ``on_imported`` is
+    first called for the countries already there. A load killed with its
+    indexes deferred left them dropped: they are rebuilt before
+    ``on_ready`` if readers come in during the import, otherwise at its end.
+    """
+    logger.info("===== RESUME INIT DATA =====")
+    if not con.execute("SELECT 1 FROM countries LIMIT 1").fetchone():
+        create_country_database(con, source)
+    if on_ready is not None:
+        create_secondary_indexes(con)
+        con.commit()
+        on_ready()
+    if on_imported is not None:
+        for country_code in load_sync_state(con):
+            on_imported(country_code, None)
+    complete = sync_postal_codes(con, source, refresh=True, on_imported=on_imported,
+                                 defer_indexes=on_ready is None)
+    set_build_complete(con, complete)
+    con.commit()
+    sync_snapshot(con)
+    logger.info("===== INIT DATA COMPLETED =====" if complete else
+                "===== INIT DATA INCOMPLETE, RESUMED AT THE NEXT START =====")
+
+
 
-def check_and_sync():
-    """Funzione principale che orchestra l'inizializzazione dei dati."""
+def check_and_sync(refresh: bool = False,
+                   on_ready: Optional[Callable[[], None]] = None,
+                   on_imported: Optional[Callable[[str, int], None]] = None,
+                   source: str = None) -> bool:
+    """
+    Funzione principale che orchestra l'inizializzazione dei dati.
+
+    With ``refresh`` an existing database is updated in place, re-importing
+    only the countries whose archive changed since the last sync.
+
+    A new database is flagged complete (see is_build_complete) only once
+    every country is imported: if the process is killed before, or some
+    countries fail, the next call resumes the import (see resume_build)
+    instead of serving the partial data as if it were complete.
+
+    ``on_ready`` is called as soon as the database can be opened for reading
+    (schema and countries in place), which for a new database is long before
+    the postal codes are loaded; ``on_imported`` is passed to
+    sync_postal_codes, like ``source``. Returns True if a new database was
+    built or its import resumed.
+    """
     if not DB_PATH.is_file():
         logger.info("===== START INIT DATA  =====")
-        with sqlite3.connect(DB_PATH) as con:
+        with closing(sqlite3.connect(DB_PATH)) as con:
             logger.info(f"Database opened at {DB_PATH}")
             create_tables(con)  # Create all tables first
-            create_country_database(con)
-            # Now run the sync functions
-            sync_postal_codes(con)
+            set_build_complete(con, False)
+            con.commit()
+            create_country_database(con, source)
+            if on_ready is not None:
+                on_ready()
+            # Now run the sync functions; indexes can only be deferred if nobody
+            # reads the countries already imported while the others load
+            complete = sync_postal_codes(con, source, on_imported=on_imported,
+                                         defer_indexes=on_ready is None)
+            set_build_complete(con, complete)
+            con.commit()
+            sync_snapshot(con)
 
-        logger.info("===== INIT DATA COMPLETED =====")
+        logger.info("===== INIT DATA COMPLETED =====" if complete else
+                    "===== INIT DATA INCOMPLETE, RESUMED AT THE NEXT START =====")
+        return True
     else:
         logger.info("===== DATA ALREADY EXISTS =====")
+        with closing(sqlite3.connect(DB_PATH)) as con:
+            # Bring databases built by older releases to the current schema
+            migrate(con)
+            if not is_build_complete(con):
+                resume_build(con, on_ready, on_imported, source)
+                return True
+            # Before on_ready, so that the store maps a snapshot of the data it opens
+            sync_snapshot(con)
+            if on_ready is not None:
+                on_ready()
+            if refresh:
+                logger.info("===== START DATA REFRESH =====")
+                sync_postal_codes(con, source, refresh=True, on_imported=on_imported)
+                sync_snapshot(con)
+                logger.info("===== DATA REFRESH COMPLETED =====")
+        return False
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Builds or refreshes the GeoNames database.")
+    parser.add_argument("--refresh", action="store_true",
+                        help="re-import only the countries whose archive changed")
+    parser.add_argument("--source", default=POSTAL_CODES_SOURCE,
+                        help="URL of the GeoNames export or directory with a copy of it")
+    parser.add_argument("--offline", dest="source", action="store_const",
+                        const=str(POSTAL_CODES_DIR),
+                        help=f"import from POSTAL_CODES_DIR ({POSTAL_CODES_DIR})")
+    parser.add_argument("--export-snapshot", metavar="PATH",
+                        help="write a memory-mapped snapshot of the data to PATH (see SNAPSHOT_PATH)")
+    args = parser.parse_args()
+    logging.basicConfig(format="%(asctime)-15s %(levelname)-8s %(message)s",
+                        level=logging.INFO)
+    check_and_sync(refresh=args.refresh, source=args.source)
+    if args.export_snapshot:
+        with closing(sqlite3.connect(DB_PATH)) as con:
+            export_snapshot(con, pathlib.Path(args.export_snapshot))
@@ -1,17 +1,32 @@
+import asyncio
+import functools
 import logging
+import os
 import pathlib
+import time
 from collections.abc import AsyncIterator
 from contextlib import asynccontextmanager
-from typing import Union, List, Any
+from typing import Union, List, Any, Dict, Optional
 
-import aiosqlite  # Importa la libreria per SQLite asincrono
 from fastmcp import FastMCP
 from fastmcp.server.dependencies import get_context
 from mcp.server.lowlevel.server import LifespanResultT
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse
 
-from initdata import check_and_sync
-from services import PostalCode, Country, get_cities, get_countries, \
-    get_postal_code
+from admission import CallLimiter, DeadlineExceeded, parse_timeouts, run_interruptible
+from cache import ResultCache
+from datastore import DataStore, WarmingUp
+from indexes import CountryIndex
+from initdata import SNAPSHOT_PATH, check_and_sync, refresh_database
+from metrics import Metrics
+from pool import ConnectionPool
+from profiling import RequestProfiler, SlowQueryLog
+from services import PostalCode, Country, NearbyPostalCode, Place, PlacesPage, PostalCodeLookup, \
+    PostalCodeLocations, ScoredPostalCode, get_cities, get_fuzzy_cities, get_places_by_name, \
+    get_postal_code, get_postal_codes, get_nearest_postal_codes, get_places_near, get_places_in_box, \
+    get_places_by_prefix, get_places_by_prefix_from_snapshot, get_cities_from_snapshot, \
+    get_postal_code_from_snapshot, cities_cache_key, postal_code_cache_key, project, select_fields
 
 logging.basicConfig(format="%(asctime)-15s %(levelname)-8s %(message)s",
                     level=logging.INFO)
@@ -24,69 +39,293 @@ DATA_DIR = pathlib.Path(__file__).parent.resolve()
 POSTAL_CODES_DIR = DATA_DIR / "data"
 DB_PATH = DATA_DIR / "countries.db"
 
+# Read-only connections shared by the tools
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "4"))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024)))
+DB_CACHE_SIZE_KIB = int(os.getenv("DB_CACHE_SIZE_KIB", str(16 * 1024)))
+
+# Result cache for postal code and city lookups (TTL in seconds, 0 = no expiry)
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_TTL = float(os.getenv("CACHE_TTL", "0"))
+
+# Codici postali risolti da una singola chiamata a get_locations_by_postal_codes
+MAX_BATCH_ITEMS = int(os.getenv("MAX_BATCH_ITEMS", "1000"))
+# 'limit' massimo dei tool di ricerca; i valori più grandi vengono ridotti a questo
+MAX_LIMIT = int(os.getenv("MAX_LIMIT", "100"))
+
+# Aggiornamento a caldo dei dati ogni REFRESH_INTERVAL secondi (0 = disabilitato)
+REFRESH_INTERVAL = float(os.getenv("REFRESH_INTERVAL", "0"))
+# Tool di amministrazione (es. refresh_data), da non esporre ad agenti non fidati
+ENABLE_ADMIN_TOOLS = os.getenv("ENABLE_ADMIN_TOOLS", "0") == "1"
+
+# Query più lente di SLOW_QUERY_MS millisecondi registrate con SQL, piano e passi della VM (0 = disabilitato)
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "500"))
+# Frazione delle chiamate ai tool profilate con cProfile (0 = nessuna), modificabile con set_profiling
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = pathlib.Path(os.getenv("PROFILE_DIR", str(DATA_DIR / "profiles")))
+
+# Chiamate ai tool eseguite insieme e in coda; oltre la coda le chiamate sono rifiutate subito
+MAX_CONCURRENT_CALLS = int(os.getenv("MAX_CONCURRENT_CALLS", "16"))
+MAX_QUEUED_CALLS = int(os.getenv("MAX_QUEUED_CALLS", "64"))
+# Secondi concessi a una chiamata, attesa in coda inclusa (0 = nessun limite), poi la query viene interrotta;
+# TOOL_TIMEOUTS li cambia per tool, es. "find_cities_by_name=2,get_locations_by_postal_codes=10"
+TOOL_TIMEOUT = float(os.getenv("TOOL_TIMEOUT", "5"))
+TOOL_TIMEOUTS = parse_timeouts(os.getenv("TOOL_TIMEOUTS", ""))
+
+
+# Stato dei dati del processo, letto anche dagli endpoint di health check
+_store: Optional[DataStore] = None
+# Metriche dei tool e delle query, esposte su /metrics e come risorsa MCP
+METRICS = Metrics()
+PROFILER = RequestProfiler(PROFILE_DIR, PROFILE_SAMPLE_RATE)
+SLOW_QUERIES = SlowQueryLog()
+LIMITER = CallLimiter(MAX_CONCURRENT_CALLS, MAX_QUEUED_CALLS, TOOL_TIMEOUT, TOOL_TIMEOUTS)
+
 
 # --- NUOVA GESTIONE LIFESPAN CON SQLITE ---
 @asynccontextmanager
 async def app_lifespan(server: FastMCP[LifespanResultT]) -> AsyncIterator[Any]:
+    global _store
     print("Starting app... Connecting to database.")
-    # Connettiti al DB SQLite e imposta la row_factory per ottenere dict invece di tuple
-    check_and_sync()
-    db = await aiosqlite.connect(DB_PATH)
-    db.row_factory = aiosqlite.Row
-    ctx = {"db": db}  # il tuo lifespan context
-    yield ctx
-    await db.close()
+    cache = ResultCache(
+        max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl=CACHE_TTL,
+    )
+    # Pool di connessioni in sola lettura: i servizi costruiscono i risultati dalle tuple (fetch_records);
+    # il tracer di ogni connessione conta i passi della VM e interrompe le query scadute o annullate;
+    # con il log delle query lente attivo registra anche le istruzioni SQL eseguite
+    store = _store = DataStore(
+        DB_PATH,
+        pool_options={"size": DB_POOL_SIZE, "mmap_size": DB_MMAP_SIZE,
+                      "cache_size_kib": DB_CACHE_SIZE_KIB, "trace": True,
+                      "record_statements": SLOW_QUERY_MS > 0},
+        cache=cache,
+        snapshot_path=SNAPSHOT_PATH or None,
+    )
+    # The first import can take minutes: run it in background and start serving now
+    initializer = asyncio.create_task(store.initialize(check_and_sync))
+    refresher = None
+    if REFRESH_INTERVAL > 0:
+        refresher = asyncio.create_task(
+            store.refresh_periodically(get_refresh_function(), REFRESH_INTERVAL))
+    ctx = {"store": store, "cache": cache}  # il tuo lifespan context
+    try:
+        yield ctx
+    finally:
+        initializer.cancel()
+        if refresher is not None:
+            refresher.cancel()
+        await SLOW_QUERIES.close()
+        await store.close()
+        _store = None
     print("Starting app... Closinng to database.")
 
 
+def get_refresh_function():
+    return functools.partial(refresh_database, DB_PATH)
+
+
+def get_store() -> DataStore:
+    ctx = get_context()
+    return ctx.request_context.lifespan_context.get("store")
+
+
+def get_pool() -> ConnectionPool:
+    return get_store().pool
+
+
+def get_country_index() -> CountryIndex:
+    return get_store().countries
+
+
+def get_cache() -> ResultCache:
+    ctx = get_context()
+    return ctx.request_context.lifespan_context.get("cache")
+
+
+async def run_query(service, *args):
+    """
+    Runs a services query on a connection borrowed from the pool, recording it in METRICS.
+
+    The query is stopped at the deadline of the tool call, or when the call
+    is cancelled. Queries slower than SLOW_QUERY_MS, stopped or not, are
+    logged by SLOW_QUERIES with the statements the tracer recorded; their
+    plans are read in background.
+    """
+    pool = get_pool()
+    waiting = time.perf_counter()
+    async with pool.acquire() as db:
+        tracer = pool.tracer(db)
+        started = time.perf_counter()
+        METRICS.observe_connection_wait(started - waiting)
+        try:
+            result = await run_interruptible(tracer, service(db, *args))
+        except (DeadlineExceeded, asyncio.CancelledError):
+            elapsed = time.perf_counter() - started
+            METRICS.observe_query(service.__name__, elapsed, failed=True)
+            if tracer is not None and 0 < SLOW_QUERY_MS <= elapsed * 1000:
+                SLOW_QUERIES.submit(pool, service, args, tracer.statements, elapsed, tracer.vm_steps,
+                                     interrupted=True)
+            raise
+        except Exception:
+            METRICS.observe_query(service.__name__, time.perf_counter() - started, failed=True)
+            raise
+        elapsed = time.perf_counter() - started
+        METRICS.observe_query(service.__name__, elapsed, result)
+        if tracer is not None and 0 < SLOW_QUERY_MS <= elapsed * 1000:
+            SLOW_QUERIES.submit(pool, service, args, tracer.statements, elapsed, tracer.vm_steps)
+        return result
+
+
+def query_snapshot(service, snapshot, *args):
+    """Runs a services lookup on the memory-mapped snapshot, recording it in METRICS."""
+    started = time.perf_counter()
+    result = service(snapshot, *args)
+    METRICS.observe_query(service.__name__, time.perf_counter() - started, result)
+    return result
+
+
 mcp = FastMCP("Geoname MCP", lifespan=app_lifespan)
 
 
+def tool(function):
+    """Registers an MCP tool whose calls are recorded in METRICS, admitted by LIMITER and sampled by PROFILER."""
+    limited = LIMITER.instrument_tool(PROFILER.instrument_tool(function))
+    return mcp.tool()(METRICS.instrument_tool(limited))
+
+
+def capped(limit: int) -> int:
+    """A search limit between 1 and MAX_LIMIT."""
+    return max(1, min(limit, MAX_LIMIT))
+
+
 # --- ENDPOINT REFACTORIZZATI CON SQL ---
 
-@mcp.tool()
+@tool
 async def countries(
         search_term: str = "",
         lang: str = "it"
-) -> Union[List[Country], str]:
+) -> Union[List[Country], WarmingUp, str]:
     """
     Retrieves a list of countries, optionally filtering by a search term.
 
-    This tool queries the database for countries matching the specified language.
+    This tool searches the in-memory country index for the specified language.
     The result is a list of dictionaries, each containing an 'id' (the country code)
     and a 'label' (the country name), suitable for display in user interfaces.
     """
-    ctx = get_context()
-    db = ctx.request_context.lifespan_context.get("db")
-    return await get_countries(db, search_term, lang)
+    not_ready = get_store().warming_up()
+    if not_ready is not None:
+        return not_ready
+    return get_country_index().search(search_term, lang)
+
 
+def projected(result, fields: Optional[List[str]], selected):
+    """A tool result with only the ``selected`` fields of its records, if ``fields`` were asked for."""
+    if not fields or isinstance(result, str):
+        return result
+    return project(result, selected)
 
-@mcp.tool()
+
+@tool
 async def find_cities_by_name(
         country_code: str = "",
         city_name: str = "",
-        limit: int = 10
-) -> Union[List[PostalCode], str]:
+        limit: int = 10,
+        fuzzy: bool = False,
+        distinct: bool = False,
+        fields: Optional[List[str]] = None
+) -> Union[List[ScoredPostalCode], List[PostalCode], List[Place], List[Dict[str, Any]], WarmingUp, str]:
     """
     Searches for cities within a given country based on a partial name.
 
     Returns a list of matching locations, including details like county, postal code,
-    and geographic coordinates. The search is case-insensitive.
+    and geographic coordinates, one per postal code. The search is case-insensitive.
+    With fuzzy=True the name may be misspelled (e.g. 'Bologan', 'Muenchen'): results
+    are the closest names, best first, each with a 'score' (0 to 1) and 'edit_distance'.
+    With distinct=True each result is a distinct place (name and admin hierarchy) with
+    the list of its 'postal_codes', their centroid and bounding box, and limit counts
+    places: prefer it to find a city rather than one of its postal codes.
     Params:
         country_code: The two-letter ISO 3166-1 alpha-2 country code (e.g., 'IT', 'DE').
         city_name: A partial or full city name to search for.
-        limit: The maximum number of results to return. Defaults to 10.
+        limit: The maximum number of results to return, up to 100. Defaults to 10.
+        fuzzy: Tolerate typos in city_name. Defaults to False.
+        distinct: One result per place instead of per postal code. Defaults to False.
+        fields: Only return these fields of each result (e.g. ['postal_code', 'place_name']).
+            Defaults to all of them.
     """
-    ctx = get_context()
-    db = ctx.request_context.lifespan_context.get("db")
-    return await get_cities(db, country_code, city_name, limit)
+    if fuzzy and distinct:
+        return "fuzzy and distinct cannot be combined."
+    limit = capped(limit)
+    try:
+        selected = select_fields(ScoredPostalCode if fuzzy else Place if distinct else PostalCode, fields)
+    except ValueError as e:
+        return str(e)
+    not_ready = get_store().warming_up(country_code)
+    if not_ready is not None:
+        return not_ready
+    snapshot = get_store().snapshot
+    if snapshot is not None and not fuzzy and not distinct:
+        # Already shared by every process through the page cache: not worth caching
+        result = query_snapshot(get_cities_from_snapshot, snapshot, country_code, city_name, limit)
+        return projected(result, fields, selected)
+    if not fuzzy and not distinct:
+        # Only the requested columns are read
+        return await get_cache().get_or_compute(
+            cities_cache_key(country_code, city_name, limit, fields=fields),
+            lambda: run_query(get_cities, country_code, city_name, limit, fields),
+        )
+    service = get_fuzzy_cities if fuzzy else get_places_by_name
+    result = await get_cache().get_or_compute(
+        cities_cache_key(country_code, city_name, limit, fuzzy, distinct),
+        lambda: run_query(service, country_code, city_name, limit),
+    )
+    return projected(result, fields, selected)
 
 
-@mcp.tool()
+@tool
+async def autocomplete_place(
+        country_code: str = "",
+        prefix: str = "",
+        limit: int = 10,
+        fields: Optional[List[str]] = None
+) -> Union[List[PostalCode], List[Dict[str, Any]], WarmingUp, str]:
+    """
+    Suggests the cities of a country whose name starts with what has been typed so far.
+
+    Meant to be called on every keystroke of an address form: names are matched
+    ignoring case and accents, in alphabetical order, with one entry per postal code.
+    Served from memory by the sorted name keys of the snapshot (SNAPSHOT_PATH, on by
+    default); with SNAPSHOT_PATH empty, by a range seek on the SQLite index.
+    Params:
+        country_code: The two-letter ISO 3166-1 alpha-2 country code (e.g., 'IT', 'DE').
+        prefix: The beginning of the city name (e.g., 'bol', 'munc').
+        limit: The maximum number of results to return, up to 100. Defaults to 10.
+        fields: Only return these fields of each result (e.g. ['postal_code', 'place_name']).
+            Defaults to all of them.
+    """
+    try:
+        selected = select_fields(PostalCode, fields)
+    except ValueError as e:
+        return str(e)
+    limit = capped(limit)
+    not_ready = get_store().warming_up(country_code)
+    if not_ready is not None:
+        return not_ready
+    snapshot = get_store().snapshot
+    if snapshot is not None:
+        result = query_snapshot(get_places_by_prefix_from_snapshot, snapshot, country_code, prefix, limit)
+    else:
+        result = await run_query(get_places_by_prefix, country_code, prefix, limit)
+    return projected(result, fields, selected)
+
+
+@tool
 async def get_location_by_postal_code(
         country_code: str = "",
-        postal_code: str = ""
-) -> Union[List[PostalCode], str]:
+        postal_code: str = "",
+        fields: Optional[List[str]] = None
+) -> Union[List[PostalCode], List[Dict[str, Any]], WarmingUp, str]:
     """
     Retrieves detailed location information for a specific postal code in a country.
 
@@ -96,11 +335,264 @@ async def get_location_by_postal_code(
     Params:
         country_code: The two-letter ISO 3166-1 alpha-2 country code (e.g., 'IT', 'DE').
         postal_code: The exact postal code to search for.
+        fields: Only return these fields of each result (e.g. ['place_name', 'latitude']).
+            Defaults to all of them.
     """
-    ctx = get_context()
-    db = ctx.request_context.lifespan_context.get("db")
+    try:
+        selected = select_fields(PostalCode, fields)
+    except ValueError as e:
+        return str(e)
+    not_ready = get_store().warming_up(country_code)
+    if not_ready is not None:
+        return not_ready
+    snapshot = get_store().snapshot
+    if snapshot is not None:
+        result = query_snapshot(get_postal_code_from_snapshot, snapshot, country_code, postal_code)
+        return projected(result, fields, selected)
+    return await get_cache().get_or_compute(
+        postal_code_cache_key(country_code, postal_code, fields),
+        lambda: run_query(get_postal_code, country_code, postal_code, fields),
+    )
+
+
+@tool
+async def get_locations_by_postal_codes(
+        items: List[PostalCodeLookup]
+) -> Union[List[PostalCodeLocations], WarmingUp, str]:
+    """
+    Retrieves the locations of many postal codes in a single call.
+
+    Use this instead of repeated get_location_by_postal_code calls when
+    resolving several postal codes. Returns one entry per input item, in the
+    same order, with the input country_code and postal_code and the matching
+    'locations' (empty when the postal code is unknown).
+    Params:
+        items: Up to 1000 {country_code, postal_code} pairs; country_code is the
+            two-letter ISO 3166-1 alpha-2 code (e.g., 'IT', 'DE').
+    """
+    if len(items) > MAX_BATCH_ITEMS:
+        return f"Too many postal codes: {len(items)}, at most {MAX_BATCH_ITEMS} per call."
+    for country_code in {item.country_code.upper() for item in items}:
+        not_ready = get_store().warming_up(country_code)
+        if not_ready is not None:
+            return not_ready
+    keys = [postal_code_cache_key(item.country_code, item.postal_code) for item in items]
+
+    async def resolve(missing):
+        found = await run_query(get_postal_codes, [(country, code) for _, country, code in missing])
+        if isinstance(found, str):
+            return found
+        return {key: found[key[1], key[2]] for key in missing}
+
+    locations = await get_cache().get_or_compute_many(keys, resolve)
+    if isinstance(locations, str):
+        return locations
+    return [
+        PostalCodeLocations(item.country_code, item.postal_code, locations[key])
+        for item, key in zip(items, keys)
+    ]
+
+
+@tool
+async def reverse_geocode(
+        latitude: float,
+        longitude: float,
+        limit: int = 10
+) -> Union[List[NearbyPostalCode], WarmingUp, str]:
+    """
+    Finds the postal codes nearest to a pair of coordinates.
+
+    Returns the closest locations first, each with its distance from the point
+    in kilometres ('distance_km').
+    Params:
+        latitude: Latitude of the point in decimal degrees (-90 to 90).
+        longitude: Longitude of the point in decimal degrees (-180 to 180).
+        limit: The maximum number of results to return, up to 100. Defaults to 10.
+    """
+    not_ready = get_store().warming_up()
+    if not_ready is not None:
+        return not_ready
+    return await run_query(get_nearest_postal_codes, latitude, longitude, capped(limit))
+
+
+@tool
+async def find_places_near(
+        latitude: float,
+        longitude: float,
+        radius_km: float = 10.0,
+        country_code: str = "",
+        limit: int = 20,
+        cursor: str = ""
+) -> Union[PlacesPage, WarmingUp, str]:
+    """
+    Lists the postal codes within a radius of a point, nearest first.
+
+    Results come in pages of at most 'limit' items (up to 100), each with its
+    distance from the point in kilometres ('distance_km'). When more results
+    exist, 'next_cursor' is set: call again with the same arguments and
+    cursor=next_cursor to get the next page.
+    Params:
+        latitude: Latitude of the point in decimal degrees (-90 to 90).
+        longitude: Longitude of the point in decimal degrees (-180 to 180).
+        radius_km: Search radius in kilometres. Defaults to 10.
+        country_code: Optional two-letter ISO 3166-1 alpha-2 code restricting the results.
+        limit: Page size. Defaults to 20.
+        cursor: The 'next_cursor' of the previous page, empty for the first one.
+    """
+    not_ready = get_store().warming_up(country_code or None)
+    if not_ready is not None:
+        return not_ready
+    return await run_query(get_places_near, latitude, longitude, radius_km,
+                           country_code or None, limit, cursor or None)
+
+
+@tool
+async def find_places_in_box(
+        min_latitude: float,
+        min_longitude: float,
+        max_latitude: float,
+        max_longitude: float,
+        country_code: str = "",
+        limit: int = 20,
+        cursor: str = ""
+) -> Union[PlacesPage, WarmingUp, str]:
+    """
+    Lists the postal codes inside a latitude/longitude bounding box.
+
+    Results are ordered by distance from the centre of the box ('distance_km')
+    and paginated like find_places_near. A box with min_longitude greater than
+    max_longitude crosses the antimeridian.
+    Params:
+        min_latitude: Southern edge of the box.
+        min_longitude: Western edge of the box.
+        max_latitude: Northern edge of the box.
+        max_longitude: Eastern edge of the box.
+        country_code: Optional two-letter ISO 3166-1 alpha-2 code restricting the results.
+        limit: Page size. Defaults to 20.
+        cursor: The 'next_cursor' of the previous page, empty for the first one.
+    """
+    not_ready = get_store().warming_up(country_code or None)
+    if not_ready is not None:
+        return not_ready
+    return await run_query(get_places_in_box, min_latitude, min_longitude, max_latitude,
+                           max_longitude, country_code or None, limit, cursor or None)
+
+
+async def refresh_data() -> dict:
+    """
+    Admin: starts a background refresh of the GeoNames data.
+
+    A new database is built next to the live one, verified and swapped in
+    without interrupting requests. Returns the current data status; poll the
+    geonames://admin/data resource to follow the refresh.
+    """
+    store = get_store()
+    started = store.start_refresh(get_refresh_function())
+    return {"started": started, **store.status()}
+
+
+async def set_profiling(sample_rate: float = 0.0) -> dict:
+    """
+    Admin: profiles a fraction of the tool calls from now on, without a restart.
+
+    Each sampled call runs under cProfile and its stats are dumped to a .prof
+    file in PROFILE_DIR, to read with pstats. 0 turns profiling off, 1
+    profiles every call. Returns the profiler status.
+    """
+    PROFILER.configure(sample_rate)
+    return PROFILER.status()
+
+
+if ENABLE_ADMIN_TOOLS:
+    tool(refresh_data)
+    tool(set_profiling)
+
+
+@mcp.resource("geonames://admin/data")
+def data_status() -> dict:
+    """Data generation currently served and status of the last hot refresh."""
+    return get_store().status()
+
+
+@mcp.resource("geonames://stats/cache")
+def cache_stats() -> dict:
+    """
+    Hit, miss and eviction counters and current size of the lookup result cache.
+
+    ``snapshot_bytes`` is the size of the memory-mapped snapshot serving the
+    lookups, 0 without one.
+    """
+    snapshot = get_store().snapshot
+    return {**get_cache().stats(), "snapshot_bytes": snapshot.nbytes if snapshot is not None else 0}
+
+
+@mcp.resource("geonames://stats/metrics")
+def metrics() -> dict:
+    """Calls, errors, latency histograms and rows returned per tool and per query."""
+    return METRICS.snapshot()
+
+
+def gauges() -> list:
+    """Samples of the admitted calls, the data, the pool and the cache at the time /metrics is scraped."""
+    limiter = LIMITER.status()
+    samples = [
+        ("geonames_calls_running", "gauge", "Tool calls admitted and running.", limiter["running"]),
+        ("geonames_calls_waiting", "gauge", "Tool calls queued for admission.", limiter["waiting"]),
+        ("geonames_calls_rejected_total", "counter", "Tool calls refused because the queue was full.",
+         limiter["rejected"]),
+        ("geonames_calls_timed_out_total", "counter", "Tool calls stopped at their deadline.",
+         limiter["timed_out"]),
+    ]
+    if _store is None:
+        return samples + [("geonames_ready", "gauge", "1 once all the data is loaded.", 0)]
+    samples += [
+        ("geonames_ready", "gauge", "1 once all the data is loaded.", int(_store.ready)),
+        ("geonames_data_generation", "gauge", "Data generation served.", _store.generation),
+        ("geonames_countries_imported", "gauge", "Countries loaded so far.", len(_store.imported)),
+    ]
+    samples.append(("geonames_snapshot_bytes", "gauge",
+                    "Size of the memory-mapped snapshot serving the lookups, 0 without one.",
+                    _store.snapshot.nbytes if _store.snapshot is not None else 0))
+    if _store.pool is not None:
+        samples += [
+            ("geonames_pool_connections", "gauge", "Pooled read-only connections.", _store.pool.size),
+            ("geonames_pool_connections_available", "gauge", "Pooled connections not in use.",
+             _store.pool.available),
+        ]
+    if _store.cache is not None:
+        stats = _store.cache.stats()
+        samples += [
+            ("geonames_cache_hits_total", "counter", "Result cache hits.", stats["hits"]),
+            ("geonames_cache_misses_total", "counter", "Result cache misses.", stats["misses"]),
+            ("geonames_cache_evictions_total", "counter", "Results evicted from the cache.",
+             stats["evictions"]),
+            ("geonames_cache_expirations_total", "counter", "Cached results expired by the TTL.",
+             stats["expirations"]),
+            ("geonames_cache_entries", "gauge", "Results in the cache.", stats["entries"]),
+            ("geonames_cache_bytes", "gauge", "Estimated size of the cache.", stats["bytes"]),
+        ]
+    return samples
+
+
+@mcp.custom_route("/metrics", methods=["GET"])
+async def prometheus_metrics(request: Request) -> PlainTextResponse:
+    """The metrics in the Prometheus text exposition format."""
+    return PlainTextResponse(METRICS.render(gauges()), media_type="text/plain; version=0.0.4")
+
+
+@mcp.custom_route("/health/live", methods=["GET"])
+async def liveness(request: Request) -> JSONResponse:
+    """The process is up and serving HTTP, whether or not the data is loaded."""
+    return JSONResponse({"status": "alive"})
+
 
-    return await get_postal_code(db, country_code, postal_code)
+@mcp.custom_route("/health/ready", methods=["GET"])
+async def readiness(request: Request) -> JSONResponse:
+    """200 once all the data is loaded, 503 while it is still importing (or failed)."""
+    if _store is None:
+        return JSONResponse({"state": "starting"}, status_code=503)
+    status = {key: value for key, value in _store.status().items() if key != "refresh"}
+    return JSONResponse(status, status_code=200 if _store.ready else 503)
 
 
 def main():
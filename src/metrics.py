@@ -0,0 +1,189 @@
+"""
+In-process metrics of the tools and of the queries they run.
+
+Samples are recorded from the event loop only, so recording one is a few
+dict and list updates, without locks. render() writes them in the
+Prometheus text exposition format, snapshot() returns them as a dict.
+"""
+import time
+from bisect import bisect_left
+from collections import defaultdict
+from functools import wraps
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+)
+
+# A sample computed at render time: name, type, help, value
+Sample = Tuple[str, str, str, float]
+
+
+class Histogram:
+    """Observations counted per bucket (each one in the first bucket whose bound it does not exceed)."""
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.buckets = tuple(buckets)
+        # The last count is the +Inf bucket
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self) -> List[Tuple[str, int]]:
+        """(upper bound, observations up to it) per bucket, as Prometheus reports them."""
+        pairs, total = [], 0
+        for bound, count in zip([f"{bound:g}" for bound in self.buckets] + ["+Inf"], self.counts):
+            total += count
+            pairs.append((bound, total))
+        return pairs
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"count": self.count, "sum": self.sum, "buckets": dict(self.cumulative())}
+
+
+def count_rows(result: Any) -> int:
+    """Records in a tool or query result: a list or dict of them, or a page with ``items``."""
+    if isinstance(result, (list, tuple, dict)):
+        return len(result)
+    items = getattr(result, "items", None)
+    return len(items) if isinstance(items, list) else 0
+
+
+class Metrics:
+    """
+    Calls, errors, latency and rows returned per tool and per query.
+
+    A result that is an error string counts as an error, like an exception.
+    Also tracks the tools running and the time spent waiting for a pooled
+    connection.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.perf_counter):
+        self._clock = clock
+        self.tool_calls: Dict[str, int] = defaultdict(int)
+        self.tool_errors: Dict[str, int] = defaultdict(int)
+        self.tool_rows: Dict[str, int] = defaultdict(int)
+        self.tool_in_flight: Dict[str, int] = defaultdict(int)
+        self.tool_latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.query_calls: Dict[str, int] = defaultdict(int)
+        self.query_errors: Dict[str, int] = defaultdict(int)
+        self.query_rows: Dict[str, int] = defaultdict(int)
+        self.query_latency: Dict[str, Histogram] = defaultdict(Histogram)
+        self.connection_wait = Histogram()
+
+    def instrument_tool(self, tool: Callable) -> Callable:
+        """Wraps an async tool so that its calls are recorded; the signature is kept for FastMCP."""
+        name = tool.__name__
+
+        @wraps(tool)
+        async def instrumented(*args, **kwargs):
+            self.tool_in_flight[name] += 1
+            started = self._clock()
+            try:
+                result = await tool(*args, **kwargs)
+            except Exception:
+                self.tool_errors[name] += 1
+                raise
+            finally:
+                self.tool_latency[name].observe(self._clock() - started)
+                self.tool_calls[name] += 1
+                self.tool_in_flight[name] -= 1
+            if isinstance(result, str):
+                self.tool_errors[name] += 1
+            self.tool_rows[name] += count_rows(result)
+            return result
+
+        return instrumented
+
+    def observe_query(self, name: str, seconds: float, result: Any = None, failed: bool = False):
+        self.query_calls[name] += 1
+        self.query_latency[name].observe(seconds)
+        if failed or isinstance(result, str):
+            self.query_errors[name] += 1
+        else:
+            self.query_rows[name] += count_rows(result)
+
+    def observe_connection_wait(self, seconds: float):
+        self.connection_wait.observe(seconds)
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "tools": {
+                name: {
+                    "calls": self.tool_calls[name],
+                    "errors": self.tool_errors[name],
+                    "rows": self.tool_rows[name],
+                    "in_flight": self.tool_in_flight[name],
+                    "latency_seconds": self.tool_latency[name].as_dict(),
+                }
+                for name in sorted(self.tool_calls.keys() | self.tool_in_flight.keys())
+            },
+            "queries": {
+                name: {
+                    "calls": self.query_calls[name],
+                    "errors": self.query_errors[name],
+                    "rows": self.query_rows[name],
+                    "latency_seconds": self.query_latency[name].as_dict(),
+                }
+                for name in sorted(self.query_calls)
+            },
+            "connection_wait_seconds": self.connection_wait.as_dict(),
+        }
+
+    def render(self, samples: Optional[List[Sample]] = None) -> str:
+        """The metrics, followed by ``samples`` computed by the caller, in the Prometheus text format."""
+        lines: List[str] = []
+        _values(lines, "counter", "geonames_tool_calls_total", "Tool calls.", "tool", self.tool_calls)
+        _values(lines, "counter", "geonames_tool_errors_total",
+                "Tool calls that failed or returned an error.", "tool", self.tool_errors)
+        _values(lines, "counter", "geonames_tool_rows_total", "Records returned by the tools.",
+                "tool", self.tool_rows)
+        _values(lines, "gauge", "geonames_tool_in_flight", "Tool calls running.",
+                "tool", self.tool_in_flight)
+        _histogram(lines, "geonames_tool_duration_seconds", "Duration of the tool calls.",
+                   "tool", self.tool_latency)
+        _values(lines, "counter", "geonames_query_calls_total", "Queries run by the tools.",
+                "query", self.query_calls)
+        _values(lines, "counter", "geonames_query_errors_total", "Queries that failed.",
+                "query", self.query_errors)
+        _values(lines, "counter", "geonames_query_rows_total", "Records returned by the queries.",
+                "query", self.query_rows)
+        _histogram(lines, "geonames_query_duration_seconds",
+                   "Duration of the queries, excluding the wait for a connection.",
+                   "query", self.query_latency)
+        _histogram(lines, "geonames_connection_wait_seconds",
+                   "Time spent waiting for a pooled connection.", None, {"": self.connection_wait})
+        for name, kind, description, value in samples or ():
+            lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}", f"{name} {value:g}"]
+        return "\n".join(lines) + "\n"
+
+
+def _labels(label: Optional[str], value: str, *extra: Tuple[str, str]) -> str:
+    pairs = ([(label, value)] if label else []) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _values(lines: List[str], kind: str, name: str, description: str, label: str,
+            values: Dict[str, int]):
+    lines += [f"# HELP {name} {description}", f"# TYPE {name} {kind}"]
+    lines += [f"{name}{_labels(label, key)} {value}" for key, value in sorted(values.items())]
+
+
+def _histogram(lines: List[str], name: str, description: str, label: Optional[str],
+               histograms: Dict[str, Histogram]):
+    lines += [f"# HELP {name} {description}", f"# TYPE {name} histogram"]
+    for key, histogram in sorted(histograms.items()):
+        for bound, count in histogram.cumulative():
+            lines.append(f"{name}_bucket{_labels(label, key, ('le', bound))} {count}")
+        lines.append(f"{name}_sum{_labels(label, key)} {histogram.sum!r}")
+        lines.append(f"{name}_count{_labels(label, key)} {histogram.count}")
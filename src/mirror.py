@@ -0,0 +1,112 @@
+"""
+Country archives read from a local copy of download.geonames.org/export/zip/.
+
+Builds without network access import from a directory holding either the
+per-country zips (IT.zip, DE.zip, ...) or the single allCountries.zip, and
+get the same stream of Archive objects as a download.
+"""
+import hashlib
+import logging
+import pathlib
+from io import TextIOWrapper
+from itertools import groupby, islice
+from typing import Dict, Iterator, List
+from zipfile import ZipFile
+
+from download import EXCLUDED_DATASETS, Archive
+
+logger = logging.getLogger(__name__)
+
+ALL_COUNTRIES = "allCountries.zip"
+
+
+def is_local_source(source) -> bool:
+    """True if ``source`` is a directory path rather than the URL of the GeoNames export."""
+    return not str(source).startswith(("http://", "https://"))
+
+
+def file_sha256(path: pathlib.Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as fh:
+        while chunk := fh.read(1024 * 1024):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def country_archive_names(directory: pathlib.Path) -> List[str]:
+    """Names of the per-country archives in ``directory``, like parse_dataset_index."""
+    return sorted(
+        path.name for path in directory.glob("*.zip")
+        if path.name not in EXCLUDED_DATASETS
+    )
+
+
+def _chunks(lines, size: int) -> Iterator[List[str]]:
+    while chunk := list(islice(lines, size)):
+        yield chunk
+
+
+def _dump_lines(zf: ZipFile) -> Iterator[str]:
+    with zf.open("allCountries.txt", "r") as fh_in_binary:
+        yield from (line for line in TextIOWrapper(fh_in_binary, 'utf-8') if line.strip())
+
+
+def _line_country(line: str) -> str:
+    return line.split("\t", 1)[0]
+
+
+def country_sha256s(path: pathlib.Path) -> Dict[str, str]:
+    """
+    SHA-256 of the rows of each country of allCountries.zip, in one streaming pass.
+
+    Raises ValueError if the rows of a country are not contiguous.
+    """
+    digests = {}
+    with ZipFile(path) as zf:
+        for country_code, rows in groupby(_dump_lines(zf), key=_line_country):
+            if country_code in digests:
+                raise ValueError(f"{path.name} is not ordered by country: {country_code} comes twice")
+            digest = hashlib.sha256()
+            for line in rows:
+                digest.update(line.encode("utf-8"))
+            digests[country_code] = digest.hexdigest()
+    return digests
+
+
+def split_all_countries(path: pathlib.Path, size: int) -> Iterator[Archive]:
+    """
+    Splits allCountries.zip by country.
+
+    Yields one Archive per country, whose ``lines`` are that country's rows
+    in chunks of ``size``; nothing but the current chunk is held in memory.
+    A first pass (see country_sha256s) checks that each country comes in a
+    single run, before anything is yielded, and gives every archive the
+    sha256 of its own rows, so that an unchanged country is recognized
+    whatever changed in the others.
+    """
+    digests = country_sha256s(path)
+    with ZipFile(path) as zf:
+        for country_code, rows in groupby(_dump_lines(zf), key=_line_country):
+            yield Archive(f"{country_code}.zip", None, sha256=digests[country_code],
+                          lines=_chunks(rows, size))
+
+
+def iter_local_archives(directory: pathlib.Path, size: int) -> Iterator[Archive]:
+    """
+    Yields the country archives found in ``directory``, like download.iter_archives.
+
+    Per-country zips are preferred, since unchanged ones can be skipped one by
+    one; otherwise allCountries.zip is split by country. Raises
+    FileNotFoundError if the directory has neither.
+    """
+    directory = pathlib.Path(directory)
+    names = country_archive_names(directory) if directory.is_dir() else []
+    if names:
+        for name in names:
+            path = directory / name
+            yield Archive(name, len(names), file=open(path, "rb"), sha256=file_sha256(path))
+    elif (directory / ALL_COUNTRIES).is_file():
+        logger.info(f"Splitting {directory / ALL_COUNTRIES} by country")
+        yield from split_all_countries(directory / ALL_COUNTRIES, size)
+    else:
+        raise FileNotFoundError(f"No GeoNames postal code archives in {directory}")
@@ -0,0 +1,20 @@
+import unicodedata
+
+
+def fold(text: str) -> str:
+    """
+    Folds a place name into its search key: accents stripped, case folded.
+
+    "München" -> "munchen", "Forlì" -> "forli", "Straße" -> "strasse".
+    The same function is used when importing rows and when searching, so
+    both sides of a comparison are always folded the same way.
+    """
+    if not text:
+        return ""
+    decomposed = unicodedata.normalize("NFKD", text)
+    stripped = "".join(c for c in decomposed if not unicodedata.combining(c))
+    return stripped.casefold().strip()
+
+
+# Sorts after any character: every key starting with a prefix is below prefix + PREFIX_END
+PREFIX_END = "\U0010ffff"
@@ -0,0 +1,137 @@
+import asyncio
+import logging
+import pathlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Dict, List, Optional
+
+import aiosqlite
+
+from profiling import QueryTracer
+
+logger = logging.getLogger(__name__)
+
+
+class ConnectionPool:
+    """
+    Bounded pool of read-only aiosqlite connections.
+
+    aiosqlite runs every connection on its own worker thread, so a single shared
+    connection serializes all the tool calls. With a pool, concurrent requests
+    run their queries on different threads, and sqlite3 releases the GIL while
+    a statement executes, so lookups can proceed in parallel.
+
+    With ``trace``, each connection gets a QueryTracer (see tracer()), which
+    counts the work of its queries and can stop them; with ``record_statements``
+    it also keeps the SQL they run. With ``lazy``, open()
+    connects nothing: connections are opened when borrowed and none is idle,
+    up to ``size``, for processes that rarely need SQLite.
+    """
+
+    def __init__(
+            self,
+            path: pathlib.Path,
+            size: int = 4,
+            mmap_size: int = 256 * 1024 * 1024,
+            cache_size_kib: int = 16 * 1024,
+            trace: bool = False,
+            record_statements: bool = False,
+            lazy: bool = False,
+    ):
+        if size < 1:
+            raise ValueError("The pool needs at least one connection")
+        self.path = pathlib.Path(path)
+        self.size = size
+        self.mmap_size = mmap_size
+        self.cache_size_kib = cache_size_kib
+        self.trace = trace
+        self.record_statements = record_statements
+        self.lazy = lazy
+        self._connections: List[aiosqlite.Connection] = []
+        self._tracers: Dict[aiosqlite.Connection, QueryTracer] = {}
+        self._idle: asyncio.Queue = asyncio.Queue()
+        self._opening = 0
+        self._closed = False
+
+    async def connect(self) -> aiosqlite.Connection:
+        """A new connection set up like the pooled ones, outside the pool: the caller closes it."""
+        db = await aiosqlite.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+        await db.execute("PRAGMA query_only = ON")
+        await db.execute(f"PRAGMA mmap_size = {int(self.mmap_size)}")
+        # A negative cache_size is expressed in KiB rather than in pages
+        await db.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+        return db
+
+    async def _connect(self) -> aiosqlite.Connection:
+        db = await self.connect()
+        if self.trace:
+            self._tracers[db] = await QueryTracer(record_statements=self.record_statements).attach(db)
+        return db
+
+    async def open(self) -> "ConnectionPool":
+        if self.lazy:
+            logger.info(f"Up to {self.size} read-only connections to {self.path}, opened on demand")
+            return self
+        for _ in range(self.size):
+            db = await self._connect()
+            self._connections.append(db)
+            self._idle.put_nowait(db)
+        logger.info(f"Opened {self.size} read-only connections to {self.path}")
+        return self
+
+    async def close(self, timeout: Optional[float] = None):
+        """
+        Closes the pool once every borrowed connection has been released.
+
+        Requests already waiting for a connection are served first, so a pool
+        being retired finishes its in-flight work before it closes. After
+        ``timeout`` seconds the remaining connections are closed anyway.
+        """
+        async def drain():
+            for _ in range(len(self._connections)):
+                await self._idle.get()
+
+        try:
+            await asyncio.wait_for(drain(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Closing {self.path} with connections still in use")
+        for db in self._connections:
+            await db.close()
+        self._closed = True
+        self._connections.clear()
+        self._tracers.clear()
+        self._idle = asyncio.Queue()
+
+    def tracer(self, db: aiosqlite.Connection) -> Optional[QueryTracer]:
+        """The QueryTracer of a connection of the pool, None unless the pool traces."""
+        return self._tracers.get(db)
+
+    @property
+    def available(self) -> int:
+        """Connections not in use, counting those a lazy pool has not opened yet."""
+        return self._idle.qsize() + self._unopened
+
+    @property
+    def _unopened(self) -> int:
+        if not self.lazy or self._closed:
+            return 0
+        return self.size - len(self._connections) - self._opening
+
+    async def _borrow(self) -> aiosqlite.Connection:
+        if self._idle.empty() and self._unopened > 0:
+            self._opening += 1
+            try:
+                db = await self._connect()
+            finally:
+                self._opening -= 1
+            self._connections.append(db)
+            return db
+        return await self._idle.get()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrows a connection, waiting for one to be released if all are busy."""
+        db = await self._borrow()
+        try:
+            yield db
+        finally:
+            self._idle.put_nowait(db)
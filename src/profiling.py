@@ -0,0 +1,239 @@
+"""
+Diagnostics of slow requests: the SQL they ran and, on demand, a profile.
+
+A QueryTracer is attached to a pooled connection: SQLite calls it back
+every PROGRESS_STEP_INTERVAL virtual machine instructions, which counts
+the work a query did and stops it once its deadline has passed (see
+admission.run_interruptible). With ``record_statements`` it also keeps,
+through SQLite's trace callback, the statements of the running query
+with their parameters bound. When a query turns out slow, or is stopped
+at its deadline, SlowQueryLog writes those statements with their plans
+as one JSON record. The plans are read in the background, on a
+connection of their own, once the caller has had its answer: EXPLAIN
+QUERY PLAN does not run the query again.
+
+RequestProfiler runs a sample of the tool calls under cProfile and dumps
+the stats of each one to a file, to read with pstats or snakeviz.
+"""
+import asyncio
+import cProfile
+import itertools
+import json
+import logging
+import pathlib
+import random
+import time
+from functools import wraps
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence
+
+from aiosqlite import Connection
+
+logger = logging.getLogger(__name__)
+
+# VM instructions between two calls of the progress handler
+PROGRESS_STEP_INTERVAL = 1000
+# Characters of each argument kept in a slow query record
+MAX_ARGUMENT_LENGTH = 500
+# Statements kept per query by a QueryTracer recording them
+MAX_RECORDED_STATEMENTS = 100
+
+
+class QueryTracer:
+    """
+    VM instructions run by a connection since the last reset().
+
+    While ``deadline`` (a time.monotonic() value) is set, a query still
+    running past it is aborted with "sqlite3.OperationalError: interrupted",
+    and ``interrupted`` becomes true. With ``record_statements``,
+    ``statements`` holds the SQL run between start() and stop(), parameters
+    bound.
+    """
+
+    def __init__(self, step_interval: int = PROGRESS_STEP_INTERVAL, record_statements: bool = False):
+        self.step_interval = step_interval
+        self.record_statements = record_statements
+        self.progress_calls = 0
+        self.deadline: Optional[float] = None
+        self.interrupted = False
+        self.statements: List[str] = []
+        self._recording = False
+
+    async def attach(self, db: Connection) -> "QueryTracer":
+        await db.set_progress_handler(self._progress, self.step_interval)
+        if self.record_statements:
+            await db.set_trace_callback(self._trace)
+        return self
+
+    def _trace(self, sql: str):
+        # Runs on the connection's thread. Some statements run by virtual tables
+        # such as FTS5 come as comments: nothing to explain
+        if self._recording and len(self.statements) < MAX_RECORDED_STATEMENTS and not sql.startswith("--"):
+            self.statements.append(sql)
+
+    def _progress(self) -> int:
+        # Runs on the connection's thread; a non-zero value aborts the query
+        self.progress_calls += 1
+        if self.deadline is not None and time.monotonic() >= self.deadline:
+            self.interrupted = True
+            return 1
+        return 0
+
+    def start(self, deadline: Optional[float]):
+        """Starts counting a new query, to be stopped at ``deadline`` (None = never)."""
+        self.progress_calls = 0
+        self.deadline = deadline
+        self.interrupted = False
+        self.statements = []
+        self._recording = True
+
+    def stop(self):
+        """Ends the query started by start(): no deadline, no more statements recorded."""
+        self.deadline = None
+        self._recording = False
+
+    def cancel(self):
+        """Stops the running query at the next call of the progress handler."""
+        self.deadline = 0.0
+
+    @property
+    def vm_steps(self) -> int:
+        """VM instructions run, rounded down to the step interval."""
+        return self.progress_calls * self.step_interval
+
+    def reset(self):
+        self.progress_calls = 0
+
+
+async def explain(db: Connection, sql: str) -> List[str]:
+    """The EXPLAIN QUERY PLAN of a statement, one line per step."""
+    try:
+        async with db.execute(f"EXPLAIN QUERY PLAN {sql}") as cursor:
+            return [row[3] for row in await cursor.fetchall()]
+    except Exception as e:
+        return [f"unavailable: {e}"]
+
+
+class SlowQueryLog:
+    """
+    Logs slow queries with the statements they ran and their plans, off the request path.
+
+    submit() returns at once: the plans of the statements are read by a
+    background task on a connection of its own (see ConnectionPool.connect).
+    The query itself is not run again. One record is explained at a time;
+    the slow queries submitted meanwhile are logged with their statements
+    but without plans.
+    """
+
+    def __init__(self):
+        self._task: Optional[asyncio.Task] = None
+
+    def submit(self, pool, service: Callable[..., Awaitable[Any]], args: Sequence[Any],
+               statements: Sequence[str], elapsed: float, vm_steps: int, interrupted: bool = False):
+        """
+        Logs a slow call of ``service(db, *args)`` on a connection of ``pool``.
+
+        ``statements`` are the SQL it ran (see QueryTracer.statements);
+        ``interrupted`` tells that the call was stopped before it completed.
+        """
+        record = {
+            "event": "slow_query",
+            "query": service.__name__,
+            "args": [repr(arg)[:MAX_ARGUMENT_LENGTH] for arg in args],
+            "elapsed_ms": round(elapsed * 1000, 3),
+            "vm_steps": vm_steps,
+            "interrupted": interrupted,
+            "statements": [{"sql": sql, "plan": None} for sql in statements],
+        }
+        if not statements or (self._task is not None and not self._task.done()):
+            logger.warning(json.dumps(record))
+            return
+        self._task = asyncio.create_task(self._explain(pool, record))
+
+    async def _explain(self, pool, record):
+        try:
+            db = await pool.connect()
+            try:
+                for statement in record["statements"]:
+                    statement["plan"] = await explain(db, statement["sql"])
+            finally:
+                await db.close()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            for statement in record["statements"]:
+                statement["plan"] = statement["plan"] or [f"unavailable: {e}"]
+        logger.warning(json.dumps(record))
+
+    async def wait(self):
+        """Waits for the plans being read, if any."""
+        if self._task is not None and not self._task.done():
+            await asyncio.wait([self._task])
+
+    async def close(self):
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            await self.wait()
+        self._task = None
+
+
+class RequestProfiler:
+    """
+    Profiles a fraction (``sample_rate``) of the tool calls with cProfile.
+
+    The stats of each sampled call are dumped to ``directory``. One call is
+    profiled at a time, and the profile also covers whatever other tasks
+    run on the event loop while the call awaits.
+    """
+
+    def __init__(self, directory: pathlib.Path, sample_rate: float = 0.0,
+                 random_fn: Callable[[], float] = random.random):
+        self.directory = pathlib.Path(directory)
+        self.sample_rate = sample_rate
+        self._random = random_fn
+        self._active = False
+        self._sequence = itertools.count(1)
+        self.profiles = 0
+        self.last_profile: Optional[str] = None
+
+    def configure(self, sample_rate: float):
+        self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+
+    def status(self) -> Dict[str, Any]:
+        return {
+            "sample_rate": self.sample_rate,
+            "directory": str(self.directory),
+            "profiles": self.profiles,
+            "last_profile": self.last_profile,
+        }
+
+    def instrument_tool(self, tool: Callable) -> Callable:
+        """Wraps an async tool so that a sample of its calls is profiled."""
+        name = tool.__name__
+
+        @wraps(tool)
+        async def profiled(*args, **kwargs):
+            if self._active or self.sample_rate <= 0 or self._random() >= self.sample_rate:
+                return await tool(*args, **kwargs)
+            self._active = True
+            profile = cProfile.Profile()
+            profile.enable()
+            try:
+                return await tool(*args, **kwargs)
+            finally:
+                profile.disable()
+                self._active = False
+                self._dump(name, profile)
+
+        return profiled
+
+    def _dump(self, name: str, profile: cProfile.Profile):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        path = self.directory / f"{name}-{time.strftime('%Y%m%dT%H%M%S')}-{next(self._sequence)}.prof"
+        try:
+            profile.dump_stats(path)
+        except OSError as e:
+            logger.error(f"Cannot write profile {path}: {e}")
+            return
+        self.profiles += 1
+        self.last_profile = str(path)
+        logger.info(f"Profiled {name} to {path}")
@@ -1,11 +1,23 @@
-from dataclasses import dataclass
-from typing import Optional, Union, List
+from collections import defaultdict
+from dataclasses import dataclass, field, fields
+from functools import partial
+from heapq import heappush, heappushpop, nsmallest
+from typing import Any, Callable, Dict, Optional, Sequence, Union, List, Tuple
 from aiosqlite import Connection
 import logging
 
+from fuzzy import chunks, levenshtein, padded_trigrams, score, trigram_similarity, trigrams
+from geo import MAX_DISTANCE_KM, bounding_boxes, haversine_km
+from normalize import PREFIX_END, fold
+from snapshot import Snapshot
+
 logger = logging.getLogger(__name__)
 
-@dataclass
+# The trigram tokenizer cannot match terms shorter than a single trigram
+TRIGRAM_MIN_LENGTH = 3
+
+
+@dataclass(slots=True)
 class PostalCode:
     country_code: str
     postal_code: str
@@ -21,6 +33,200 @@ class PostalCode:
     accuracy: Optional[int] = None
 
 
+@dataclass(slots=True)
+class Place:
+    """
+    A place name with its admin hierarchy, and every postal code it has.
+
+    latitude/longitude are the centroid of its postal codes, the min_/max_
+    fields their bounding box.
+    """
+    country_code: str
+    place_name: str
+    state_name: Optional[str] = None
+    state_code: Optional[str] = None
+    county_name: Optional[str] = None
+    county_code: Optional[str] = None
+    community_name: Optional[str] = None
+    community_code: Optional[str] = None
+    postal_codes: List[str] = field(default_factory=list)
+    latitude: Optional[float] = None
+    longitude: Optional[float] = None
+    min_latitude: Optional[float] = None
+    min_longitude: Optional[float] = None
+    max_latitude: Optional[float] = None
+    max_longitude: Optional[float] = None
+
+
+@dataclass(slots=True)
+class NearbyPostalCode(PostalCode):
+    distance_km: Optional[float] = None
+
+
+@dataclass(slots=True)
+class ScoredPostalCode(PostalCode):
+    """A fuzzy search result: ``score`` from 0 to 1, and edits from the searched name."""
+    score: Optional[float] = None
+    edit_distance: Optional[int] = None
+
+
+@dataclass
+class PlacesPage:
+    """A page of a spatial search; pass ``next_cursor`` back to get the next one."""
+    items: List[NearbyPostalCode] = field(default_factory=list)
+    next_cursor: Optional[str] = None
+
+
+@dataclass
+class PostalCodeLookup:
+    country_code: str
+    postal_code: str
+
+
+@dataclass
+class PostalCodeLocations:
+    """The locations found for one PostalCodeLookup of a batch, empty if none."""
+    country_code: str
+    postal_code: str
+    locations: List[PostalCode] = field(default_factory=list)
+
+
+POSTAL_CODE_FIELDS = tuple(f.name for f in fields(PostalCode))
+
+# Explicit column lists: postal_codes also holds internal columns such as place_key
+POSTAL_CODE_COLUMNS = ", ".join(POSTAL_CODE_FIELDS)
+POSTAL_CODE_COLUMNS_P = ", ".join(f"p.{name}" for name in POSTAL_CODE_FIELDS)
+
+# {columns} in the lookup queries is filled with the selected PostalCode columns
+# (see select_fields): all of them, or the ones a tool call asked for
+POSTAL_CODE_QUERY = """
+    SELECT {columns}
+    FROM postal_codes
+    WHERE country_code = ? AND postal_code = ?
+"""
+
+# Several postal codes of one country: a seek per code on the same index
+POSTAL_CODE_BATCH_QUERY = f"""
+    SELECT {POSTAL_CODE_COLUMNS}
+    FROM postal_codes
+    WHERE country_code = ? AND postal_code IN ({{placeholders}})
+"""
+# Postal codes per query of a batch, well below SQLite's limit on bound parameters
+POSTAL_CODE_BATCH_SIZE = 500
+
+PLACE_COLUMNS = ", ".join(f.name for f in fields(Place))
+PLACE_COLUMNS_P = ", ".join(f"p.{f.name}" for f in fields(Place))
+
+# Places with more postal codes first: the city before the hamlet of the same name
+PLACE_EXACT_QUERY = f"""
+    SELECT {PLACE_COLUMNS}
+    FROM places
+    WHERE country_code = ? AND place_key = ?
+    ORDER BY postal_code_count DESC, id
+    LIMIT ?
+"""
+
+PLACE_TRIGRAM_QUERY = f"""
+    SELECT {PLACE_COLUMNS_P}
+    FROM places_fts f
+    CROSS JOIN places p ON p.id = f.rowid
+    WHERE places_fts MATCH ? AND p.country_code = ? AND p.place_key != ?
+    LIMIT ?
+"""
+
+PLACE_LIKE_QUERY = f"""
+    SELECT {PLACE_COLUMNS}
+    FROM places
+    WHERE place_key LIKE ? ESCAPE '\\' AND country_code = ? AND place_key != ?
+    LIMIT ?
+"""
+
+CITY_EXACT_QUERY = """
+    SELECT {columns}
+    FROM postal_codes
+    WHERE country_code = ? AND place_key = ?
+    LIMIT ?
+"""
+
+# The CROSS JOIN pins the trigram index as the outer loop: otherwise the planner
+# prefers walking every row of the country and probing the index once per row.
+CITY_TRIGRAM_QUERY = """
+    SELECT {columns}
+    FROM postal_codes_fts f
+    CROSS JOIN postal_codes p ON p.rowid = f.rowid
+    WHERE postal_codes_fts MATCH ? AND p.country_code = ? AND p.place_key != ?
+    LIMIT ?
+"""
+
+# Distinct names of a country: the country is matched by the index too (see fuzzy_match)
+FUZZY_CANDIDATES_QUERY = """
+    SELECT place_key
+    FROM place_names_fts
+    WHERE place_names_fts MATCH ?
+    LIMIT ?
+"""
+# Edits a candidate name is guaranteed to be found with: the searched name is cut
+# into one more pieces than this, and an edit can only break one piece
+FUZZY_MAX_EDITS = 2
+# Candidate names read at most, in no particular order: it bounds the time of
+# a search whose pieces are common, not the candidates of a typical one
+FUZZY_MAX_CANDIDATES = 10000
+# Candidates ranked by trigram similarity that are then compared by edit distance
+FUZZY_RERANK_SIZE = 50
+# Candidates longer or shorter than the searched name by more than this fraction
+# of its length are skipped before computing their trigrams
+FUZZY_MAX_LENGTH_DIFFERENCE = 0.5
+# Results scoring less than this are not considered matches
+FUZZY_MIN_SCORE = 0.4
+
+# Autocompletion: a range seek on the (country_code, place_key) index
+PLACE_PREFIX_QUERY = f"""
+    SELECT {POSTAL_CODE_COLUMNS}
+    FROM postal_codes
+    WHERE country_code = ? AND place_key >= ? AND place_key < ?
+    ORDER BY place_key, rowid
+    LIMIT ?
+"""
+
+CITY_LIKE_QUERY = """
+    SELECT {columns}
+    FROM postal_codes
+    WHERE place_key LIKE ? ESCAPE '\\' AND country_code = ? AND place_key != ?
+    LIMIT ?
+"""
+
+# Points of the R*Tree inside a box; rows are stored as boxes of size zero
+RTREE_BOX_QUERY = """
+    SELECT id, min_lat, max_lat, min_lon, max_lon
+    FROM postal_codes_rtree
+    WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+"""
+
+RTREE_COUNT_QUERY = """
+    SELECT COUNT(*)
+    FROM postal_codes_rtree
+    WHERE max_lat >= ? AND min_lat <= ? AND max_lon >= ? AND min_lon <= ?
+"""
+
+# Coordinates of the rows in a box, with the exact values of the base table
+SPATIAL_SCAN_QUERY = """
+    SELECT p.rowid, p.latitude, p.longitude
+    FROM postal_codes_rtree r
+    CROSS JOIN postal_codes p ON p.rowid = r.id
+    WHERE r.max_lat >= ? AND r.min_lat <= ? AND r.max_lon >= ? AND r.min_lon <= ?
+"""
+SPATIAL_SCAN_COUNTRY_QUERY = SPATIAL_SCAN_QUERY + " AND p.country_code = ?"
+
+# Largest page returned by the spatial searches
+MAX_PAGE_SIZE = 100
+
+# Radius of the first box searched for the nearest postal codes, doubled until
+# enough rows are found, and precision of its bisection when it finds too many
+REVERSE_GEOCODE_RADIUS_KM = 5.0
+# Points read per requested result before the box is narrowed down
+REVERSE_GEOCODE_MAX_CANDIDATES = 16
+
+
 @dataclass
 class Country:
     country_code: str
@@ -45,10 +251,8 @@ async def countries(
         query += " AND LOWER(country_name) LIKE ?"
         params.append(f"%{search_term.lower()}%")
 
-    async with db.execute(query, tuple(params)) as cursor:
-        rows = await cursor.fetchall()
-        # Formatta il risultato come richiesto
-        return [Item(id=row["country_code"], label=row["country_name"]) for row in rows]
+    # Formatta il risultato come richiesto: id e label sono codice e nome del paese
+    return await fetch_records(db, query, tuple(params), Item)
 
 
 async def get_countries(
@@ -64,76 +268,544 @@ async def get_countries(
         query += " AND LOWER(country_name) LIKE ?"
         params.append(f"%{search_term.lower()}%")
     try:
-        async with db.execute(query, tuple(params)) as cursor:
-            rows = await cursor.fetchall()
-            # Converte le righe del DB in una lista di dizionari
-            vals = [Country(**dict(row)) for row in rows]
-            if vals is not None:
-                # Convert the value to JSON string for consistent return type
-                return vals
-            else:
-                return f"No data found for country '{search_term}'."
+        # Converte le righe del DB in una lista di Country
+        return await fetch_records(db, query, tuple(params), Country)
     except Exception as e:
         logger.error(f"Error retrieving data for country '{search_term}': {str(e)}", exc_info=True)
         return f"Error retrieving data for country '{search_term}': {str(e)}"
 
 
 
+async def get_data_generation(db: Connection) -> int:
+    """Data generation of the database, bumped by initdata at every sync."""
+    async with db.execute("SELECT value FROM metadata WHERE key = 'generation'") as cursor:
+        row = await cursor.fetchone()
+        return int(row[0]) if row else 0
+
+
+def cities_cache_key(country: str, city: str = "", top_k: int = 10, fuzzy: bool = False,
+                     distinct: bool = False, fields: Optional[Sequence[str]] = None) -> tuple:
+    """Cache key of a get_cities call: arguments normalized the way the query uses them."""
+    name = "cities_fuzzy" if fuzzy else "places" if distinct else "cities"
+    key = name, country.upper(), fold(city), top_k
+    return key + (tuple(sorted(set(fields))),) if fields else key
+
+
+def postal_code_cache_key(country: str, posta_code: str = "",
+                          fields: Optional[Sequence[str]] = None) -> tuple:
+    key = "postal_code", country.upper(), posta_code
+    return key + (tuple(sorted(set(fields))),) if fields else key
+
+
+def fts_phrase(text: str) -> str:
+    """Quotes a search term as an FTS5 phrase so it is matched literally."""
+    return '"' + text.replace('"', '""') + '"'
+
+
+def fuzzy_match(country: str, term: str) -> str:
+    """
+    FTS5 query of the candidate names of ``country`` for the folded name ``term``.
+
+    Names containing one of FUZZY_MAX_EDITS + 1 pieces of ``term`` are
+    candidates. Pieces must be trigrams at least: shorter names share any of
+    their trigrams instead.
+    """
+    parts = min(FUZZY_MAX_EDITS + 1, len(term) // 3)
+    pieces = chunks(term, parts) if parts > 1 else sorted(trigrams(term))
+    names = " OR ".join(fts_phrase(piece) for piece in pieces)
+    return f"country_tag : {fts_phrase(country.lower() + '~')} AND place_key : ({names})"
+
+
+def like_pattern(text: str) -> str:
+    """Escapes LIKE wildcards in a search term and wraps it for a substring match."""
+    escaped = text.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"%{escaped}%"
+
+
+def select_fields(record: type, requested: Optional[Sequence[str]] = None) -> Tuple[str, ...]:
+    """
+    The fields of the ``record`` dataclass to return: the ``requested`` ones, all if None.
+
+    Fields keep their declaration order. Raises ValueError for a name that
+    is not a field of ``record``.
+    """
+    names = tuple(f.name for f in fields(record))
+    if not requested:
+        return names
+    unknown = sorted(set(requested) - set(names))
+    if unknown:
+        raise ValueError(f"Unknown fields {', '.join(unknown)}; available fields: {', '.join(names)}.")
+    return tuple(name for name in names if name in requested)
+
+
+def project(records: list, selected: Sequence[str]) -> List[Dict[str, Any]]:
+    """The ``selected`` fields of each of ``records``, as dicts."""
+    return [{name: getattr(record, name) for name in selected} for record in records]
+
+
+def _decoder(record: type, requested: Optional[Sequence[str]]) -> Tuple[Tuple[str, ...], Callable[..., Any]]:
+    """The columns to read for the ``requested`` fields of ``record``, and what builds a result from them."""
+    selected = select_fields(record, requested)
+    if not requested:
+        return selected, record
+    return selected, lambda *row: dict(zip(selected, row))
+
+
+async def fetch_records(db: Connection, query: str, params, record: Callable[..., Any]) -> list:
+    """
+    Runs ``query`` and returns ``record(*row)`` for each of its rows.
+
+    The records are built by the cursor's row factory on the connection's
+    thread, straight from the tuples sqlite3 decodes: no sqlite3.Row or
+    dict is made per row.
+    """
+    async with db.execute(query, params) as cursor:
+        cursor.row_factory = lambda _, row: record(*row)
+        return await cursor.fetchall()
+
+
 async def get_cities(
         db: Connection,
         country: str,
         city: str = "",
+        top_k: int = 10,
+        fields: Optional[Sequence[str]] = None
+) -> Union[List[PostalCode], List[Dict[str, Any]], str]:
+    """
+    Searches for cities in the database based on a partial name.
+
+    Names are compared on their folded place_key, so the search ignores case
+    and accents. Exact matches come first and are an index seek on
+    (country_code, place_key); the remaining slots are filled with substring
+    matches from the trigram index (postal_codes_fts), or with a LIKE scan of
+    the country rows for terms shorter than a trigram. With ``fields``, only
+    those columns are read and each result is a dict of them.
+    """
+    term = fold(city)
+    country = country.upper()
+    try:
+        selected, record = _decoder(PostalCode, fields)
+    except ValueError as e:
+        return str(e)
+    if len(term) >= TRIGRAM_MIN_LENGTH:
+        substring_query = CITY_TRIGRAM_QUERY.format(columns=", ".join(f"p.{name}" for name in selected))
+        substring_term = fts_phrase(term)
+    else:
+        substring_query = CITY_LIKE_QUERY.format(columns=", ".join(selected))
+        substring_term = like_pattern(term)
+    try:
+        vals = await fetch_records(db, CITY_EXACT_QUERY.format(columns=", ".join(selected)),
+                                   (country, term, top_k), record)
+        if len(vals) < top_k:
+            params = (substring_term, country, term, top_k - len(vals))
+            vals.extend(await fetch_records(db, substring_query, params, record))
+        return vals
+    except Exception as e:
+        return f"Error retrieving data for country '{country}' city '{city}': {str(e)}"
+
+
+def _place(*row) -> Place:
+    place = Place(*row)
+    place.postal_codes = place.postal_codes.split(",")
+    return place
+
+
+async def get_places_by_name(
+        db: Connection,
+        country: str,
+        city: str = "",
+        top_k: int = 10
+) -> Union[List[Place], str]:
+    """
+    Like get_cities, but each result is a distinct place rather than a postal code row.
+
+    Searches the places table (see initdata.create_places_table) the same
+    way: exact names first, the ones with more postal codes before, then
+    substring matches from its trigram index or a LIKE scan.
+    """
+    term = fold(city)
+    country = country.upper()
+    if len(term) >= TRIGRAM_MIN_LENGTH:
+        substring_query, substring_term = PLACE_TRIGRAM_QUERY, fts_phrase(term)
+    else:
+        substring_query, substring_term = PLACE_LIKE_QUERY, like_pattern(term)
+    try:
+        vals = await fetch_records(db, PLACE_EXACT_QUERY, (country, term, top_k), _place)
+        if len(vals) < top_k:
+            params = (substring_term, country, term, top_k - len(vals))
+            vals.extend(await fetch_records(db, substring_query, params, _place))
+        return vals
+    except Exception as e:
+        return f"Error retrieving places for country '{country}' city '{city}': {str(e)}"
+
+
+def get_cities_from_snapshot(
+        snapshot: Snapshot,
+        country: str,
+        city: str = "",
         top_k: int = 10
 ) -> Union[List[PostalCode], str]:
     """
-    Searches for cities in the database based on a partial name.
+    get_cities served from a memory-mapped snapshot instead of SQLite.
+
+    Same matches, exact names first; the substring matches come in name
+    order rather than in rowid order.
     """
-    query = """
-            SELECT *
-            FROM postal_codes
-            WHERE country_code = ? \
-              AND (LOWER(place_name) = ? OR LOWER(place_name) LIKE ?) \
-              ORDER BY CASE WHEN LOWER(place_name) = ? THEN 0 ELSE 1 END \
-              LIMIT ? \
-            """
-    # The '%' are wildcards for the SQL LIKE search
-    params = (country.upper(), city.lower(), f"%{city.lower()}%", city.lower(), top_k)
     try:
-        async with db.execute(query, params) as cursor:
-            rows = await cursor.fetchall()
-            # Convert database rows to a list of dictionaries
-            logger.info(rows)
-            vals = [PostalCode(**dict(row)) for row in rows]
-            if vals is not None:
-                # Convert the value to JSON string for consistent return type
-                return vals
-            else:
-                return f"No data found for country '{country}' city '{city}'."
+        return [PostalCode(*row) for row in snapshot.cities(country, fold(city), top_k)]
     except Exception as e:
         return f"Error retrieving data for country '{country}' city '{city}': {str(e)}"
 
 
+async def get_fuzzy_cities(
+        db: Connection,
+        country: str,
+        city: str = "",
+        top_k: int = 10
+) -> Union[List[ScoredPostalCode], str]:
+    """
+    Searches for cities whose name is close to ``city``, tolerating typos.
+
+    Candidate names come from the trigram index of the distinct names of the
+    country (see fuzzy_match), at most FUZZY_MAX_CANDIDATES, and must be of a
+    similar length. They are ranked by trigram similarity, the best FUZZY_RERANK_SIZE are compared by edit
+    distance, and the rows of the best scoring names are returned, best
+    first. Names shorter than a trigram fall back to get_cities.
+    """
+    term = fold(city)
+    country = country.upper()
+    if len(term) < 3:
+        return await get_cities(db, country, city, top_k)
+    match = fuzzy_match(country, term)
+    try:
+        async with db.execute(FUZZY_CANDIDATES_QUERY, (match, FUZZY_MAX_CANDIDATES)) as cursor:
+            names = [row[0] for row in await cursor.fetchall()]
+        padded = padded_trigrams(term)
+        slack = max(2, int(len(term) * FUZZY_MAX_LENGTH_DIFFERENCE))
+        similar = nsmallest(
+            FUZZY_RERANK_SIZE,
+            ((-trigram_similarity(padded, padded_trigrams(name)), name) for name in names
+             if abs(len(name) - len(term)) <= slack),
+        )
+        ranked = []
+        for negated_similarity, name in similar:
+            distance = levenshtein(term, name)
+            name_score = score(distance, -negated_similarity, term, name)
+            if name_score >= FUZZY_MIN_SCORE:
+                ranked.append((-name_score, distance, name))
+        vals = []
+        query = CITY_EXACT_QUERY.format(columns=POSTAL_CODE_COLUMNS)
+        for negated_score, distance, name in sorted(ranked):
+            record = partial(ScoredPostalCode, score=-negated_score, edit_distance=distance)
+            vals.extend(await fetch_records(db, query, (country, name, top_k - len(vals)), record))
+            if len(vals) >= top_k:
+                break
+        return vals
+    except Exception as e:
+        return f"Error retrieving data for country '{country}' city '{city}': {str(e)}"
+
+
+async def get_places_by_prefix(
+        db: Connection,
+        country: str,
+        prefix: str = "",
+        limit: int = 10
+) -> Union[List[PostalCode], str]:
+    """Rows of the cities whose name starts with ``prefix``, in name order."""
+    start = fold(prefix)
+    try:
+        return await fetch_records(db, PLACE_PREFIX_QUERY,
+                                   (country.upper(), start, start + PREFIX_END, limit), PostalCode)
+    except Exception as e:
+        return f"Error retrieving data for country '{country}' prefix '{prefix}': {str(e)}"
+
+
+def get_places_by_prefix_from_snapshot(
+        snapshot: Snapshot,
+        country: str,
+        prefix: str = "",
+        limit: int = 10
+) -> Union[List[PostalCode], str]:
+    """get_places_by_prefix served from a memory-mapped snapshot; the rows of a name come in postal code order."""
+    try:
+        return [PostalCode(*row) for row in snapshot.places_by_prefix(country, fold(prefix), limit)]
+    except Exception as e:
+        return f"Error retrieving data for country '{country}' prefix '{prefix}': {str(e)}"
+
+
 async def get_postal_code(
         db: Connection,
         country: str,
+        posta_code: str = "",
+        fields: Optional[Sequence[str]] = None
+) -> Union[List[PostalCode], List[Dict[str, Any]], str]:
+    """Rows of a postal code; with ``fields``, dicts of only those columns."""
+    try:
+        selected, record = _decoder(PostalCode, fields)
+    except ValueError as e:
+        return str(e)
+    params = (country.upper(), posta_code)
+    try:
+        return await fetch_records(db, POSTAL_CODE_QUERY.format(columns=", ".join(selected)),
+                                   params, record)
+    except Exception as e:
+        return f"Error retrieving data for country '{country}' postal code '{posta_code}': {str(e)}"
+
+
+def get_postal_code_from_snapshot(
+        snapshot: Snapshot,
+        country: str,
         posta_code: str = ""
 ) -> Union[List[PostalCode], str]:
-    query = """
-            SELECT *
-            FROM postal_codes
-            WHERE country_code = ? \
-              AND postal_code = ? \
-            """
-    params = (country.upper(), posta_code)
+    """get_postal_code served from a memory-mapped snapshot instead of SQLite."""
     try:
-        async with db.execute(query, params) as cursor:
-            rows = await cursor.fetchall()
-            # Convert database rows to a list of dictionaries
-            vals = [PostalCode(**dict(row)) for row in rows]
-            if vals is not None:
-                # Convert the value to JSON string for consistent return type
-                return vals
-            else:
-                return f"No data found for country '{country}' city '{city}'."
+        return [PostalCode(*row) for row in snapshot.postal_code(country, posta_code)]
     except Exception as e:
-        return f"Error retrieving data for country '{country}' city '{city}': {str(e)}"
+        return f"Error retrieving data for country '{country}' postal code '{posta_code}': {str(e)}"
+
+
+async def get_postal_codes(
+        db: Connection,
+        items: List[Tuple[str, str]]
+) -> Union[Dict[Tuple[str, str], List[PostalCode]], str]:
+    """
+    Resolves many (country, postal code) pairs at once.
+
+    Pairs are grouped by country and each group is resolved with one indexed
+    query (chunks of POSTAL_CODE_BATCH_SIZE codes). Returns the locations of
+    every distinct pair, keyed by (upper-case country, postal code).
+    """
+    by_country = defaultdict(set)
+    for country, code in items:
+        by_country[country.upper()].add(code)
+    found = {(country, code): [] for country, codes in by_country.items() for code in codes}
+    try:
+        for country, codes in by_country.items():
+            codes = sorted(codes)
+            for start in range(0, len(codes), POSTAL_CODE_BATCH_SIZE):
+                chunk = codes[start:start + POSTAL_CODE_BATCH_SIZE]
+                query = POSTAL_CODE_BATCH_QUERY.format(placeholders=", ".join("?" * len(chunk)))
+                for location in await fetch_records(db, query, (country, *chunk), PostalCode):
+                    found[country, location.postal_code].append(location)
+        return found
+    except Exception as e:
+        return f"Error retrieving {len(items)} postal codes: {str(e)}"
+
+
+async def _box_count(db: Connection, boxes) -> int:
+    count = 0
+    for box in boxes:
+        async with db.execute(RTREE_COUNT_QUERY, box) as cursor:
+            count += (await cursor.fetchone())[0]
+    return count
+
+
+async def _box_points(db: Connection, latitude: float, longitude: float, boxes) -> list:
+    """(distance, rowid) of the R*Tree points in ``boxes``."""
+    points = []
+    for box in boxes:
+        async with db.execute(RTREE_BOX_QUERY, box) as cursor:
+            for rowid, min_lat, max_lat, min_lon, max_lon in await cursor.fetchall():
+                distance = haversine_km(latitude, longitude,
+                                        (min_lat + max_lat) / 2, (min_lon + max_lon) / 2)
+                points.append((distance, rowid))
+    return points
+
+
+async def nearest_rowids(db: Connection, latitude: float, longitude: float,
+                         limit: int) -> List[int]:
+    """
+    Rowids of the ``limit`` postal codes nearest to a point, closest first.
+
+    Only the R*Tree is read. The box around the point doubles until it
+    holds ``limit`` points, then is narrowed down by bisection while it
+    holds too many; both steps only count points. The distance of the
+    ``limit``-th nearest point of the box bounds the answer: the points within
+    that distance are the result. The tree stores 32-bit floats, which is
+    precise to about a metre.
+    """
+    low, radius = 0.0, REVERSE_GEOCODE_RADIUS_KM
+    count = await _box_count(db, bounding_boxes(latitude, longitude, radius))
+    while count < limit and radius < MAX_DISTANCE_KM:
+        low, radius = radius, radius * 2
+        count = await _box_count(db, bounding_boxes(latitude, longitude, radius))
+    while count > REVERSE_GEOCODE_MAX_CANDIDATES * limit and radius - low > REVERSE_GEOCODE_RADIUS_KM:
+        middle = (low + radius) / 2
+        middle_count = await _box_count(db, bounding_boxes(latitude, longitude, middle))
+        if middle_count < limit:
+            low = middle
+        else:
+            radius, count = middle, middle_count
+    points = await _box_points(db, latitude, longitude, bounding_boxes(latitude, longitude, radius))
+    if len(points) >= limit:
+        bound = nsmallest(limit, points)[-1][0]
+        if bound > radius:
+            # The box holds a circle of ``radius`` only: closer points may lie out of it
+            points = await _box_points(db, latitude, longitude,
+                                       bounding_boxes(latitude, longitude, bound))
+    return [rowid for _, rowid in nsmallest(limit, points)]
+
+
+def _nearby(latitude: float, longitude: float, *row) -> NearbyPostalCode:
+    """A postal code row with its distance from (latitude, longitude)."""
+    nearby = NearbyPostalCode(*row)
+    nearby.distance_km = round(haversine_km(latitude, longitude, nearby.latitude, nearby.longitude), 3)
+    return nearby
+
+
+async def get_nearest_postal_codes(
+        db: Connection,
+        latitude: float,
+        longitude: float,
+        limit: int = 10
+) -> Union[List[NearbyPostalCode], str]:
+    """
+    Finds the postal codes nearest to a point, with their great-circle distance.
+
+    Candidates come from the spatial index (see nearest_rowids), so a lookup
+    only examines rows around the point; the rows are then read by rowid.
+    """
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return f"Invalid coordinates ({latitude}, {longitude})."
+    try:
+        rowids = await nearest_rowids(db, latitude, longitude, max(1, limit))
+        placeholders = ", ".join("?" * len(rowids))
+        query = f"SELECT {POSTAL_CODE_COLUMNS} FROM postal_codes WHERE rowid IN ({placeholders})"
+        vals = await fetch_records(db, query, rowids, partial(_nearby, latitude, longitude))
+        return sorted(vals, key=lambda val: val.distance_km)
+    except Exception as e:
+        return f"Error reverse geocoding ({latitude}, {longitude}): {str(e)}"
+
+
+def encode_cursor(key: Tuple[float, int]) -> str:
+    distance, rowid = key
+    return f"{distance!r}:{rowid}"
+
+
+def decode_cursor(cursor: str) -> Tuple[float, int]:
+    distance, rowid = cursor.split(":")
+    return float(distance), int(rowid)
+
+
+async def _spatial_page(
+        db: Connection,
+        latitude: float,
+        longitude: float,
+        boxes,
+        country: Optional[str],
+        limit: int,
+        cursor: Optional[str],
+        accept: Callable[[float, float, float], bool],
+) -> Union[PlacesPage, str]:
+    """
+    One page of the rows in ``boxes`` accepted by ``accept(lat, lon, distance)``.
+
+    Rows are ordered by (distance from the point, rowid) and a page starts
+    after the key in ``cursor``. Candidates are streamed from the R*Tree and
+    only the best ``limit`` + 1 keys are kept, so memory does not depend on
+    how many rows the boxes hold.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    try:
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError:
+        return f"Invalid cursor '{cursor}'."
+    query = SPATIAL_SCAN_COUNTRY_QUERY if country else SPATIAL_SCAN_QUERY
+    # Max-heap of the smallest keys seen, by negation
+    best = []
+    try:
+        for box in boxes:
+            params = (*box, country.upper()) if country else box
+            async with db.execute(query, params) as rows:
+                async for rowid, lat, lon in rows:
+                    distance = haversine_km(latitude, longitude, lat, lon)
+                    key = (distance, rowid)
+                    if (after is not None and key <= after) or not accept(lat, lon, distance):
+                        continue
+                    if len(best) <= limit:
+                        heappush(best, (-distance, -rowid))
+                    elif key < (-best[0][0], -best[0][1]):
+                        heappushpop(best, (-distance, -rowid))
+        keys = sorted((-distance, -rowid) for distance, rowid in best)
+        page, more = keys[:limit], len(keys) > limit
+
+        placeholders = ", ".join("?" * len(page))
+        query = f"SELECT rowid, {POSTAL_CODE_COLUMNS} FROM postal_codes WHERE rowid IN ({placeholders})"
+        by_rowid = dict(await fetch_records(db, query, [rowid for _, rowid in page],
+                                            lambda rowid, *row: (rowid, NearbyPostalCode(*row))))
+        items = []
+        for distance, rowid in page:
+            item = by_rowid[rowid]
+            item.distance_km = round(distance, 3)
+            items.append(item)
+        return PlacesPage(items, encode_cursor(page[-1]) if more else None)
+    except Exception as e:
+        return f"Error searching places around ({latitude}, {longitude}): {str(e)}"
+
+
+async def get_places_near(
+        db: Connection,
+        latitude: float,
+        longitude: float,
+        radius_km: float = 10.0,
+        country: Optional[str] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None
+) -> Union[PlacesPage, str]:
+    """
+    Postal codes within ``radius_km`` of a point, nearest first, a page at a time.
+
+    The R*Tree prunes the candidates to the bounding box of the circle; their
+    exact great-circle distance decides whether they are in it.
+    """
+    if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+        return f"Invalid coordinates ({latitude}, {longitude})."
+    if radius_km <= 0:
+        return f"Invalid radius {radius_km} km."
+    radius_km = min(radius_km, MAX_DISTANCE_KM)
+    return await _spatial_page(
+        db, latitude, longitude, bounding_boxes(latitude, longitude, radius_km),
+        country, limit, cursor, lambda lat, lon, distance: distance <= radius_km,
+    )
+
+
+async def get_places_in_box(
+        db: Connection,
+        min_latitude: float,
+        min_longitude: float,
+        max_latitude: float,
+        max_longitude: float,
+        country: Optional[str] = None,
+        limit: int = 20,
+        cursor: Optional[str] = None
+) -> Union[PlacesPage, str]:
+    """
+    Postal codes inside a latitude/longitude box, a page at a time.
+
+    Rows are ordered by distance from the centre of the box. A box whose
+    ``min_longitude`` is greater than ``max_longitude`` crosses the
+    antimeridian.
+    """
+    if not (-90 <= min_latitude <= max_latitude <= 90
+            and -180 <= min_longitude <= 180 and -180 <= max_longitude <= 180):
+        return (f"Invalid box ({min_latitude}, {min_longitude}) - "
+                f"({max_latitude}, {max_longitude}).")
+    center_latitude = (min_latitude + max_latitude) / 2
+    if min_longitude <= max_longitude:
+        boxes = [(min_latitude, max_latitude, min_longitude, max_longitude)]
+        center_longitude = (min_longitude + max_longitude) / 2
+    else:
+        boxes = [(min_latitude, max_latitude, min_longitude, 180.0),
+                 (min_latitude, max_latitude, -180.0, max_longitude)]
+        center_longitude = (min_longitude + max_longitude + 360) / 2
+        if center_longitude > 180:
+            center_longitude -= 360
+
+    def inside(lat: float, lon: float, distance: float) -> bool:
+        # The R*Tree rounds to 32-bit floats: check the exact coordinates
+        in_longitude = min_longitude <= lon <= max_longitude if min_longitude <= max_longitude \
+            else lon >= min_longitude or lon <= max_longitude
+        return min_latitude <= lat <= max_latitude and in_longitude
+
+    return await _spatial_page(db, center_latitude, center_longitude, boxes,
+                               country, limit, cursor, inside)
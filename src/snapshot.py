@@ -0,0 +1,289 @@
+"""
+Read-only, memory-mapped snapshot of the postal codes.
+
+Every process serving the data maps the same file, so they all share one
+copy of it in the OS page cache, and opening it is a matter of reading the
+header: nothing is parsed or copied until a lookup touches it.
+
+Layout: a header, a table of sections, then the sections, each aligned to
+8 bytes. Numbers are in the byte order of the machine that wrote the file.
+
+- rows, sorted by (country_code, postal_code, rowid): one fixed-width array
+  per column. Text columns hold indexes into the string table (NO_STRING
+  for NULL), latitude/longitude are doubles (NaN for NULL) and accuracy an
+  int (-1 for NULL).
+- string table: the distinct UTF-8 strings of a country end to end, and the
+  offset of each one.
+- place keys: the distinct folded place names of each country, sorted, each
+  preceded by a newline so a substring search never spans two names; with
+  the rows of each name, in postal code order.
+- countries: the range of rows and of place keys of each country.
+"""
+import math
+import mmap
+import pathlib
+import struct
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import groupby
+from operator import itemgetter
+from typing import Dict, List, Optional, Tuple
+
+FORMAT_VERSION = 1
+MAGIC = b"GNSNAP\x00\x00"
+BYTE_ORDER_MARK = 0x01020304
+NO_STRING = 0xFFFFFFFF
+
+# magic, version, byte order mark, data generation, rows, sections
+HEADER = struct.Struct("=8sIIQQI")
+# name, typecode, offset, length in items
+SECTION = struct.Struct("=16s1s7xQQ")
+
+TEXT_COLUMNS = (
+    "postal_code", "place_name", "state_name", "state_code",
+    "county_name", "county_code", "community_name", "community_code",
+)
+# Columns of the exported rows, in the order of services.PostalCode
+COLUMNS = ("country_code",) + TEXT_COLUMNS + ("latitude", "longitude", "accuracy")
+
+EXPORT_QUERY = f"""
+    SELECT country_code, place_key, {", ".join(COLUMNS[1:])}
+    FROM postal_codes
+    ORDER BY country_code, postal_code, rowid
+"""
+
+# Per country: first row, end row, first place key, end place key
+COUNTRY_FIELDS = 4
+
+SECTIONS = set(TEXT_COLUMNS) | {
+    "latitude", "longitude", "accuracy", "string_offsets", "strings", "key_offsets", "keys",
+    "key_row_starts", "key_rows", "country_codes", "countries",
+}
+
+
+def _align(offset: int) -> int:
+    return (offset + 7) & ~7
+
+
+def write_snapshot(con, path: pathlib.Path, generation: int):
+    """
+    Writes the postal codes of ``con`` to a snapshot at ``path``.
+
+    The rows are read in a single pass; strings are deduplicated per
+    country, so only one country's distinct strings are held as objects.
+    """
+    sections: Dict[str, array] = {name: array("I") for name in TEXT_COLUMNS}
+    sections.update(
+        latitude=array("d"), longitude=array("d"), accuracy=array("i"),
+        string_offsets=array("I", [0]), key_offsets=array("I"), key_row_starts=array("I"),
+        key_rows=array("I"), country_codes=array("B"), countries=array("I"),
+    )
+    strings, keys = bytearray(), bytearray()
+    for country_code, country_rows in groupby(con.execute(EXPORT_QUERY), key=itemgetter(0)):
+        first_row = len(sections["latitude"])
+        first_key = len(sections["key_offsets"])
+        string_ids: Dict[str, int] = {}
+        place_rows: List[Tuple[bytes, int]] = []
+        for row_number, row in enumerate(country_rows, first_row):
+            _, place_key, *text, latitude, longitude, accuracy = row
+            for name, value in zip(TEXT_COLUMNS, text):
+                if value is None:
+                    sections[name].append(NO_STRING)
+                    continue
+                string_id = string_ids.get(value)
+                if string_id is None:
+                    string_id = string_ids[value] = len(sections["string_offsets"]) - 1
+                    strings += value.encode()
+                    sections["string_offsets"].append(len(strings))
+                sections[name].append(string_id)
+            sections["latitude"].append(math.nan if latitude is None else latitude)
+            sections["longitude"].append(math.nan if longitude is None else longitude)
+            sections["accuracy"].append(-1 if accuracy is None else accuracy)
+            if place_key:
+                place_rows.append((place_key.encode(), row_number))
+        # Rows were read by postal code: a stable sort by name keeps that order within a name
+        place_rows.sort(key=lambda item: item[0])
+        previous = None
+        for place_key, row_number in place_rows:
+            if place_key != previous:
+                keys += b"\n"
+                sections["key_offsets"].append(len(keys))
+                keys += place_key
+                sections["key_row_starts"].append(len(sections["key_rows"]))
+                previous = place_key
+            sections["key_rows"].append(row_number)
+        sections["country_codes"].extend(country_code.encode().ljust(2)[:2])
+        sections["countries"].extend(
+            (first_row, len(sections["latitude"]), first_key, len(sections["key_offsets"])))
+    # End markers, so that item i always spans [offsets[i], offsets[i + 1])
+    sections["key_offsets"].append(len(keys) + 1)
+    sections["key_row_starts"].append(len(sections["key_rows"]))
+    sections["strings"] = array("B", strings)
+    sections["keys"] = array("B", keys + b"\n")
+
+    rows = len(sections["latitude"])
+    offset = _align(HEADER.size + SECTION.size * len(sections))
+    table = []
+    for name, items in sections.items():
+        table.append(SECTION.pack(name.encode(), items.typecode.encode(), offset, len(items)))
+        offset = _align(offset + items.itemsize * len(items))
+    with open(path, "wb") as fh:
+        fh.write(HEADER.pack(MAGIC, FORMAT_VERSION, BYTE_ORDER_MARK, generation, rows, len(sections)))
+        fh.write(b"".join(table))
+        for items in sections.values():
+            fh.write(b"\0" * (_align(fh.tell()) - fh.tell()))
+            items.tofile(fh)
+
+
+class Snapshot:
+    """
+    A snapshot file mapped in memory, answering lookups without SQLite.
+
+    Lookups return rows as tuples in the order of COLUMNS. close() must be
+    called once no lookup can be running.
+    """
+
+    def __init__(self, path: pathlib.Path):
+        self.path = pathlib.Path(path)
+        with open(self.path, "rb") as fh:
+            self._mmap = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        self._views = []
+        try:
+            self._open()
+        except Exception:
+            self.close()
+            raise
+
+    def _open(self):
+        if len(self._mmap) < HEADER.size:
+            raise ValueError(f"{self.path} is not a postal code snapshot")
+        magic, version, byte_order, self.generation, self.rows, count = \
+            HEADER.unpack_from(self._mmap)
+        if magic != MAGIC:
+            raise ValueError(f"{self.path} is not a postal code snapshot")
+        if version != FORMAT_VERSION:
+            raise ValueError(f"{self.path} has snapshot format {version}, expected {FORMAT_VERSION}")
+        if byte_order != BYTE_ORDER_MARK:
+            raise ValueError(f"{self.path} was written on a machine with another byte order")
+        view = memoryview(self._mmap)
+        self._views.append(view)
+        sections = {}
+        offsets = {}
+        for i in range(count):
+            name, typecode, offset, length = SECTION.unpack_from(self._mmap, HEADER.size + SECTION.size * i)
+            name, typecode = name.rstrip(b"\0").decode(), typecode.decode()
+            section = view[offset:offset + array(typecode).itemsize * length].cast(typecode)
+            self._views.append(section)
+            sections[name], offsets[name] = section, offset
+        if set(sections) != SECTIONS:
+            raise ValueError(f"{self.path} is missing sections {sorted(SECTIONS - set(sections))}")
+        self._columns = [sections[name] for name in TEXT_COLUMNS]
+        self._latitude, self._longitude = sections["latitude"], sections["longitude"]
+        self._accuracy = sections["accuracy"]
+        self._string_offsets, self._strings = sections["string_offsets"], sections["strings"]
+        self._key_offsets = sections["key_offsets"]
+        # Substring searches run on the mmap itself, which has find()
+        self._keys_start = offsets["keys"]
+        self._key_row_starts, self._key_rows = sections["key_row_starts"], sections["key_rows"]
+        codes, ranges = bytes(sections["country_codes"]), sections["countries"]
+        self._countries = {
+            codes[2 * i:2 * i + 2].decode(): tuple(ranges[COUNTRY_FIELDS * i:COUNTRY_FIELDS * (i + 1)])
+            for i in range(len(codes) // 2)
+        }
+
+    def close(self):
+        # Sections first: they are slices of the view of the whole file
+        for view in reversed(self._views):
+            view.release()
+        self._mmap.close()
+
+    @property
+    def nbytes(self) -> int:
+        return len(self._mmap)
+
+    def _string(self, string_id: int) -> Optional[str]:
+        if string_id == NO_STRING:
+            return None
+        return str(self._strings[self._string_offsets[string_id]:self._string_offsets[string_id + 1]],
+                   "utf-8")
+
+    def _postal_code(self, row: int) -> bytes:
+        string_id = self._columns[0][row]
+        if string_id == NO_STRING:
+            # NULL sorts first in SQLite, like the empty string here
+            return b""
+        return bytes(self._strings[self._string_offsets[string_id]:self._string_offsets[string_id + 1]])
+
+    def _key(self, key: int) -> bytes:
+        return self._mmap[self._keys_start + self._key_offsets[key]:
+                          self._keys_start + self._key_offsets[key + 1] - 1]
+
+    def row(self, country_code: str, row: int) -> tuple:
+        latitude, longitude, accuracy = self._latitude[row], self._longitude[row], self._accuracy[row]
+        return (
+            country_code,
+            *(self._string(column[row]) for column in self._columns),
+            None if math.isnan(latitude) else latitude,
+            None if math.isnan(longitude) else longitude,
+            None if accuracy == -1 else accuracy,
+        )
+
+    def postal_code(self, country_code: str, postal_code: str) -> List[tuple]:
+        """Rows of a postal code."""
+        country_code = country_code.upper()
+        first_row, end_row, _, _ = self._countries.get(country_code, (0, 0, 0, 0))
+        code = postal_code.encode()
+        first = bisect_left(range(end_row), code, first_row, end_row, key=self._postal_code)
+        last = bisect_right(range(end_row), code, first, end_row, key=self._postal_code)
+        return [self.row(country_code, row) for row in range(first, last)]
+
+    def _key_rows_of(self, key: int, limit: int) -> range:
+        start = self._key_row_starts[key]
+        return range(start, min(self._key_row_starts[key + 1], start + limit))
+
+    def places_by_prefix(self, country_code: str, prefix: str, limit: int) -> List[tuple]:
+        """
+        Rows of the names starting with ``prefix`` (a folded name), in name order.
+
+        The rows of a name come in postal code order.
+        """
+        country_code = country_code.upper()
+        _, _, first_key, end_key = self._countries.get(country_code, (0, 0, 0, 0))
+        term = prefix.encode()
+        rows: List[int] = []
+        key = bisect_left(range(end_key), term, first_key, end_key, key=self._key)
+        while key < end_key and len(rows) < limit and self._key(key).startswith(term):
+            rows.extend(self._key_rows[i] for i in self._key_rows_of(key, limit - len(rows)))
+            key += 1
+        return [self.row(country_code, row) for row in rows]
+
+    def cities(self, country_code: str, place_key: str, limit: int) -> List[tuple]:
+        """
+        Rows of the names equal to ``place_key`` (a folded name), then of the names containing it.
+
+        Names containing it come in name order; the rows of a name in postal code order.
+        """
+        country_code = country_code.upper()
+        _, _, first_key, end_key = self._countries.get(country_code, (0, 0, 0, 0))
+        if limit <= 0 or first_key == end_key or "\n" in place_key:
+            return []
+        term = place_key.encode()
+        rows: List[int] = []
+        exact = bisect_left(range(end_key), term, first_key, end_key, key=self._key)
+        if exact < end_key and self._key(exact) == term:
+            rows.extend(self._key_rows[i] for i in self._key_rows_of(exact, limit))
+        else:
+            exact = None
+        # A substring search over the country's names, end to end
+        position, end = self._key_offsets[first_key], self._key_offsets[end_key] - 1
+        while len(rows) < limit:
+            position = self._mmap.find(term, self._keys_start + position, self._keys_start + end)
+            if position < 0:
+                break
+            position -= self._keys_start
+            key = bisect_right(self._key_offsets, position, first_key, end_key) - 1
+            if key != exact:
+                rows.extend(self._key_rows[i] for i in self._key_rows_of(key, limit - len(rows)))
+            # Resume at the next name
+            position = self._key_offsets[key + 1]
+        return [self.row(country_code, row) for row in rows]
@@ -0,0 +1,150 @@
+import asyncio
+import time
+
+import aiosqlite
+import pytest
+import pytest_asyncio
+
+from admission import CallLimiter, DeadlineExceeded, _deadline, current_deadline, parse_timeouts, \
+    run_interruptible
+from profiling import QueryTracer
+
+# Counts to ``?``: long enough to need the progress handler to stop it
+LONG_QUERY = """
+    WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers WHERE n < ?)
+    SELECT COUNT(*) FROM numbers
+"""
+
+
+async def count(db, n: int) -> int:
+    async with db.execute(LONG_QUERY, (n,)) as cursor:
+        return (await cursor.fetchone())[0]
+
+
+@pytest_asyncio.fixture
+async def traced_db():
+    db = await aiosqlite.connect(":memory:")
+    tracer = await QueryTracer().attach(db)
+    yield db, tracer
+    await db.close()
+
+
+class TestParseTimeouts:
+
+    def test_parse(self):
+        assert parse_timeouts(" find_cities_by_name=2, reverse_geocode=0.5,") == {
+            "find_cities_by_name": 2.0, "reverse_geocode": 0.5}
+        assert parse_timeouts("") == {}
+
+    def test_invalid(self):
+        with pytest.raises(ValueError):
+            parse_timeouts("find_cities_by_name")
+
+
+class TestRunInterruptible:
+
+    @pytest.mark.asyncio
+    async def test_without_deadline(self, traced_db):
+        db, tracer = traced_db
+        assert await run_interruptible(tracer, count(db, 10000)) == 10000
+        assert not tracer.interrupted
+        assert tracer.vm_steps > 0
+
+    @pytest.mark.asyncio
+    async def test_stopped_at_the_deadline(self, traced_db):
+        db, tracer = traced_db
+        limiter = CallLimiter(1, 0, timeout=0.2)
+
+        async def query():
+            return await run_interruptible(tracer, count(db, 10 ** 10))
+
+        started = time.monotonic()
+        result = await limiter.instrument_tool(query)()
+        assert result.startswith("query took longer than 0.2s")
+        assert time.monotonic() - started < 5
+        assert limiter.timed_out == 1
+        assert await run_interruptible(tracer, count(db, 10)) == 10
+
+    @pytest.mark.asyncio
+    async def test_deadline_of_the_progress_handler(self, traced_db):
+        db, tracer = traced_db
+        # Without the wait_for of a CallLimiter, only the progress handler stops the query
+        token = _deadline.set(time.monotonic() + 0.1)
+        try:
+            with pytest.raises(DeadlineExceeded):
+                await run_interruptible(tracer, count(db, 10 ** 10))
+        finally:
+            _deadline.reset(token)
+        assert tracer.interrupted
+        assert tracer.deadline is None
+
+    @pytest.mark.asyncio
+    async def test_cancellation_stops_the_query(self, traced_db):
+        db, tracer = traced_db
+        task = asyncio.ensure_future(run_interruptible(tracer, count(db, 10 ** 10)))
+        await asyncio.sleep(0.1)
+        started = time.monotonic()
+        task.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await task
+        assert time.monotonic() - started < 5
+        # The connection is free again
+        assert await asyncio.wait_for(count(db, 10), 1) == 10
+
+
+class TestCallLimiter:
+
+    @pytest.mark.asyncio
+    async def test_queue_then_reject(self):
+        limiter = CallLimiter(1, 1)
+        release = asyncio.Event()
+
+        async def lookup(value):
+            await release.wait()
+            return value
+
+        call = limiter.instrument_tool(lookup)
+        first = asyncio.ensure_future(call(1))
+        second = asyncio.ensure_future(call(2))
+        await asyncio.sleep(0.01)
+        assert limiter.status() == {"running": 1, "waiting": 1, "rejected": 0, "timed_out": 0}
+        assert (await call(3)).startswith("Server busy: 1 calls running and 1 waiting")
+        release.set()
+        assert await asyncio.gather(first, second) == [1, 2]
+        assert limiter.status() == {"running": 0, "waiting": 0, "rejected": 1, "timed_out": 0}
+
+    @pytest.mark.asyncio
+    async def test_cancelled_while_queued(self):
+        limiter = CallLimiter(1, 5)
+        release = asyncio.Event()
+
+        async def lookup():
+            await release.wait()
+            return "done"
+
+        call = limiter.instrument_tool(lookup)
+        first = asyncio.ensure_future(call())
+        queued = asyncio.ensure_future(call())
+        await asyncio.sleep(0.01)
+        queued.cancel()
+        await asyncio.sleep(0.01)
+        assert limiter.waiting == 0
+        release.set()
+        assert await first == "done"
+        assert limiter.running == 0
+
+    @pytest.mark.asyncio
+    async def test_deadline_per_tool(self):
+        limiter = CallLimiter(2, 0, timeout=5, timeouts={"slow": 0.05})
+
+        async def slow():
+            await asyncio.sleep(10)
+
+        async def deadline():
+            return current_deadline()
+
+        assert "took longer than 0.05s" in await limiter.instrument_tool(slow)()
+        remaining = await limiter.instrument_tool(deadline)() - time.monotonic()
+        assert 4 < remaining <= 5
+        assert current_deadline() is None
+        assert limiter.running == 0
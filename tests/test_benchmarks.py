@@ -0,0 +1,36 @@
+import sqlite3
+
+from benchmarks.results import compare, summarize
+from benchmarks.synthetic import COUNTRY_NAMES, build_database, generate_rows
+
+
+class TestSynthetic:
+
+    def test_same_seed_same_rows(self):
+        assert list(generate_rows(200)) == list(generate_rows(200))
+        assert list(generate_rows(200, seed=1)) != list(generate_rows(200))
+
+    def test_build_database(self, tmp_path):
+        path = tmp_path / "bench.db"
+        build_database(path, 500)
+        with sqlite3.connect(path) as con:
+            assert con.execute("SELECT COUNT(*) FROM postal_codes").fetchone()[0] == 500
+            assert con.execute("SELECT COUNT(*) FROM countries").fetchone()[0] == 2 * len(COUNTRY_NAMES)
+        con.close()
+
+
+class TestResults:
+
+    def test_summarize(self):
+        summary = summarize([float(i) for i in range(1, 101)], elapsed=2.0)
+        assert summary["p50_ms"] == 51.0
+        assert summary["p99_ms"] == 100.0
+        assert summary["throughput_per_s"] == 50.0
+
+    def test_compare_flags_regressions_by_unit(self):
+        base = {"results": {"lookup": {"p95_ms": 1.0, "throughput_per_s": 100.0, "count": 10}}}
+        new = {"results": {"lookup": {"p95_ms": 1.5, "throughput_per_s": 105.0, "count": 20}}}
+        rows = {row["metric"]: row for row in compare(base, new, 0.1)}
+        assert set(rows) == {"p95_ms", "throughput_per_s"}
+        assert rows["p95_ms"]["regression"]
+        assert not rows["throughput_per_s"]["regression"]
@@ -0,0 +1,116 @@
+import pytest
+
+from cache import ResultCache, estimate_size
+from services import PostalCode, cities_cache_key
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestResultCache:
+
+    def test_hit_and_miss_counters(self):
+        cache = ResultCache()
+        assert cache.get("a") == (False, None)
+        cache.put("a", 1)
+        assert cache.get("a") == (True, 1)
+        assert (cache.hits, cache.misses) == (1, 1)
+
+    def test_evicts_least_recently_used(self):
+        cache = ResultCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        cache.get("a")
+        cache.put("c", 3)
+        assert cache.get("b") == (False, None)
+        assert cache.get("a") == (True, 1)
+        assert cache.evictions == 1
+
+    def test_bounded_by_bytes(self):
+        value = (PostalCode("IT", "00118", "Roma"),)
+        cache = ResultCache(max_bytes=estimate_size(value) * 2)
+        for i in range(5):
+            cache.put(i, value)
+        assert len(cache) == 2
+        assert cache.bytes <= cache.max_bytes
+        assert cache.evictions == 3
+
+    def test_entries_expire_after_ttl(self):
+        clock = FakeClock()
+        cache = ResultCache(ttl=10, clock=clock)
+        cache.put("a", 1)
+        clock.now = 9.9
+        assert cache.get("a") == (True, 1)
+        clock.now = 10
+        assert cache.get("a") == (False, None)
+        assert cache.expirations == 1
+        assert cache.bytes == 0
+
+    def test_new_generation_invalidates_entries(self):
+        cache = ResultCache(generation=1)
+        cache.put("a", 1)
+        cache.set_generation(2)
+        assert cache.get("a") == (False, None)
+        assert cache.stats()["generation"] == 2
+
+    def test_keys_are_normalized(self):
+        assert cities_cache_key("it", "FORLÌ", 10) == cities_cache_key("IT", "forli", 10)
+        assert cities_cache_key("IT", "roma", fields=["place_name", "postal_code"]) == \
+               cities_cache_key("IT", "roma", fields=["postal_code", "place_name"])
+        assert cities_cache_key("IT", "roma", fields=["place_name"]) != cities_cache_key("IT", "roma")
+
+    @pytest.mark.asyncio
+    async def test_get_or_compute_skips_error_strings(self):
+        cache = ResultCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            return "Error retrieving data"
+
+        await cache.get_or_compute("k", compute)
+        await cache.get_or_compute("k", compute)
+        assert len(calls) == 2
+
+    @pytest.mark.asyncio
+    async def test_get_or_compute_drops_results_of_old_generation(self):
+        cache = ResultCache(generation=1)
+
+        async def compute():
+            cache.set_generation(2)
+            return [1]
+
+        assert await cache.get_or_compute("k", compute) == [1]
+        assert len(cache) == 0
+
+    @pytest.mark.asyncio
+    async def test_get_or_compute_many_computes_only_missing_keys(self):
+        cache = ResultCache()
+        cache.put("a", (1,))
+        calls = []
+
+        async def compute(missing):
+            calls.append(missing)
+            return {key: [key] for key in missing}
+
+        assert await cache.get_or_compute_many(["a", "b", "b", "c"], compute) == {
+            "a": [1], "b": ["b"], "c": ["c"]}
+        assert calls == [["b", "c"]]
+        assert await cache.get_or_compute_many(["c"], compute) == {"c": ["c"]}
+        assert len(calls) == 1
+
+    @pytest.mark.asyncio
+    async def test_get_or_compute_many_returns_errors(self):
+        cache = ResultCache()
+
+        async def compute(missing):
+            return "Error retrieving data"
+
+        assert await cache.get_or_compute_many(["a"], compute) == "Error retrieving data"
+        assert len(cache) == 0
@@ -0,0 +1,153 @@
+import asyncio
+import os
+import sqlite3
+
+import pytest
+import pytest_asyncio
+
+import initdata
+from cache import ResultCache
+from datastore import DataStore
+
+SLOW_QUERY = """
+    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 2000000)
+    SELECT COUNT(*) FROM n
+"""
+
+
+def build_database(path, place_name, generation):
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        con.execute("INSERT INTO countries VALUES ('IT', 'Italia', 'it')")
+        initdata.insert_postal_codes(
+            con.cursor(), [("IT", "00118", place_name) + ("",) * 6 + (41.89, 12.48, 4)])
+        con.execute("UPDATE metadata SET value = ? WHERE key = 'generation'", (str(generation),))
+    con.close()
+
+
+async def place_name(store):
+    async with store.pool.acquire() as db:
+        async with db.execute("SELECT place_name FROM postal_codes") as cursor:
+            return (await cursor.fetchone())[0]
+
+
+@pytest_asyncio.fixture
+async def store(tmp_path):
+    path = tmp_path / "countries.db"
+    build_database(path, "Roma", 1)
+    store = await DataStore(path, pool_options={"size": 2}, cache=ResultCache()).open()
+    yield store
+    await store.close()
+
+
+def publish(store, place, generation):
+    """Builds a new file and renames it over the live one, like initdata.refresh_database."""
+    shadow = store.path.with_name("countries.db.shadow")
+    build_database(shadow, place, generation)
+    os.replace(shadow, store.path)
+    return True
+
+
+class TestDataStore:
+
+    @pytest.mark.asyncio
+    async def test_reload_serves_new_generation(self, store):
+        store.cache.put("key", [1])
+        publish(store, "Rome", 2)
+        await store.reload()
+        assert store.generation == 2
+        assert await place_name(store) == "Rome"
+        assert store.cache.get("key") == (False, None)
+
+    @pytest.mark.asyncio
+    async def test_in_flight_queries_finish_on_old_generation(self, store):
+        old_pool = store.pool
+        started = asyncio.Event()
+
+        async def in_flight():
+            async with old_pool.acquire() as db:
+                started.set()
+                async with db.execute(SLOW_QUERY) as cursor:
+                    await cursor.fetchone()
+                async with db.execute("SELECT place_name FROM postal_codes") as cursor:
+                    return (await cursor.fetchone())[0]
+
+        task = asyncio.create_task(in_flight())
+        await started.wait()
+        publish(store, "Rome", 2)
+        reload = asyncio.create_task(store.reload())
+        # New requests are switched over while the old pool is still draining
+        while store.generation != 2:
+            await asyncio.sleep(0.01)
+        assert await place_name(store) == "Rome"
+        assert not reload.done()
+        assert await task == "Roma"
+        await reload
+        assert old_pool.available == 0
+
+    @pytest.mark.asyncio
+    async def test_refresh_status(self, store):
+        assert store.start_refresh(lambda: publish(store, "Rome", 2))
+        assert not store.start_refresh(lambda: False)
+        await store._refresh_task
+        status = store.status()
+        assert status["generation"] == 2
+        assert status["refresh"]["state"] == "idle"
+        assert status["refresh"]["published"] is True
+
+    @pytest.mark.asyncio
+    async def test_failed_refresh_keeps_serving(self, store):
+        def refresh():
+            raise ValueError("integrity_check failed")
+
+        await store.refresh(refresh)
+        assert store.refresh_status.state == "failed"
+        assert "integrity_check" in store.refresh_status.error
+        assert await place_name(store) == "Roma"
+
+
+def export_snapshot(path):
+    with sqlite3.connect(path) as con:
+        initdata.export_snapshot(con, path.with_name("countries.snap"))
+    con.close()
+
+
+class TestSnapshot:
+
+    @pytest.mark.asyncio
+    async def test_maps_snapshot_of_the_same_generation(self, tmp_path):
+        path = tmp_path / "countries.db"
+        build_database(path, "Roma", 1)
+        export_snapshot(path)
+        store = await DataStore(path, snapshot_path=tmp_path / "countries.snap").open()
+        assert store.snapshot.postal_code("IT", "00118")[0][2] == "Roma"
+        assert store.status()["snapshot"] == str(tmp_path / "countries.snap")
+
+        # A new database without its snapshot yet: back to SQLite
+        publish(store, "Rome", 2)
+        await store.reload()
+        assert store.snapshot is None
+        export_snapshot(path)
+        await store.reload()
+        assert store.snapshot.postal_code("IT", "00118")[0][2] == "Rome"
+        await store.close()
+        assert store.snapshot is None
+
+    @pytest.mark.asyncio
+    async def test_connects_once_with_a_snapshot(self, tmp_path):
+        path = tmp_path / "countries.db"
+        build_database(path, "Roma", 1)
+        export_snapshot(path)
+        store = await DataStore(path, pool_options={"size": 4},
+                                snapshot_path=tmp_path / "countries.snap").open()
+        # Only the connection that loaded the countries
+        assert len(store.pool._connections) == 1
+        assert store.pool.available == 4
+        await store.close()
+
+    @pytest.mark.asyncio
+    async def test_without_snapshot(self, store, tmp_path):
+        assert store.snapshot is None
+        store = await DataStore(store.path, snapshot_path=tmp_path / "missing.snap").open()
+        assert store.snapshot is None
+        await store.close()
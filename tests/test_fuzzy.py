@@ -0,0 +1,38 @@
+from fuzzy import chunks, levenshtein, padded_trigrams, score, trigram_similarity, trigrams
+
+
+class TestTrigrams:
+
+    def test_trigrams_match_the_fts_tokenizer(self):
+        assert trigrams("roma") == {"rom", "oma"}
+        assert trigrams("ro") == set()
+
+    def test_padded_trigrams_mark_word_boundaries(self):
+        assert padded_trigrams("ab") == {"  a", " ab", "ab "}
+        assert padded_trigrams("a b") == {"  a", " a ", "  b", " b "}
+
+    def test_similarity(self):
+        a = padded_trigrams("bologna")
+        assert trigram_similarity(a, a) == 1.0
+        assert trigram_similarity(a, padded_trigrams("xyz")) == 0.0
+        assert 0 < trigram_similarity(a, padded_trigrams("bologan")) < 1
+        assert trigram_similarity(set(), a) == 0.0
+
+    def test_chunks_cover_the_text_in_order(self):
+        assert chunks("romagnano", 3) == ["rom", "agn", "ano"]
+        assert chunks("bologna", 2) == ["bolo", "gna"]
+        assert "".join(chunks("muenchen", 3)) == "muenchen"
+
+
+class TestLevenshtein:
+
+    def test_distances(self):
+        assert levenshtein("bologna", "bologna") == 0
+        assert levenshtein("bologan", "bologna") == 2
+        assert levenshtein("muenchen", "munchen") == 1
+        assert levenshtein("", "roma") == 4
+        assert levenshtein("kitten", "sitting") == levenshtein("sitting", "kitten") == 3
+
+    def test_score(self):
+        assert score(0, 1.0, "roma", "roma") == 1.0
+        assert score(4, 0.0, "abcd", "wxyz") == 0.0
@@ -0,0 +1,35 @@
+import pytest
+
+from geo import MAX_DISTANCE_KM, bounding_boxes, haversine_km
+
+
+def contains(boxes, lat, lon):
+    return any(min_lat <= lat <= max_lat and min_lon <= lon <= max_lon
+               for min_lat, max_lat, min_lon, max_lon in boxes)
+
+
+class TestGeo:
+
+    def test_haversine(self):
+        # Roma - Milano
+        assert haversine_km(41.9028, 12.4964, 45.4642, 9.19) == pytest.approx(477, abs=1)
+        assert haversine_km(0, 0, 0, 180) == pytest.approx(MAX_DISTANCE_KM)
+
+    def test_box_contains_the_circle(self):
+        for lat in (0, 45, 80):
+            boxes = bounding_boxes(lat, 10, 100)
+            assert len(boxes) == 1
+            for bearing_lat, bearing_lon in ((0.8, 0), (-0.8, 0), (0, 0.8), (0, -0.8)):
+                # Points just inside the radius along the four directions
+                step = 100 / haversine_km(lat, 10, lat + bearing_lat, 10 + bearing_lon) * 0.99
+                assert contains(boxes, lat + bearing_lat * step, 10 + bearing_lon * step)
+
+    def test_box_across_the_antimeridian(self):
+        boxes = bounding_boxes(0, 179.9, 50)
+        assert len(boxes) == 2
+        assert contains(boxes, 0, -179.9)
+        assert not contains(boxes, 0, 0)
+
+    def test_box_around_a_pole(self):
+        [box] = bounding_boxes(89.5, 0, 100)
+        assert box == (pytest.approx(88.6, abs=0.1), 90.0, -180.0, 180.0)
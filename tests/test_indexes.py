@@ -0,0 +1,57 @@
+import sqlite3
+import time
+
+import aiosqlite
+import pytest
+
+import initdata
+from indexes import CountryIndex
+from services import Country
+
+COUNTRIES = [
+    ("IT", "Italia", "it"), ("DE", "Germania", "it"), ("US", "Stati Uniti", "it"),
+    ("IT", "Italy", "en"), ("DE", "Germany", "en"), ("US", "United States", "en"),
+    ("CI", "Côte d'Ivoire", "en"),
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "countries.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        con.executemany("INSERT INTO countries VALUES (?, ?, ?)", COUNTRIES)
+    con.close()
+    return path
+
+
+async def load_index(db_path) -> CountryIndex:
+    async with aiosqlite.connect(db_path) as db:
+        return await CountryIndex.load(db)
+
+
+class TestCountryIndex:
+
+    @pytest.mark.asyncio
+    async def test_all_countries_of_a_language(self, db_path):
+        index = await load_index(db_path)
+        assert len(index) == len(COUNTRIES)
+        assert set(index.languages) == {"it", "en"}
+        assert [c.country_code for c in index.search("", "it")] == ["DE", "IT", "US"]
+
+    @pytest.mark.asyncio
+    async def test_search_ignores_case_and_accents(self, db_path):
+        index = await load_index(db_path)
+        assert index.search("united STATES", "en") == [Country("US", "United States")]
+        assert index.search("cote", "en") == [Country("CI", "Côte d'Ivoire")]
+        assert index.search("Atlantis", "en") == []
+        assert index.search("", "fr") == []
+
+    def test_search_is_sub_millisecond(self):
+        index = CountryIndex({
+            "en": [Country(f"C{i:03}", f"Country number {i}") for i in range(250)]
+        })
+        started = time.perf_counter()
+        for _ in range(1000):
+            index.search("number 12", "en")
+        assert (time.perf_counter() - started) / 1000 < 0.001
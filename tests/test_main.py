@@ -0,0 +1,372 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+
+import pytest
+from fastmcp import Client
+from starlette.testclient import TestClient
+
+import initdata
+import main
+
+ROWS = [
+    ("IT", "00118", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.89, 12.48, 4),
+    ("DE", "80331", "München", "Bayern", "BY", "Oberbayern", "091", "", "", 48.13, 11.57, 4),
+]
+
+
+def build_database(path):
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        con.executemany("INSERT INTO countries VALUES (?, ?, ?)",
+                        [("IT", "Italy", "en"), ("DE", "Germany", "en")])
+        initdata.insert_postal_codes(con.cursor(), ROWS)
+    con.close()
+
+
+async def wait_for_state(state):
+    while main._store is None or main._store.state != state:
+        await asyncio.sleep(0.01)
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    path = tmp_path / "countries.db"
+    build_database(path)
+
+    def check_and_sync(on_ready=None, on_imported=None):
+        on_ready()
+        return False
+
+    monkeypatch.setattr(main, "DB_PATH", path)
+    monkeypatch.setattr(main, "check_and_sync", check_and_sync)
+    # No snapshot unless a test exports one
+    monkeypatch.setattr(main, "SNAPSHOT_PATH", "")
+    return main.mcp
+
+
+class SlowImport:
+    """Stand-in for check_and_sync that imports IT, then waits to be released."""
+
+    def __init__(self, path):
+        self.path = path
+        self.release = threading.Event()
+
+    def __call__(self, on_ready=None, on_imported=None):
+        build_database(self.path)
+        on_ready()
+        on_imported("IT", 2)
+        self.release.wait(10)
+        on_imported("DE", 2)
+        return True
+
+
+@pytest.fixture
+def slow_import(tmp_path, monkeypatch):
+    slow_import = SlowImport(tmp_path / "countries.db")
+    monkeypatch.setattr(main, "DB_PATH", slow_import.path)
+    monkeypatch.setattr(main, "check_and_sync", slow_import)
+    monkeypatch.setattr(main, "SNAPSHOT_PATH", "")
+    yield slow_import
+    slow_import.release.set()
+
+
+class TestTools:
+
+    @pytest.mark.asyncio
+    async def test_countries(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool("countries", {"search_term": "germ", "lang": "en"})
+        assert result.structured_content["result"] == [
+            {"country_code": "DE", "country_name": "Germany"}
+        ]
+
+    @pytest.mark.asyncio
+    async def test_find_cities_by_name(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "de", "city_name": "munchen"})
+        assert [r["postal_code"] for r in result.structured_content["result"]] == ["80331"]
+
+    @pytest.mark.asyncio
+    async def test_find_cities_by_name_fuzzy(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "de", "city_name": "muenchen", "fuzzy": True})
+        [city] = result.structured_content["result"]
+        assert (city["postal_code"], city["edit_distance"]) == ("80331", 1)
+        assert 0 < city["score"] < 1
+
+    @pytest.mark.asyncio
+    async def test_find_cities_by_name_distinct(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "IT", "city_name": "roma", "distinct": True})
+            [place] = result.structured_content["result"]
+            assert (place["place_name"], place["postal_codes"]) == ("Roma", ["00118"])
+            result = await client.call_tool(
+                "find_cities_by_name",
+                {"country_code": "IT", "city_name": "roma", "distinct": True, "fuzzy": True})
+        assert "cannot be combined" in result.structured_content["result"]
+
+    @pytest.mark.asyncio
+    async def test_autocomplete_place(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "autocomplete_place", {"country_code": "de", "prefix": "Mün"})
+            assert [r["postal_code"] for r in result.structured_content["result"]] == ["80331"]
+            result = await client.call_tool(
+                "autocomplete_place", {"country_code": "IT", "prefix": "ro"})
+        assert [r["place_name"] for r in result.structured_content["result"]] == ["Roma"]
+
+    @pytest.mark.asyncio
+    async def test_lookups_served_from_snapshot(self, server, tmp_path, monkeypatch):
+        with sqlite3.connect(main.DB_PATH) as con:
+            initdata.export_snapshot(con, tmp_path / "countries.snap")
+        con.close()
+        monkeypatch.setattr(main, "SNAPSHOT_PATH", str(tmp_path / "countries.snap"))
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            assert main._store.snapshot is not None
+            result = await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+            assert [r["place_name"] for r in result.structured_content["result"]] == ["Roma"]
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "de", "city_name": "munchen"})
+            assert [r["postal_code"] for r in result.structured_content["result"]] == ["80331"]
+            result = await client.call_tool(
+                "autocomplete_place", {"country_code": "de", "prefix": "mun"})
+            assert [r["place_name"] for r in result.structured_content["result"]] == ["München"]
+            stats = json.loads((await client.read_resource("geonames://stats/cache"))[0].text)
+        # The footprint of the in-memory path
+        assert stats["snapshot_bytes"] == (tmp_path / "countries.snap").stat().st_size
+
+    @pytest.mark.asyncio
+    async def test_get_location_by_postal_code(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+        assert [r["place_name"] for r in result.structured_content["result"]] == ["Roma"]
+
+    @pytest.mark.asyncio
+    async def test_fields_projection(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "get_location_by_postal_code",
+                {"country_code": "IT", "postal_code": "00118", "fields": ["place_name"]})
+            assert result.structured_content["result"] == [{"place_name": "Roma"}]
+            result = await client.call_tool(
+                "find_cities_by_name",
+                {"country_code": "IT", "city_name": "roma", "distinct": True,
+                 "fields": ["place_name", "postal_codes"]})
+            assert result.structured_content["result"] == \
+                   [{"place_name": "Roma", "postal_codes": ["00118"]}]
+            result = await client.call_tool(
+                "autocomplete_place", {"country_code": "de", "prefix": "Mün", "fields": ["postal_code"]})
+            assert result.structured_content["result"] == [{"postal_code": "80331"}]
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "IT", "city_name": "roma", "fields": ["score"]})
+        assert "Unknown fields score" in result.structured_content["result"]
+
+    @pytest.mark.asyncio
+    async def test_reverse_geocode(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "reverse_geocode", {"latitude": 48.0, "longitude": 11.0, "limit": 1})
+        [nearest] = result.structured_content["result"]
+        assert nearest["place_name"] == "München"
+        assert 40 < nearest["distance_km"] < 50
+
+    @pytest.mark.asyncio
+    async def test_find_places_near_is_paginated(self, server):
+        args = {"latitude": 45.0, "longitude": 12.0, "radius_km": 1000, "limit": 1}
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            first = (await client.call_tool("find_places_near", args)).structured_content["result"]
+            second = (await client.call_tool(
+                "find_places_near", {**args, "cursor": first["next_cursor"]})
+            ).structured_content["result"]
+        assert [r["place_name"] for r in first["items"]] == ["Roma"]
+        assert [r["place_name"] for r in second["items"]] == ["München"]
+        assert second["next_cursor"] is None
+
+    @pytest.mark.asyncio
+    async def test_get_locations_by_postal_codes(self, server):
+        items = [{"country_code": "de", "postal_code": "80331"},
+                 {"country_code": "IT", "postal_code": "99999"},
+                 {"country_code": "IT", "postal_code": "00118"},
+                 {"country_code": "IT", "postal_code": "00118"}]
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+            result = await client.call_tool("get_locations_by_postal_codes", {"items": items})
+            contents = await client.read_resource("geonames://stats/cache")
+        entries = result.structured_content["result"]
+        assert [(e["country_code"], e["postal_code"]) for e in entries] == [
+            (i["country_code"], i["postal_code"]) for i in items]
+        assert [[loc["place_name"] for loc in e["locations"]] for e in entries] == [
+            ["München"], [], ["Roma"], ["Roma"]]
+        # The single lookup already cached IT 00118: the batch resolved the other two
+        stats = json.loads(contents[0].text)
+        assert (stats["hits"], stats["entries"]) == (1, 3)
+
+    @pytest.mark.asyncio
+    async def test_lookups_are_cached(self, server):
+        args = {"country_code": "IT", "postal_code": "00118"}
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            await client.call_tool("get_location_by_postal_code", args)
+            await client.call_tool("get_location_by_postal_code", args)
+            contents = await client.read_resource("geonames://stats/cache")
+        stats = json.loads(contents[0].text)
+        assert (stats["hits"], stats["misses"], stats["entries"]) == (1, 1, 1)
+
+    @pytest.mark.asyncio
+    async def test_data_status(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            contents = await client.read_resource("geonames://admin/data")
+        status = json.loads(contents[0].text)
+        assert status["generation"] == 0
+        assert status["refresh"]["state"] == "idle"
+
+
+class TestMetrics:
+
+    @pytest.mark.asyncio
+    async def test_tool_and_query_metrics_resource(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            before = json.loads((await client.read_resource("geonames://stats/metrics"))[0].text)
+            calls = before["tools"].get("get_location_by_postal_code", {}).get("calls", 0)
+            await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+            await client.call_tool("find_cities_by_name", {"fuzzy": True, "distinct": True})
+            contents = await client.read_resource("geonames://stats/metrics")
+        stats = json.loads(contents[0].text)
+        assert stats["tools"]["get_location_by_postal_code"]["calls"] == calls + 1
+        assert stats["tools"]["find_cities_by_name"]["errors"] >= 1
+        assert stats["queries"]["get_postal_code"]["rows"] >= 1
+        assert stats["connection_wait_seconds"]["count"] >= 1
+
+    def test_prometheus_endpoint(self, server):
+        with TestClient(main.mcp.http_app()) as http:
+            for _ in range(500):
+                if http.get("/health/ready").status_code == 200:
+                    break
+                threading.Event().wait(0.01)
+            response = http.get("/metrics")
+        assert response.status_code == 200
+        assert response.headers["content-type"].startswith("text/plain")
+        assert "# TYPE geonames_tool_duration_seconds histogram" in response.text
+        assert "geonames_ready 1" in response.text
+        assert "geonames_pool_connections_available" in response.text
+        assert "geonames_cache_hits_total" in response.text
+        assert "geonames_calls_rejected_total" in response.text
+        assert "geonames_snapshot_bytes 0" in response.text
+
+
+class TestAdmission:
+
+    @pytest.mark.asyncio
+    async def test_calls_are_shed_when_the_queue_is_full(self, server, monkeypatch):
+        monkeypatch.setattr(main.LIMITER, "max_concurrent", 0)
+        monkeypatch.setattr(main.LIMITER, "max_waiting", 0)
+        rejected = main.LIMITER.rejected
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool("countries", {"lang": "en"})
+        assert result.structured_content["result"].startswith("Server busy")
+        assert main.LIMITER.rejected == rejected + 1
+
+    @pytest.mark.asyncio
+    async def test_limit_is_capped(self, server):
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            result = await client.call_tool(
+                "find_cities_by_name", {"country_code": "IT", "city_name": "r", "limit": 10 ** 9})
+        assert [r["postal_code"] for r in result.structured_content["result"]] == ["00118"]
+        assert main.capped(10 ** 9) == main.MAX_LIMIT
+        assert main.capped(-5) == 1
+
+
+class TestDiagnostics:
+
+    @pytest.mark.asyncio
+    async def test_slow_queries_are_logged(self, server, monkeypatch, caplog):
+        monkeypatch.setattr(main, "SLOW_QUERY_MS", 1e-9)
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            with caplog.at_level(logging.WARNING, logger="profiling"):
+                await client.call_tool(
+                    "find_cities_by_name", {"country_code": "IT", "city_name": "roma"})
+                await main.SLOW_QUERIES.wait()
+        [record] = [json.loads(r.getMessage()) for r in caplog.records if r.name == "profiling"]
+        assert record["query"] == "get_cities"
+        [exact] = [s for s in record["statements"] if "place_key = 'roma'" in s["sql"]]
+        assert exact["plan"][0].startswith("SEARCH postal_codes USING INDEX")
+
+    @pytest.mark.asyncio
+    async def test_profiling_is_switched_on_at_runtime(self, server, monkeypatch, tmp_path):
+        monkeypatch.setattr(main.PROFILER, "directory", tmp_path / "profiles")
+        async with Client(server) as client:
+            await wait_for_state("ready")
+            assert (await main.set_profiling(1.0))["sample_rate"] == 1.0
+            try:
+                await client.call_tool(
+                    "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+            finally:
+                status = await main.set_profiling(0.0)
+        assert status["sample_rate"] == 0.0
+        profiles = [p.name.split("-")[0] for p in (tmp_path / "profiles").iterdir()]
+        assert profiles == ["get_location_by_postal_code"]
+
+
+class TestWarmUp:
+
+    @pytest.mark.asyncio
+    async def test_answers_imported_countries_while_warming_up(self, slow_import):
+        async with Client(main.mcp) as client:
+            await wait_for_state("warming_up")
+            while "IT" not in main._store.imported:
+                await asyncio.sleep(0.01)
+            it = await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "IT", "postal_code": "00118"})
+            de = await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "DE", "postal_code": "80331"})
+            assert [r["place_name"] for r in it.structured_content["result"]] == ["Roma"]
+            assert de.structured_content["result"]["status"] == "warming_up"
+            assert de.structured_content["result"]["countries_imported"] == 1
+
+            slow_import.release.set()
+            await wait_for_state("ready")
+            de = await client.call_tool(
+                "get_location_by_postal_code", {"country_code": "DE", "postal_code": "80331"})
+            assert [r["place_name"] for r in de.structured_content["result"]] == ["München"]
+
+    def test_health_endpoints(self, slow_import):
+        with TestClient(main.mcp.http_app()) as http:
+            assert http.get("/health/live").status_code == 200
+            ready = http.get("/health/ready")
+            assert ready.status_code == 503
+            assert ready.json()["state"] in ("starting", "warming_up")
+
+            slow_import.release.set()
+            for _ in range(500):
+                ready = http.get("/health/ready")
+                if ready.status_code == 200:
+                    break
+                threading.Event().wait(0.01)
+            assert ready.status_code == 200
+            assert ready.json()["state"] == "ready"
@@ -0,0 +1,86 @@
+import asyncio
+
+import pytest
+
+from metrics import Histogram, Metrics, count_rows
+from services import PlacesPage, PostalCode
+
+
+class FakeClock:
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class TestHistogram:
+
+    def test_buckets_are_cumulative_and_inclusive(self):
+        histogram = Histogram((0.1, 1.0))
+        for value in (0.05, 0.1, 0.5, 2.0):
+            histogram.observe(value)
+        assert histogram.cumulative() == [("0.1", 2), ("1", 3), ("+Inf", 4)]
+        assert (histogram.count, histogram.sum) == (4, pytest.approx(2.65))
+
+
+class TestMetrics:
+
+    def test_count_rows(self):
+        assert count_rows([PostalCode("IT", "00118", "Roma")] * 2) == 2
+        assert count_rows(PlacesPage([PostalCode("IT", "00118", "Roma")])) == 1
+        assert count_rows({"a": 1}) == 1
+        assert count_rows(None) == 0
+
+    @pytest.mark.asyncio
+    async def test_tool_calls_errors_rows_and_in_flight(self):
+        clock = FakeClock()
+        metrics = Metrics(clock)
+        release = asyncio.Event()
+
+        @metrics.instrument_tool
+        async def lookup(fail: str = "") -> list:
+            """Docstring kept for the tool description."""
+            await release.wait()
+            clock.now += 0.002
+            if fail == "raise":
+                raise RuntimeError("boom")
+            return "Error" if fail else [1, 2, 3]
+
+        assert lookup.__name__ == "lookup" and lookup.__doc__.startswith("Docstring")
+        running = asyncio.create_task(lookup())
+        await asyncio.sleep(0)
+        assert metrics.tool_in_flight["lookup"] == 1
+        release.set()
+        assert await running == [1, 2, 3]
+        assert await lookup("error") == "Error"
+        with pytest.raises(RuntimeError):
+            await lookup("raise")
+
+        stats = metrics.snapshot()["tools"]["lookup"]
+        assert (stats["calls"], stats["errors"], stats["rows"], stats["in_flight"]) == (3, 2, 3, 0)
+        assert stats["latency_seconds"]["buckets"]["0.0025"] == 3
+
+    def test_queries_and_connection_wait(self):
+        metrics = Metrics()
+        metrics.observe_query("get_cities", 0.01, [PostalCode("IT", "00118", "Roma")])
+        metrics.observe_query("get_cities", 0.02, "Error retrieving data")
+        metrics.observe_query("get_postal_code", 0.01, failed=True)
+        metrics.observe_connection_wait(0.0)
+        queries = metrics.snapshot()["queries"]
+        assert (queries["get_cities"]["calls"], queries["get_cities"]["errors"],
+                queries["get_cities"]["rows"]) == (2, 1, 1)
+        assert queries["get_postal_code"]["errors"] == 1
+        assert metrics.snapshot()["connection_wait_seconds"]["count"] == 1
+
+    def test_render_prometheus_text(self):
+        metrics = Metrics()
+        metrics.observe_query('we"ird', 0.003, [1])
+        text = metrics.render([("geonames_ready", "gauge", "Ready.", 1)])
+        assert "# TYPE geonames_query_duration_seconds histogram" in text
+        assert 'geonames_query_duration_seconds_bucket{query="we\\"ird",le="0.005"} 1' in text
+        assert 'geonames_query_duration_seconds_count{query="we\\"ird"} 1' in text
+        assert 'geonames_query_rows_total{query="we\\"ird"} 1' in text
+        assert "geonames_connection_wait_seconds_count 0" in text
+        assert text.endswith("# TYPE geonames_ready gauge\ngeonames_ready 1\n")
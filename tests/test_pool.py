@@ -0,0 +1,105 @@
+import asyncio
+import os
+import sqlite3
+
+import pytest
+import pytest_asyncio
+
+import initdata
+from pool import ConnectionPool
+
+
+@pytest_asyncio.fixture
+async def pool(tmp_path):
+    path = tmp_path / "countries.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        initdata.insert_postal_codes(
+            con.cursor(), [("IT", "00118", "Roma") + ("",) * 6 + (41.89, 12.48, 4)]
+        )
+    con.close()
+    pool = await ConnectionPool(path, size=2).open()
+    yield pool
+    await pool.close()
+
+
+class TestConnectionPool:
+
+    @pytest.mark.asyncio
+    async def test_connections_are_read_only(self, pool):
+        async with pool.acquire() as db:
+            with pytest.raises(sqlite3.OperationalError):
+                await db.execute("DELETE FROM postal_codes")
+            async with db.execute("SELECT place_name FROM postal_codes") as cursor:
+                row = await cursor.fetchone()
+        assert row == ("Roma",)
+
+    @pytest.mark.asyncio
+    async def test_acquire_waits_when_exhausted(self, pool):
+        async with pool.acquire() as first, pool.acquire() as second:
+            assert first is not second
+            assert pool.available == 0
+            waiting = asyncio.ensure_future(pool.acquire().__aenter__())
+            await asyncio.sleep(0.05)
+            assert not waiting.done()
+        assert await waiting in (first, second)
+
+    @pytest.mark.skipif((os.cpu_count() or 1) < 2, reason="needs more than one core")
+    @pytest.mark.asyncio
+    async def test_queries_run_concurrently(self, pool):
+        async def slow_query():
+            async with pool.acquire() as db:
+                # A recursive CTE keeps the connection's thread busy in SQLite
+                async with db.execute("""
+                    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 3000000)
+                    SELECT COUNT(*) FROM n
+                """) as cursor:
+                    return await cursor.fetchone()
+
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        await slow_query()
+        serial = loop.time() - started
+
+        started = loop.time()
+        await asyncio.gather(slow_query(), slow_query())
+        parallel = loop.time() - started
+        assert parallel < serial * 1.7
+
+    @pytest.mark.asyncio
+    async def test_traced_connections(self, pool, tmp_path):
+        async with pool.acquire() as db:
+            assert pool.tracer(db) is None
+        traced = await ConnectionPool(pool.path, size=1, trace=True).open()
+        try:
+            async with traced.acquire() as db:
+                tracer = traced.tracer(db)
+                tracer.reset()
+                async with db.execute("""
+                    WITH RECURSIVE n(i) AS (SELECT 1 UNION ALL SELECT i + 1 FROM n WHERE i < 10000)
+                    SELECT COUNT(*) FROM n
+                """) as cursor:
+                    await cursor.fetchone()
+            assert tracer.vm_steps > 10000
+        finally:
+            await traced.close()
+
+    def test_rejects_empty_pool(self, tmp_path):
+        with pytest.raises(ValueError):
+            ConnectionPool(tmp_path / "countries.db", size=0)
+
+    @pytest.mark.asyncio
+    async def test_lazy_pool_connects_on_demand(self, tmp_path):
+        path = tmp_path / "countries.db"
+        sqlite3.connect(path).close()
+        pool = await ConnectionPool(path, size=2, lazy=True).open()
+        assert (len(pool._connections), pool.available) == (0, 2)
+        async with pool.acquire() as first:
+            assert (len(pool._connections), pool.available) == (1, 1)
+        async with pool.acquire() as again:
+            # An idle connection is reused before a new one is opened
+            assert again is first
+        async with pool.acquire(), pool.acquire():
+            assert (len(pool._connections), pool.available) == (2, 0)
+        await pool.close()
+        assert pool.available == 0
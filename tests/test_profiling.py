@@ -0,0 +1,185 @@
+import asyncio
+import json
+import logging
+import pstats
+import sqlite3
+import time
+
+import aiosqlite
+import pytest
+import pytest_asyncio
+
+import initdata
+from pool import ConnectionPool
+from admission import DeadlineExceeded, run_interruptible
+from profiling import QueryTracer, RequestProfiler, SlowQueryLog
+from services import get_cities
+
+ROWS = [
+    ("IT", "00118", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.89, 12.48, 4),
+    ("IT", "47121", "Forlì", "Emilia-Romagna", "05", "Forlì-Cesena", "FC", "", "", 44.22, 12.04, 4),
+]
+
+
+def build_database(path):
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        initdata.insert_postal_codes(con.cursor(), ROWS)
+    con.close()
+
+
+async def count_to(db, n: int) -> int:
+    """A query long enough to need its deadline."""
+    query = ("WITH RECURSIVE numbers(n) AS (SELECT 1 UNION ALL SELECT n + 1 FROM numbers WHERE n < ?) "
+             "SELECT COUNT(*) FROM numbers")
+    async with db.execute(query, (n,)) as cursor:
+        return (await cursor.fetchone())[0]
+
+
+@pytest_asyncio.fixture
+async def traced_db(tmp_path):
+    path = tmp_path / "countries.db"
+    build_database(path)
+    db = await aiosqlite.connect(path)
+    tracer = await QueryTracer(step_interval=10, record_statements=True).attach(db)
+    yield db, tracer
+    await db.close()
+
+
+class TestQueryTracer:
+
+    @pytest.mark.asyncio
+    async def test_counts_steps(self, traced_db):
+        db, tracer = traced_db
+        assert [c.place_name for c in await get_cities(db, "IT", "roma", 10)] == ["Roma"]
+        assert tracer.vm_steps > 0
+        tracer.reset()
+        assert tracer.vm_steps == 0
+
+    @pytest.mark.asyncio
+    @pytest.mark.asyncio
+    async def test_records_statements_with_parameters(self, traced_db):
+        db, tracer = traced_db
+        await run_interruptible(tracer, get_cities(db, "IT", "roma", 10))
+        assert any("place_key = 'roma'" in sql for sql in tracer.statements)
+        assert not any(sql.startswith("--") for sql in tracer.statements)
+        # Only between start() and stop()
+        recorded = list(tracer.statements)
+        await get_cities(db, "IT", "forli", 10)
+        assert tracer.statements == recorded
+        await run_interruptible(tracer, asyncio.sleep(0))
+        assert tracer.statements == []
+
+
+@pytest_asyncio.fixture
+async def pool(tmp_path):
+    path = tmp_path / "countries.db"
+    build_database(path)
+    pool = await ConnectionPool(path, size=1, trace=True, record_statements=True).open()
+    yield pool
+    await pool.close()
+
+
+async def run_slow(pool, service, *args, deadline=None):
+    """Runs ``service`` on the pool like main.run_query; returns its tracer's statements."""
+    async with pool.acquire() as db:
+        tracer = pool.tracer(db)
+        try:
+            await run_interruptible(tracer, service(db, *args), deadline)
+        except DeadlineExceeded:
+            pass
+        return list(tracer.statements)
+
+
+class TestSlowQueryLog:
+
+    @pytest.mark.asyncio
+    async def test_slow_query_record(self, pool, caplog):
+        statements = await run_slow(pool, get_cities, "IT", "roma", 10)
+        log = SlowQueryLog()
+        with caplog.at_level(logging.WARNING, logger="profiling"):
+            log.submit(pool, get_cities, ("IT", "roma", 10), statements, 1.25, 4000)
+            # Explained in background, once the caller has moved on
+            assert not caplog.records
+            await log.wait()
+        record = json.loads(caplog.records[-1].getMessage())
+        assert (record["event"], record["query"]) == ("slow_query", "get_cities")
+        assert record["elapsed_ms"] == 1250.0
+        assert record["args"] == ["'IT'", "'roma'", "10"]
+        assert (record["vm_steps"], record["interrupted"]) == (4000, False)
+        [exact] = [s for s in record["statements"] if "place_key = 'roma'" in s["sql"]]
+        assert any("idx_postal_codes_country_place_key" in step for step in exact["plan"])
+        # The pooled connection was never used
+        assert pool.available == 1
+
+    @pytest.mark.asyncio
+    async def test_interrupted_query_is_not_run_again(self, pool, caplog):
+        statements = await run_slow(pool, count_to, 10 ** 10, deadline=time.monotonic() + 0.1)
+        log = SlowQueryLog()
+        started = time.monotonic()
+        with caplog.at_level(logging.WARNING, logger="profiling"):
+            log.submit(pool, count_to, (10 ** 10,), statements, 0.1, 10 ** 6, interrupted=True)
+            await log.wait()
+        # A run of the query would count for minutes
+        assert time.monotonic() - started < 1
+        record = json.loads(caplog.records[-1].getMessage())
+        assert record["interrupted"]
+        [statement] = record["statements"]
+        assert "WITH RECURSIVE" in statement["sql"] and "10000000000" in statement["sql"]
+        assert statement["plan"]
+
+    @pytest.mark.asyncio
+    async def test_one_explain_at_a_time(self, pool, caplog):
+        first = await run_slow(pool, count_to, 10)
+        second = await run_slow(pool, get_cities, "IT", "roma", 10)
+        log = SlowQueryLog()
+        with caplog.at_level(logging.WARNING, logger="profiling"):
+            log.submit(pool, count_to, (10,), first, 5.0, 0)
+            log.submit(pool, get_cities, ("IT", "roma", 10), second, 1.0, 0)
+            await log.wait()
+        records = [json.loads(r.getMessage()) for r in caplog.records]
+        assert [r["query"] for r in records] == ["get_cities", "count_to"]
+        assert records[0]["statements"] and all(s["plan"] is None for s in records[0]["statements"])
+        assert all(s["plan"] for s in records[1]["statements"])
+
+
+class TestRequestProfiler:
+
+    @pytest.mark.asyncio
+    async def test_sampled_calls_are_dumped(self, tmp_path):
+        samples = iter([0.1, 0.9])
+        profiler = RequestProfiler(tmp_path / "profiles", 0.5, lambda: next(samples))
+
+        @profiler.instrument_tool
+        async def lookup(value):
+            await asyncio.sleep(0)
+            return value * 2
+
+        assert await lookup(1) == 2
+        assert await lookup(2) == 4
+        assert profiler.status()["profiles"] == 1
+        [dump] = (tmp_path / "profiles").iterdir()
+        assert dump.name.startswith("lookup-") and str(dump) == profiler.last_profile
+        assert pstats.Stats(str(dump)).total_calls > 0
+
+    @pytest.mark.asyncio
+    async def test_disabled_and_one_profile_at_a_time(self, tmp_path):
+        profiler = RequestProfiler(tmp_path, 0.0)
+        release = asyncio.Event()
+
+        @profiler.instrument_tool
+        async def lookup():
+            await release.wait()
+
+        await asyncio.wait_for(asyncio.gather(lookup(), _set(release)), 5)
+        assert profiler.profiles == 0
+        profiler.configure(5)
+        assert profiler.sample_rate == 1.0
+        release.clear()
+        await asyncio.wait_for(asyncio.gather(lookup(), lookup(), _set(release)), 5)
+        assert profiler.profiles == 1
+
+
+async def _set(event):
+    await asyncio.sleep(0)
+    event.set()
@@ -0,0 +1,443 @@
+import random
+import sqlite3
+
+import aiosqlite
+import pytest
+import pytest_asyncio
+
+import initdata
+import services
+from geo import haversine_km
+from services import Place, PostalCode, ScoredPostalCode, get_cities, get_fuzzy_cities, get_nearest_postal_codes, \
+    get_places_by_name, get_places_by_prefix, get_places_in_box, \
+    get_places_near, get_postal_code, get_postal_codes
+
+ROWS = [
+    ("IT", "00118", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.89, 12.48, 4),
+    ("IT", "00010", "Villa Adriana", "Lazio", "07", "Roma", "RM", "", "", 41.95, 12.77, 4),
+    ("IT", "47121", "Forlì", "Emilia-Romagna", "05", "Forlì-Cesena", "FC", "", "", 44.22, 12.04, 4),
+    ("IT", "40121", "Bologna", "Emilia-Romagna", "05", "Bologna", "BO", "", "", 44.49, 11.34, 4),
+    ("IT", "00040", "Romagnano", "Lazio", "07", "Roma", "RM", "", "", 41.70, 12.70, 4),
+    ("DE", "80331", "München", "Bayern", "BY", "Oberbayern", "091", "", "", 48.13, 11.57, 4),
+    ("DE", "10115", "Berlin", "Berlin", "BE", "Berlin", "00", "", "", 52.53, 13.38, 4),
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "countries.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        initdata.insert_postal_codes(con.cursor(), ROWS)
+        con.commit()
+    return path
+
+
+@pytest_asyncio.fixture
+async def db(db_path):
+    con = await aiosqlite.connect(db_path)
+    yield con
+    await con.close()
+
+
+class TestGetCities:
+
+    @pytest.mark.asyncio
+    async def test_exact_match_first(self, db):
+        cities = await get_cities(db, "it", "roma", 10)
+        assert [c.place_name for c in cities][0] == "Roma"
+        assert {c.place_name for c in cities} == {"Roma", "Romagnano"}
+
+    @pytest.mark.asyncio
+    async def test_substring_is_case_insensitive(self, db):
+        cities = await get_cities(db, "IT", "ADRIA", 10)
+        assert [c.place_name for c in cities] == ["Villa Adriana"]
+        assert isinstance(cities[0], PostalCode)
+
+    @pytest.mark.asyncio
+    async def test_short_terms_use_like_fallback(self, db):
+        cities = await get_cities(db, "DE", "be", 10)
+        assert [c.place_name for c in cities] == ["Berlin"]
+
+    @pytest.mark.asyncio
+    async def test_accents_are_folded(self, db):
+        assert [c.place_name for c in await get_cities(db, "DE", "MUNCHEN", 10)] == ["München"]
+        assert [c.place_name for c in await get_cities(db, "IT", "forli", 10)] == ["Forlì"]
+        assert [c.place_name for c in await get_cities(db, "DE", "ünch", 10)] == ["München"]
+
+    @pytest.mark.asyncio
+    async def test_limit_counts_exact_and_substring_rows(self, db):
+        assert [c.place_name for c in await get_cities(db, "IT", "roma", 1)] == ["Roma"]
+
+    @pytest.mark.asyncio
+    async def test_quotes_in_term_are_literal(self, db):
+        assert await get_cities(db, "IT", 'ro"ma', 10) == []
+
+    @pytest.mark.asyncio
+    async def test_index_follows_country_replace(self, db_path, db):
+        with sqlite3.connect(db_path) as con:
+            con.execute("DELETE FROM postal_codes WHERE country_code = 'DE'")
+            initdata.insert_postal_codes(
+                con.cursor(), [("DE", "20095", "Hamburg") + ("",) * 6 + (53.55, 10.0, 4)]
+            )
+            con.commit()
+        assert await get_cities(db, "DE", "berlin", 10) == []
+        assert [c.postal_code for c in await get_cities(db, "DE", "hamb", 10)] == ["20095"]
+
+    @pytest.mark.asyncio
+    async def test_fields_select_only_those_columns(self, db):
+        cities = await get_cities(db, "IT", "roma", 10, ["postal_code", "place_name"])
+        assert cities[0] == {"postal_code": "00118", "place_name": "Roma"}
+        assert {tuple(c) for c in await get_cities(db, "IT", "rom", 10, ["place_name"])} == \
+               {("place_name",)}
+        assert "Unknown fields population" in await get_cities(db, "IT", "roma", 10, ["population"])
+
+
+class TestGetFuzzyCities:
+
+    @pytest.mark.asyncio
+    async def test_misspellings_find_the_city(self, db):
+        assert [c.place_name for c in await get_fuzzy_cities(db, "it", "Bologan", 10)][0] == "Bologna"
+        assert [c.place_name for c in await get_fuzzy_cities(db, "DE", "Muenchen", 10)] == ["München"]
+        assert [c.place_name for c in await get_fuzzy_cities(db, "IT", "Forl", 10)][0] == "Forlì"
+
+    @pytest.mark.asyncio
+    async def test_results_are_scored_best_first(self, db):
+        cities = await get_fuzzy_cities(db, "IT", "romagnan", 10)
+        assert [c.place_name for c in cities][0] == "Romagnano"
+        assert all(isinstance(c, ScoredPostalCode) for c in cities)
+        assert cities[0].edit_distance == 1
+        assert [c.score for c in cities] == sorted((c.score for c in cities), reverse=True)
+
+    @pytest.mark.asyncio
+    async def test_exact_name_scores_one(self, db):
+        cities = await get_fuzzy_cities(db, "IT", "roma", 1)
+        assert [(c.place_name, c.score, c.edit_distance) for c in cities] == [("Roma", 1.0, 0)]
+
+    @pytest.mark.asyncio
+    async def test_unrelated_names_and_other_countries_are_excluded(self, db):
+        assert await get_fuzzy_cities(db, "IT", "xyzzy", 10) == []
+        assert await get_fuzzy_cities(db, "DE", "bologna", 10) == []
+
+    @pytest.mark.asyncio
+    async def test_candidates_share_a_piece_of_the_name(self, db, monkeypatch):
+        # Two edits in "romagnano" leave its last piece, "ano", intact
+        assert [c.place_name for c in await get_fuzzy_cities(db, "IT", "ramugnano", 10)][0] == "Romagnano"
+        assert services.fuzzy_match("IT", "romagnano") == \
+            'country_tag : "it~" AND place_key : ("rom" OR "agn" OR "ano")'
+        monkeypatch.setattr(services, "FUZZY_MAX_CANDIDATES", 0)
+        assert await get_fuzzy_cities(db, "IT", "bologna", 10) == []
+
+    @pytest.mark.asyncio
+    async def test_short_terms_fall_back_to_get_cities(self, db):
+        assert [c.place_name for c in await get_fuzzy_cities(db, "DE", "be", 10)] == ["Berlin"]
+
+
+ROMA_ROWS = [
+    ("IT", "00121", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.75, 12.30, 4),
+    ("IT", "00199", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.95, 12.50, 4),
+    ("IT", "00118", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.89, 12.48, 4),
+    # A hamlet with the same name in another province
+    ("IT", "12040", "Roma", "Piemonte", "12", "Cuneo", "CN", "", "", 44.60, 7.70, 4),
+]
+
+
+class TestGetPlacesByName:
+
+    @pytest.fixture
+    def db_path(self, db_path):
+        with sqlite3.connect(db_path) as con:
+            con.execute("DELETE FROM postal_codes WHERE place_name = 'Roma'")
+            initdata.insert_postal_codes(con.cursor(), ROMA_ROWS)
+        con.close()
+        return db_path
+
+    @pytest.mark.asyncio
+    async def test_one_result_per_place(self, db):
+        assert len(await get_cities(db, "IT", "roma", 10)) == 5
+        places = await get_places_by_name(db, "it", "roma", 10)
+        assert [(p.place_name, p.county_code) for p in places] == \
+               [("Roma", "RM"), ("Roma", "CN"), ("Romagnano", "RM")]
+        assert all(isinstance(p, Place) for p in places)
+
+    @pytest.mark.asyncio
+    async def test_postal_codes_centroid_and_bounding_box(self, db):
+        [rome] = await get_places_by_name(db, "IT", "roma", 1)
+        assert rome.postal_codes == ["00118", "00121", "00199"]
+        assert (rome.min_latitude, rome.max_latitude) == (41.75, 41.95)
+        assert (rome.min_longitude, rome.max_longitude) == (12.30, 12.50)
+        assert rome.latitude == pytest.approx((41.75 + 41.95 + 41.89) / 3)
+        assert rome.longitude == pytest.approx((12.30 + 12.50 + 12.48) / 3)
+
+    @pytest.mark.asyncio
+    async def test_substring_and_short_terms(self, db):
+        assert [p.place_name for p in await get_places_by_name(db, "IT", "ADRIA", 10)] == ["Villa Adriana"]
+        assert [p.place_name for p in await get_places_by_name(db, "DE", "be", 10)] == ["Berlin"]
+        assert await get_places_by_name(db, "FR", "paris", 10) == []
+
+    @pytest.mark.asyncio
+    async def test_places_follow_country_replace(self, db_path, db):
+        with sqlite3.connect(db_path) as con:
+            initdata.import_country_lines(con.cursor(), "IT", [[
+                "IT\t00118\tRoma\tLazio\t07\tRoma\tRM\t\t\t41.89\t12.48\t4",
+            ]])
+        con.close()
+        places = await get_places_by_name(db, "IT", "roma", 10)
+        assert [(p.place_name, p.postal_codes) for p in places] == [("Roma", ["00118"])]
+        assert await get_places_by_name(db, "IT", "bologna", 10) == []
+        assert len(await get_places_by_name(db, "DE", "berlin", 10)) == 1
+
+
+class TestAutocomplete:
+
+    @pytest.mark.asyncio
+    async def test_prefix_in_name_order(self, db):
+        cities = await get_places_by_prefix(db, "it", "ROM", 10)
+        assert [c.place_name for c in cities] == ["Roma", "Romagnano"]
+        assert [c.place_name for c in await get_places_by_prefix(db, "IT", "forl", 10)] == ["Forlì"]
+        assert await get_places_by_prefix(db, "IT", "adria", 10) == []
+
+
+class TestGetPostalCode:
+
+    @pytest.mark.asyncio
+    async def test_lookup(self, db):
+        rows = await get_postal_code(db, "it", "47121")
+        assert [r.place_name for r in rows] == ["Forlì"]
+
+    @pytest.mark.asyncio
+    async def test_fields(self, db):
+        assert await get_postal_code(db, "IT", "47121", ["place_name", "latitude"]) == \
+               [{"place_name": "Forlì", "latitude": 44.22}]
+
+
+class TestGetPostalCodes:
+
+    @pytest.mark.asyncio
+    async def test_same_rows_as_single_lookups(self, db, monkeypatch):
+        monkeypatch.setattr(services, "POSTAL_CODE_BATCH_SIZE", 2)
+        items = [(r[0].lower(), r[1]) for r in ROWS] + [("IT", "99999"), ("FR", "75001")]
+        found = await get_postal_codes(db, items)
+        for country, code in items:
+            assert found[country.upper(), code] == await get_postal_code(db, country, code)
+        assert found["IT", "99999"] == []
+
+    def test_batch_query_is_an_index_seek(self, db_path):
+        query = services.POSTAL_CODE_BATCH_QUERY.format(placeholders="?, ?")
+        plan = query_plan(db_path, query, ("IT", "00118", "47121"))
+        assert plan == "SEARCH postal_codes USING INDEX " \
+                       "idx_postal_codes_country_postal_code (country_code=? AND postal_code=?)"
+
+
+class TestNearestPostalCodes:
+
+    @pytest.mark.asyncio
+    async def test_nearest_first_with_distances(self, db):
+        result = await get_nearest_postal_codes(db, 41.9, 12.5, 3)
+        assert [r.place_name for r in result] == ["Roma", "Villa Adriana", "Romagnano"]
+        assert result[0].distance_km == round(haversine_km(41.9, 12.5, 41.89, 12.48), 3)
+        assert result == sorted(result, key=lambda r: r.distance_km)
+
+    @pytest.mark.asyncio
+    async def test_far_from_everything(self, db):
+        # Middle of the Pacific: the search box grows until it reaches land
+        result = await get_nearest_postal_codes(db, 0.0, -150.0, 1)
+        nearest = min(ROWS, key=lambda r: haversine_km(0.0, -150.0, r[9], r[10]))
+        assert [r.place_name for r in result] == [nearest[2]]
+
+    @pytest.mark.asyncio
+    async def test_limit_larger_than_the_table(self, db):
+        assert len(await get_nearest_postal_codes(db, 45.0, 10.0, 100)) == len(ROWS)
+
+    @pytest.mark.asyncio
+    async def test_invalid_coordinates(self, db):
+        assert "Invalid coordinates" in await get_nearest_postal_codes(db, 91.0, 0.0)
+
+    @pytest.mark.asyncio
+    async def test_matches_a_full_scan(self, tmp_path):
+        rnd = random.Random(3)
+        rows = [
+            ("XX", f"{i:05}", f"P{i}", "", "", "", "", "", "",
+             rnd.uniform(-89, 89), rnd.uniform(-180, 180), 4)
+            for i in range(2_000)
+        ]
+        # Across the antimeridian and next to a pole
+        rows += [("XX", "E", "East", *[""] * 6, 10.0, 179.99, 4),
+                 ("XX", "W", "West", *[""] * 6, 10.0, -179.99, 4),
+                 ("XX", "N", "North", *[""] * 6, 89.99, 0.0, 4)]
+        path = tmp_path / "points.db"
+        with sqlite3.connect(path) as con:
+            initdata.create_tables(con)
+            initdata.insert_postal_codes(con.cursor(), rows)
+        con.close()
+        points = [(rnd.uniform(-90, 90), rnd.uniform(-180, 180)) for _ in range(50)]
+        points += [(10.0, -179.995), (10.0, 179.995), (89.9, 180.0)]
+        async with aiosqlite.connect(path) as db:
+            for lat, lon in points:
+                expected = sorted(rows, key=lambda r: haversine_km(lat, lon, r[9], r[10]))[:5]
+                result = await get_nearest_postal_codes(db, lat, lon, 5)
+                assert [r.postal_code for r in result] == [r[1] for r in expected], (lat, lon)
+
+    def test_index_follows_deletes(self, db_path):
+        with sqlite3.connect(db_path) as con:
+            con.execute("DELETE FROM postal_codes WHERE country_code = 'DE'")
+            assert con.execute("SELECT COUNT(*) FROM postal_codes_rtree").fetchone() == (5,)
+        con.close()
+
+
+_rnd = random.Random(5)
+RANDOM_POINTS = [
+    ("XX" if i % 3 else "YY", f"{i:05}", f"P{i}", *[""] * 6,
+     _rnd.uniform(-60, 60), _rnd.uniform(-180, 180), 4)
+    for i in range(3_000)
+]
+
+
+@pytest_asyncio.fixture
+async def points_db(tmp_path):
+    path = tmp_path / "points.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        initdata.insert_postal_codes(con.cursor(), RANDOM_POINTS)
+    con.close()
+    async with aiosqlite.connect(path) as db:
+        yield db
+
+
+async def all_pages(search, *args, limit):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = await search(*args, limit=limit, cursor=cursor)
+        items += page.items
+        pages += 1
+        if page.next_cursor is None:
+            return items, pages
+        assert len(page.items) == limit
+        cursor = page.next_cursor
+
+
+class TestPlacesNear:
+
+    @pytest.mark.asyncio
+    async def test_within_radius_nearest_first(self, db):
+        page = await get_places_near(db, 41.9, 12.5, 30)
+        assert [r.place_name for r in page.items] == ["Roma", "Villa Adriana", "Romagnano"]
+        assert page.next_cursor is None
+        assert all(r.distance_km <= 30 for r in page.items)
+
+    @pytest.mark.asyncio
+    async def test_country_filter(self, db):
+        page = await get_places_near(db, 48.13, 11.57, 1000, "it")
+        assert {r.country_code for r in page.items} == {"IT"}
+        assert len(page.items) == 5
+
+    @pytest.mark.asyncio
+    async def test_pages_match_a_full_scan(self, points_db):
+        lat, lon, radius = 10.0, 170.0, 2_500
+        expected = sorted(
+            (haversine_km(lat, lon, r[9], r[10]), r[1]) for r in RANDOM_POINTS
+            if r[0] == "XX" and haversine_km(lat, lon, r[9], r[10]) <= radius
+        )
+        items, pages = await all_pages(get_places_near, points_db, lat, lon, radius, "XX",
+                                       limit=7)
+        assert [r.postal_code for r in items] == [code for _, code in expected]
+        assert pages == len(expected) // 7 + 1
+
+    @pytest.mark.asyncio
+    async def test_invalid_arguments(self, db):
+        assert "Invalid radius" in await get_places_near(db, 41.9, 12.5, 0)
+        assert "Invalid cursor" in await get_places_near(db, 41.9, 12.5, 10, cursor="x")
+
+
+class TestPlacesInBox:
+
+    @pytest.mark.asyncio
+    async def test_rows_inside_the_box(self, db):
+        page = await get_places_in_box(db, 44.0, 11.0, 45.0, 13.0)
+        assert [r.place_name for r in page.items] == ["Forlì", "Bologna"]
+
+    @pytest.mark.asyncio
+    async def test_box_across_the_antimeridian(self, points_db):
+        items, _ = await all_pages(get_places_in_box, points_db, -20.0, 170.0, 20.0, -170.0, None,
+                                   limit=50)
+        expected = {r[1] for r in RANDOM_POINTS
+                    if -20 <= r[9] <= 20 and (r[10] >= 170 or r[10] <= -170)}
+        assert expected and {r.postal_code for r in items} == expected
+        assert [r.distance_km for r in items] == sorted(r.distance_km for r in items)
+
+
+def query_plan(db_path, query, params):
+    with sqlite3.connect(db_path) as con:
+        return " ".join(row[3] for row in con.execute(f"EXPLAIN QUERY PLAN {query}", params))
+
+
+class TestSchema:
+
+    def test_postal_code_lookup_is_an_index_seek(self, db_path):
+        query = services.POSTAL_CODE_QUERY.format(columns=services.POSTAL_CODE_COLUMNS)
+        plan = query_plan(db_path, query, ("IT", "00118"))
+        assert plan == "SEARCH postal_codes USING INDEX " \
+                       "idx_postal_codes_country_postal_code (country_code=? AND postal_code=?)"
+
+    def test_exact_city_lookup_is_an_index_seek(self, db_path):
+        query = services.CITY_EXACT_QUERY.format(columns=services.POSTAL_CODE_COLUMNS)
+        plan = query_plan(db_path, query, ("IT", "roma", 10))
+        assert plan == "SEARCH postal_codes USING INDEX " \
+                       "idx_postal_codes_country_place_key (country_code=? AND place_key=?)"
+
+    def test_place_lookup_uses_place_key_index(self, db_path):
+        plan = query_plan(db_path, services.PLACE_EXACT_QUERY, ("IT", "roma", 10))
+        assert plan.startswith("SEARCH places USING INDEX idx_places_country_place_key")
+
+    def test_substring_lookup_starts_from_trigram_index(self, db_path):
+        query = services.CITY_TRIGRAM_QUERY.format(columns=services.POSTAL_CODE_COLUMNS_P)
+        plan = query_plan(db_path, query, ('"rom"', "IT", "rom", 10))
+        assert plan.startswith("SCAN f VIRTUAL TABLE")
+        assert "SEARCH p USING INTEGER PRIMARY KEY (rowid=?)" in plan
+
+    def test_migrates_legacy_database(self, tmp_path):
+        path = tmp_path / "legacy.db"
+        with sqlite3.connect(path) as con:
+            # Schema as created before versioning was introduced
+            con.execute("""
+                CREATE TABLE postal_codes (
+                    country_code TEXT, postal_code TEXT, place_name TEXT,
+                    state_name TEXT, state_code TEXT, county_name TEXT, county_code TEXT,
+                    community_name TEXT, community_code TEXT,
+                    latitude REAL, longitude REAL, accuracy INTEGER
+                )
+            """)
+            con.execute("CREATE INDEX idx_postal_code ON postal_codes (postal_code)")
+            con.executemany(
+                "INSERT INTO postal_codes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", ROWS
+            )
+            con.commit()
+
+            assert initdata.migrate(con) == initdata.SCHEMA_VERSION
+            assert initdata.migrate(con) == initdata.SCHEMA_VERSION
+            assert con.execute(
+                "SELECT place_key FROM postal_codes WHERE place_name = 'München'"
+            ).fetchone() == ("munchen",)
+            assert con.execute(
+                "SELECT COUNT(*) FROM postal_codes_fts WHERE postal_codes_fts MATCH '\"unch\"'"
+            ).fetchone() == (1,)
+            indexes = {row[0] for row in con.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'index'")}
+            assert "idx_postal_code" not in indexes
+            assert con.execute("SELECT COUNT(*) FROM places").fetchone() == (len(ROWS),)
+            assert con.execute(
+                "SELECT place_key FROM place_names_fts WHERE place_names_fts MATCH "
+                "'country_tag : \"de~\" AND place_key : \"unch\"'"
+            ).fetchall() == [("munchen",)]
+
+    def test_migration_replaces_empty_strings_with_null(self, tmp_path):
+        with sqlite3.connect(tmp_path / "untyped.db") as con:
+            initdata.create_tables(con)
+            con.execute("DELETE FROM schema_version WHERE version >= 5")
+            con.execute(initdata.INSERT_POSTAL_CODE,
+                        ("IT", "00118", "Roma", "Lazio", "07", "", "", "", "", "", "", "", "roma"))
+            con.commit()
+            initdata.migrate(con)
+            assert con.execute(
+                "SELECT state_name, county_name, latitude, accuracy FROM postal_codes"
+            ).fetchone() == ("Lazio", None, None, None)
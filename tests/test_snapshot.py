@@ -0,0 +1,135 @@
+import sqlite3
+import struct
+
+import aiosqlite
+import pytest
+
+import initdata
+import snapshot
+from services import get_cities, get_cities_from_snapshot, get_places_by_prefix, \
+    get_places_by_prefix_from_snapshot, get_postal_code, get_postal_code_from_snapshot
+from snapshot import Snapshot
+
+ROWS = [
+    ("IT", "00118", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.89, 12.48, 4),
+    ("IT", "00119", "Roma", "Lazio", "07", "Roma", "RM", "", "", 41.90, 12.49, None),
+    ("IT", "00010", "Villa Adriana", "Lazio", "07", "Roma", "RM", "", "", 41.95, 12.77, 4),
+    ("IT", "47121", "Forlì", "Emilia-Romagna", "05", "Forlì-Cesena", "FC", "", "", 44.22, 12.04, 4),
+    ("IT", "00040", "Romagnano", "Lazio", "07", "Roma", "RM", "", "", None, None, None),
+    ("DE", "80331", "München", "Bayern", "BY", "Oberbayern", "091", "", "", 48.13, 11.57, 4),
+    ("DE", "10115", "Berlin", "Berlin", "BE", "Berlin", "00", "", "", 52.53, 13.38, 4),
+]
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    path = tmp_path / "countries.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        initdata.insert_postal_codes(con.cursor(), ROWS)
+    con.close()
+    return path
+
+
+@pytest.fixture
+def snap(db_path):
+    with sqlite3.connect(db_path) as con:
+        path = initdata.export_snapshot(con, db_path.with_name("countries.snap"))
+    con.close()
+    snap = Snapshot(path)
+    yield snap
+    snap.close()
+
+
+class TestSnapshot:
+
+    @pytest.mark.asyncio
+    async def test_same_rows_as_sqlite(self, db_path, snap):
+        assert (snap.generation, snap.rows) == (0, len(ROWS))
+        async with aiosqlite.connect(db_path) as db:
+            for country, code in (("IT", "00118"), ("it", "00119"), ("DE", "80331"),
+                                  ("IT", "99999"), ("FR", "75001")):
+                assert get_postal_code_from_snapshot(snap, country, code) == \
+                       await get_postal_code(db, country, code)
+            for country, city in (("IT", "roma"), ("IT", "ADRIA"), ("DE", "munchen"),
+                                  ("IT", "be"), ("DE", "be"), ("FR", "paris")):
+                by_snapshot = get_cities_from_snapshot(snap, country, city, 10)
+                by_sqlite = await get_cities(db, country, city, 10)
+                # Same exact matches first, then the same substring matches
+                assert by_snapshot[:2] == by_sqlite[:2]
+                assert sorted(by_snapshot, key=repr) == sorted(by_sqlite, key=repr)
+
+    @pytest.mark.asyncio
+    async def test_prefix_search_as_sqlite(self, db_path, snap):
+        async with aiosqlite.connect(db_path) as db:
+            for country, prefix, limit in (("IT", "rom", 10), ("it", "Rom", 2), ("IT", "", 10),
+                                           ("DE", "mun", 10), ("IT", "x", 10), ("FR", "pa", 10)):
+                assert get_places_by_prefix_from_snapshot(snap, country, prefix, limit) == \
+                       await get_places_by_prefix(db, country, prefix, limit)
+
+    def test_prefix_search_stops_at_the_limit(self, snap):
+        assert [r[1] for r in snap.places_by_prefix("IT", "roma", 10)] == ["00118", "00119", "00040"]
+        assert [r[1] for r in snap.places_by_prefix("IT", "roma", 1)] == ["00118"]
+        assert snap.places_by_prefix("IT", "roma", 0) == []
+
+    def test_exact_names_come_first_within_the_limit(self, snap):
+        assert [r[2] for r in snap.cities("IT", "roma", 10)] == ["Roma", "Roma", "Romagnano"]
+        assert [r[1] for r in snap.cities("IT", "roma", 2)] == ["00118", "00119"]
+        assert [r[2] for r in snap.cities("IT", "", 2)] == ["Forlì", "Roma"]
+        assert snap.cities("IT", "roma", 0) == []
+
+    def test_nulls_round_trip(self, snap):
+        [row] = snap.postal_code("IT", "00040")
+        assert row[7:] == (None, None, None, None, None)
+
+    def test_rows_without_postal_code(self, tmp_path):
+        path = tmp_path / "countries.db"
+        with sqlite3.connect(path) as con:
+            initdata.create_tables(con)
+            initdata.insert_postal_codes(con.cursor(), ROWS + [
+                ("IT", None, "Ostia", "Lazio", "07", "Roma", "RM", "", "", 41.73, 12.28, 4)])
+            snap = Snapshot(initdata.export_snapshot(con, tmp_path / "countries.snap"))
+        con.close()
+        try:
+            assert [r[1] for r in snap.postal_code("IT", "00010")] == ["00010"]
+            assert [r[1] for r in snap.postal_code("IT", "47121")] == ["47121"]
+            assert snap.postal_code("IT", "00000") == []
+            assert [r[1:3] for r in snap.cities("IT", "ostia", 10)] == [(None, "Ostia")]
+        finally:
+            snap.close()
+
+    def test_rejects_other_formats(self, snap, tmp_path):
+        data = bytearray(snap.path.read_bytes())
+        struct.pack_into("=I", data, 8, snapshot.FORMAT_VERSION + 1)
+        path = tmp_path / "future.snap"
+        path.write_bytes(data)
+        with pytest.raises(ValueError, match="format"):
+            Snapshot(path)
+        path.write_bytes(b"SQLite format 3\0" + bytes(100))
+        with pytest.raises(ValueError, match="not a postal code snapshot"):
+            Snapshot(path)
+
+
+class TestExport:
+
+    def test_exports_only_when_stale(self, db_path, monkeypatch):
+        path = db_path.with_name("countries.snap")
+        monkeypatch.setattr(initdata, "SNAPSHOT_PATH", str(path))
+        with sqlite3.connect(db_path) as con:
+            initdata.sync_snapshot(con)
+            exported = path.stat().st_mtime_ns
+            initdata.sync_snapshot(con)
+            assert path.stat().st_mtime_ns == exported
+            initdata.bump_generation(con)
+            assert not initdata.snapshot_is_current(con, path)
+            initdata.sync_snapshot(con)
+            assert initdata.snapshot_is_current(con, path)
+        con.close()
+        assert list(path.parent.glob("*.partial")) == []
+
+    def test_disabled_by_default(self, db_path, monkeypatch):
+        monkeypatch.setattr(initdata, "SNAPSHOT_PATH", "")
+        with sqlite3.connect(db_path) as con:
+            initdata.sync_snapshot(con)
+        con.close()
+        assert list(db_path.parent.glob("*.snap")) == []
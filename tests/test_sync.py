@@ -0,0 +1,618 @@
+import hashlib
+import io
+import json
+import random
+import sqlite3
+import threading
+import time
+import tracemalloc
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import download
+import initdata
+import mirror
+from snapshot import Snapshot
+
+
+def country_zip(country_code: str, rows: int) -> bytes:
+    rnd = random.Random(rows)
+    lines = [
+        "\t".join([country_code, f"{i:05}", f"Place {rnd.getrandbits(64):x}", "State", "01",
+                   "County", "001", "", "", f"{rnd.uniform(-90, 90):.4f}",
+                   f"{rnd.uniform(-180, 180):.4f}", "4"])
+        for i in range(rows)
+    ]
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr(f"{country_code}.txt", "\n".join(lines) + "\n")
+        zf.writestr("readme.txt", "GeoNames fixture")
+    return buffer.getvalue()
+
+
+class GeoNamesStandIn:
+    """Local HTTP server mimicking download.geonames.org/export/zip/."""
+
+    def __init__(self, archives: dict, delay: float = 0.0):
+        self.archives = archives
+        self.delay = delay
+        self.failures = {}
+        self.requests = []
+        self.statuses = []
+        self.conditional = True
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                stand_in.requests.append(self.path)
+                name = self.path.rsplit("/", 1)[-1]
+                time.sleep(stand_in.delay)
+                if stand_in.failures.get(name):
+                    stand_in.failures[name] -= 1
+                    self.send_error(503)
+                    return
+                if name == "":
+                    links = "".join(
+                        f'<a href="{n}">{n}</a>'
+                        for n in [*stand_in.archives, "allCountries.zip", "readme.txt"]
+                    )
+                    body = f"<html><body>{links}</body></html>".encode()
+                elif name in stand_in.archives:
+                    body = stand_in.archives[name]
+                else:
+                    self.send_error(404)
+                    return
+                etag = f'"{hashlib.md5(body).hexdigest()}"'
+                if stand_in.conditional and self.headers.get("If-None-Match") == etag:
+                    stand_in.statuses.append((name, 304))
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                stand_in.statuses.append((name, 200))
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                if stand_in.conditional:
+                    self.send_header("ETag", etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        class Server(ThreadingHTTPServer):
+            # Room for a whole wave of concurrent downloads: with the default
+            # backlog of 5 a refused SYN is retried only after a second
+            request_queue_size = 64
+
+        self.server = Server(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/export/zip/"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+COUNTRIES = ["AD", "AT", "BE", "CH", "DE", "FR", "IT", "LU"]
+
+
+@pytest.fixture
+def archives():
+    return {f"{cc}.zip": country_zip(cc, 50) for cc in COUNTRIES}
+
+
+@pytest.fixture
+def con(tmp_path):
+    con = sqlite3.connect(tmp_path / "countries.db")
+    initdata.create_tables(con)
+    yield con
+    con.close()
+
+
+@pytest.fixture(autouse=True)
+def fast_backoff(monkeypatch):
+    monkeypatch.setattr(initdata, "DOWNLOAD_BACKOFF", 0.01)
+
+
+def count_by_country(con) -> dict:
+    return dict(con.execute(
+        "SELECT country_code, COUNT(*) FROM postal_codes GROUP BY country_code"))
+
+
+class TestSyncPostalCodes:
+
+    def test_imports_every_archive(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert count_by_country(con) == {cc: 50 for cc in COUNTRIES}
+        assert initdata.get_generation(con) == 1
+        assert not any(r.endswith("allCountries.zip") for r in stand_in.requests)
+
+    def test_retries_transient_errors(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            stand_in.failures["IT.zip"] = 2
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert count_by_country(con)["IT"] == 50
+        assert stand_in.requests.count("/export/zip/IT.zip") == 3
+
+    def test_skips_archives_that_keep_failing(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            stand_in.failures["IT.zip"] = 10
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert "IT" not in count_by_country(con)
+        assert len(count_by_country(con)) == len(COUNTRIES) - 1
+
+    def test_unreachable_index(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            stand_in.failures[""] = 10
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert count_by_country(con) == {}
+
+    def test_concurrent_downloads_are_faster(self, tmp_path, archives):
+        elapsed = {}
+        for concurrency in (1, len(COUNTRIES)):
+            with sqlite3.connect(tmp_path / f"c{concurrency}.db") as con:
+                initdata.create_tables(con)
+                with GeoNamesStandIn(archives, delay=0.2) as stand_in:
+                    started = time.perf_counter()
+                    initdata.sync_postal_codes(con, stand_in.url, concurrency=concurrency)
+                    elapsed[concurrency] = time.perf_counter() - started
+            con.close()
+        # Serial: ~9 round-trips of 0.2s; concurrent: index + one wave of downloads
+        assert elapsed[len(COUNTRIES)] < elapsed[1] / 2
+
+
+def index_names(con) -> set:
+    return {row[0] for row in con.execute(
+        "SELECT name FROM sqlite_master WHERE type IN ('index', 'table', 'trigger')")}
+
+
+class TestImportMode:
+
+    def test_coerces_rows_to_typed_values(self):
+        row = ["IT", "00118", "Roma", "Lazio", "07", "", "", "", "", "41.9", "12.5", ""]
+        assert initdata.coerce_row(row) == (
+            "IT", "00118", "Roma", "Lazio", "07", None, None, None, None,
+            41.9, 12.5, None, "roma",
+        )
+        # Short rows and garbage numbers
+        assert initdata.coerce_row(["IT", "00118", "Roma"])[3:12] == (None,) * 9
+        assert initdata.coerce_row(["IT", "1", "X", "", "", "", "", "", "", "n/a", "", "4"])[9:12] \
+            == (None, None, 4)
+
+    def test_batches(self):
+        batches = list(initdata.iter_batches([["IT", str(i), "X"] for i in range(5)], 2))
+        assert [len(batch) for batch in batches] == [2, 2, 1]
+
+    def test_stores_typed_columns(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert set(con.execute(
+            "SELECT typeof(latitude), typeof(longitude), typeof(accuracy), typeof(community_name) "
+            "FROM postal_codes")) == {("real", "real", "integer", "null")}
+
+    def test_deferred_indexes_are_rebuilt(self, con, archives):
+        before = index_names(con)
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url, defer_indexes=True)
+        assert index_names(con) == before
+        assert count_by_country(con) == {cc: 50 for cc in COUNTRIES}
+        # The rebuilt trigram index covers every imported row
+        assert con.execute(
+            "SELECT COUNT(*) FROM postal_codes_fts WHERE postal_codes_fts MATCH 'place'"
+        ).fetchone() == (50 * len(COUNTRIES),)
+        # Places are derived from each country's rows even without the indexes
+        assert dict(con.execute(
+            "SELECT country_code, SUM(postal_code_count) FROM places GROUP BY country_code"
+        )) == {cc: 50 for cc in COUNTRIES}
+
+    def test_restores_pragmas(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert con.execute("PRAGMA journal_mode").fetchone() == ("delete",)
+        assert con.execute("PRAGMA synchronous").fetchone() == (2,)
+
+    def test_rebuilds_indexes_when_the_load_fails(self, con):
+        before = index_names(con)
+        with pytest.raises(RuntimeError):
+            with initdata.import_mode(con, defer_indexes=True):
+                assert "idx_postal_codes_country_place_key" not in index_names(con)
+                raise RuntimeError("download failed")
+        assert index_names(con) == before
+
+
+class TestImportPipeline:
+
+    def test_parses_lines(self):
+        lines = ['IT\t00118\t"Roma"\tLazio\t07\t\t\t\t\t91.5\t12.5\t4\n', "\n"]
+        assert initdata.parse_lines(lines) == [(
+            "IT", "00118", '"Roma"', "Lazio", "07", None, None, None, None,
+            None, 12.5, 4, '"roma"',
+        )]
+
+    def test_parsing_stays_ahead_of_the_writer_by_a_bounded_amount(self):
+        read = []
+
+        def chunks():
+            for i in range(20):
+                read.append(i)
+                yield [f"IT\t{i:05}\tPlace\n"]
+
+        with ThreadPoolExecutor(2) as pool:
+            for consumed, batch in enumerate(initdata.iter_parsed(chunks(), pool, ahead=3)):
+                assert batch[0][1] == f"{consumed:05}"
+                assert len(read) - consumed <= 3
+
+    def test_pool_produces_the_same_database_as_a_serial_import(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(initdata, "IMPORT_BATCH_SIZE", 300)
+        archives = {f"{cc}.zip": country_zip(cc, 2_000) for cc in COUNTRIES}
+        contents = {}
+        for workers in (1, 3):
+            with closing(sqlite3.connect(tmp_path / f"w{workers}.db")) as con:
+                initdata.create_tables(con)
+                with GeoNamesStandIn(archives) as stand_in:
+                    # One download at a time: the same import order in both runs
+                    initdata.sync_postal_codes(con, stand_in.url, concurrency=1, workers=workers)
+                contents[workers] = (
+                    con.execute("SELECT rowid, * FROM postal_codes ORDER BY rowid").fetchall(),
+                    con.execute("SELECT rowid, place_key FROM postal_codes_fts ORDER BY rowid").fetchall(),
+                )
+        assert len(contents[1][0]) == 2_000 * len(COUNTRIES)
+        assert contents[3] == contents[1]
+
+
+def peak_sync_allocation(tmp_path, name, archive) -> int:
+    with sqlite3.connect(tmp_path / f"{name}.db") as con:
+        initdata.create_tables(con)
+        with GeoNamesStandIn({"US.zip": archive}) as stand_in:
+            tracemalloc.start()
+            try:
+                initdata.sync_postal_codes(con, stand_in.url, concurrency=1)
+                return tracemalloc.get_traced_memory()[1]
+            finally:
+                tracemalloc.stop()
+                assert count_by_country(con) != {}
+    con.close()
+
+
+class TestMemoryProfile:
+
+    def test_peak_allocation_does_not_grow_with_archive_size(self, tmp_path, monkeypatch):
+        spool_max_size = 256 * 1024
+        monkeypatch.setattr(initdata, "DOWNLOAD_SPOOL_MAX_SIZE", spool_max_size)
+        # Insert batches are bounded by IMPORT_BATCH_SIZE, not by the archive size
+        monkeypatch.setattr(initdata, "IMPORT_BATCH_SIZE", 100)
+        small = country_zip("US", 1_000)
+        large = country_zip("US", 100_000)
+        assert len(large) > 8 * spool_max_size
+
+        # The first sync also allocates one-off state (imports, parser tables)
+        peak_sync_allocation(tmp_path, "warm-up", country_zip("US", 10))
+        small_peak = peak_sync_allocation(tmp_path, "small", small)
+        large_peak = peak_sync_allocation(tmp_path, "large", large)
+        # A buffered download would hold the whole archive (several MB) at once
+        assert large_peak < len(large) / 2
+        assert large_peak < small_peak + 4 * spool_max_size, (small_peak, large_peak)
+
+
+@pytest.fixture
+def imports(monkeypatch):
+    """Records the countries actually re-imported by a sync."""
+    calls = []
+    original = initdata.import_country_archive
+
+    def import_country_archive(cur, country_code, archive, pool=None):
+        calls.append(country_code)
+        return original(cur, country_code, archive, pool)
+
+    monkeypatch.setattr(initdata, "import_country_archive", import_country_archive)
+    return calls
+
+
+class TestRefresh:
+
+    def test_records_sync_state(self, con, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+        state = initdata.load_sync_state(con)
+        assert set(state) == set(COUNTRIES)
+        validators, sha256 = state["IT"]
+        assert validators.etag is not None
+        assert sha256 == hashlib.sha256(archives["IT.zip"]).hexdigest()
+
+    def test_unchanged_archives_are_not_downloaded(self, con, archives, imports):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+            stand_in.statuses.clear()
+            imports.clear()
+            initdata.sync_postal_codes(con, stand_in.url, refresh=True)
+        assert {status for name, status in stand_in.statuses if name} == {304}
+        assert imports == []
+        assert initdata.get_generation(con) == 1
+
+    def test_only_changed_countries_are_imported(self, con, archives, imports):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+            imports.clear()
+            stand_in.archives["IT.zip"] = country_zip("IT", 70)
+            initdata.sync_postal_codes(con, stand_in.url, refresh=True)
+        assert imports == ["IT"]
+        assert count_by_country(con) == {**{cc: 50 for cc in COUNTRIES}, "IT": 70}
+        assert initdata.get_generation(con) == 2
+        assert con.execute(
+            "SELECT row_count FROM sync_state WHERE country_code = 'IT'").fetchone() == (70,)
+
+    def test_same_content_without_validators_is_not_imported(self, con, archives, imports):
+        with GeoNamesStandIn(archives) as stand_in:
+            stand_in.conditional = False
+            initdata.sync_postal_codes(con, stand_in.url)
+            imports.clear()
+            initdata.sync_postal_codes(con, stand_in.url, refresh=True)
+        assert imports == []
+
+    def test_full_sync_ignores_state(self, con, archives, imports):
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+            imports.clear()
+            initdata.sync_postal_codes(con, stand_in.url)
+        assert sorted(imports) == COUNTRIES
+
+
+@pytest.fixture
+def mirror_dir(tmp_path, archives):
+    """A local copy of the GeoNames export with one zip per country."""
+    directory = tmp_path / "mirror"
+    directory.mkdir()
+    for name, data in archives.items():
+        (directory / name).write_bytes(data)
+    return directory
+
+
+def all_countries_zip(archives: dict) -> bytes:
+    text = ""
+    for name in sorted(archives):
+        with zipfile.ZipFile(io.BytesIO(archives[name])) as zf:
+            text += zf.read(name.replace(".zip", ".txt")).decode()
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr("allCountries.txt", text)
+        zf.writestr("readme.txt", "GeoNames fixture")
+    return buffer.getvalue()
+
+
+class TestLocalSource:
+
+    def test_imports_country_archives_from_a_directory(self, con, mirror_dir, imports):
+        initdata.sync_postal_codes(con, str(mirror_dir))
+        assert count_by_country(con) == {cc: 50 for cc in COUNTRIES}
+        assert sorted(imports) == COUNTRIES
+        assert initdata.get_generation(con) == 1
+
+    def test_refresh_skips_unchanged_files(self, con, mirror_dir, imports):
+        initdata.sync_postal_codes(con, str(mirror_dir))
+        imports.clear()
+        (mirror_dir / "IT.zip").write_bytes(country_zip("IT", 70))
+        initdata.sync_postal_codes(con, str(mirror_dir), refresh=True)
+        assert imports == ["IT"]
+        assert count_by_country(con)["IT"] == 70
+
+    def test_splits_all_countries_dump(self, tmp_path, con, archives, mirror_dir, monkeypatch):
+        monkeypatch.setattr(initdata, "IMPORT_BATCH_SIZE", 7)
+        dump_dir = tmp_path / "dump"
+        dump_dir.mkdir()
+        (dump_dir / "allCountries.zip").write_bytes(all_countries_zip(archives))
+        imported = []
+        initdata.sync_postal_codes(con, str(dump_dir),
+                                   on_imported=lambda cc, total: imported.append((cc, total)))
+        assert imported == [(cc, None) for cc in COUNTRIES]
+
+        with closing(sqlite3.connect(tmp_path / "per-country.db")) as expected:
+            initdata.create_tables(expected)
+            initdata.sync_postal_codes(expected, str(mirror_dir))
+            query = "SELECT * FROM postal_codes ORDER BY country_code, postal_code"
+            assert con.execute(query).fetchall() == expected.execute(query).fetchall()
+
+        # Each country is hashed on its own rows: only the changed one is imported again
+        initdata.sync_postal_codes(con, str(dump_dir), refresh=True)
+        assert initdata.get_generation(con) == 1
+        (dump_dir / "allCountries.zip").write_bytes(
+            all_countries_zip({**archives, "IT.zip": country_zip("IT", 70)}))
+        imported.clear()
+        initdata.sync_postal_codes(con, str(dump_dir), refresh=True,
+                                   on_imported=lambda cc, total: imported.append(cc))
+        assert imported == ["IT"]
+        assert count_by_country(con)["IT"] == 70
+
+    def test_rejects_a_dump_not_ordered_by_country(self, tmp_path, con, archives):
+        dump = all_countries_zip(archives)
+        with zipfile.ZipFile(io.BytesIO(dump)) as zf:
+            lines = zf.read("allCountries.txt").decode().splitlines(keepends=True)
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w") as zf:
+            # The first AD row moved to the end: AD comes in two runs
+            zf.writestr("allCountries.txt", "".join(lines[1:] + lines[:1]))
+        dump_dir = tmp_path / "dump"
+        dump_dir.mkdir()
+        (dump_dir / "allCountries.zip").write_bytes(buffer.getvalue())
+        with pytest.raises(ValueError, match="AD comes twice"):
+            mirror.country_sha256s(dump_dir / "allCountries.zip")
+        assert initdata.sync_postal_codes(con, str(dump_dir)) is False
+        assert count_by_country(con) == {}
+
+    def test_prefers_country_archives_over_the_dump(self, mirror_dir, archives):
+        (mirror_dir / "allCountries.zip").write_bytes(all_countries_zip(archives))
+        archives = list(mirror.iter_local_archives(mirror_dir, 100))
+        assert [a.name for a in archives] == [f"{cc}.zip" for cc in COUNTRIES]
+        for archive in archives:
+            archive.close()
+
+    def test_missing_directory(self, tmp_path, con):
+        initdata.sync_postal_codes(con, str(tmp_path / "missing"))
+        assert count_by_country(con) == {}
+
+    def test_reads_saved_country_info(self, tmp_path, con, mirror_dir):
+        for lang, name in (("it", "Italia"), ("en", "Italy")):
+            (mirror_dir / f"countryInfo-{lang}.json").write_text(json.dumps(
+                {"geonames": [{"country_code": "IT", "country_name": name}]}))
+        initdata.create_country_database(con, str(mirror_dir))
+        assert set(con.execute("SELECT lang, country_name FROM countries")) == {
+            ("it", "Italia"), ("en", "Italy")}
+
+
+@pytest.fixture
+def live_db(tmp_path, archives):
+    path = tmp_path / "live.db"
+    with sqlite3.connect(path) as con:
+        initdata.create_tables(con)
+        con.execute("INSERT INTO countries VALUES ('IT', 'Italia', 'it')")
+        with GeoNamesStandIn(archives) as stand_in:
+            initdata.sync_postal_codes(con, stand_in.url)
+    con.close()
+    return path
+
+
+class TestHotRefresh:
+
+    def test_publishes_refreshed_database(self, live_db, archives):
+        with sqlite3.connect(live_db) as reader:
+            # A reader holding the live file open keeps seeing the old data
+            with GeoNamesStandIn(archives) as stand_in:
+                stand_in.archives["IT.zip"] = country_zip("IT", 70)
+                assert initdata.refresh_database(live_db, stand_in.url) is True
+            assert count_by_country(reader)["IT"] == 50
+        reader.close()
+        with sqlite3.connect(live_db) as con:
+            assert count_by_country(con)["IT"] == 70
+            assert initdata.get_generation(con) == 2
+        con.close()
+        assert list(live_db.parent.glob("*.shadow")) == []
+
+    def test_keeps_live_database_without_changes(self, live_db, archives):
+        before = live_db.stat().st_ino
+        with GeoNamesStandIn(archives) as stand_in:
+            assert initdata.refresh_database(live_db, stand_in.url) is False
+        assert live_db.stat().st_ino == before
+        assert list(live_db.parent.glob("*.shadow")) == []
+
+    def test_rejects_database_that_lost_rows(self, live_db, archives):
+        with GeoNamesStandIn(archives) as stand_in:
+            for name in archives:
+                stand_in.archives[name] = country_zip(name[:2], 5)
+            with pytest.raises(ValueError):
+                initdata.refresh_database(live_db, stand_in.url)
+        with sqlite3.connect(live_db) as con:
+            assert count_by_country(con) == {cc: 50 for cc in COUNTRIES}
+        con.close()
+        assert list(live_db.parent.glob("*.shadow")) == []
+
+
+    def test_exports_snapshot_of_the_published_generation(self, live_db, archives, monkeypatch):
+        snapshot_path = live_db.with_name("live.snap")
+        monkeypatch.setattr(initdata, "SNAPSHOT_PATH", str(snapshot_path))
+        with GeoNamesStandIn(archives) as stand_in:
+            stand_in.archives["IT.zip"] = country_zip("IT", 70)
+            assert initdata.refresh_database(live_db, stand_in.url) is True
+        snapshot = Snapshot(snapshot_path)
+        assert (snapshot.generation, snapshot.rows) == (2, 70 + 50 * (len(COUNTRIES) - 1))
+        snapshot.close()
+
+
+class TestDatasetIndex:
+
+    def test_skips_non_country_archives(self):
+        html = '<a href="IT.zip">IT</a><a href="GB_full.csv.zip"></a>' \
+               '<a href="allCountries.zip"></a><a href="readme.txt"></a><a name="top"></a>'
+        assert download.parse_dataset_index(html) == ["IT.zip"]
+
+
+class KilledImport(BaseException):
+    """Stops an import the way killing the process would: no handler catches it."""
+
+
+@pytest.fixture
+def build_source(tmp_path, mirror_dir, monkeypatch):
+    """A local source for check_and_sync building a new database at DB_PATH."""
+    for lang in ("it", "en"):
+        (mirror_dir / f"countryInfo-{lang}.json").write_text(json.dumps(
+            {"geonames": [{"country_code": cc, "country_name": cc} for cc in COUNTRIES]}))
+    monkeypatch.setattr(initdata, "DB_PATH", tmp_path / "countries.db")
+    monkeypatch.setattr(initdata, "SNAPSHOT_PATH", "")
+    return str(mirror_dir)
+
+
+def kill_after(monkeypatch, imports, countries: int):
+    imported = initdata.import_country_archive
+
+    def import_country_archive(cur, country_code, archive, pool=None):
+        if len(imports) == countries:
+            raise KilledImport
+        return imported(cur, country_code, archive, pool)
+
+    monkeypatch.setattr(initdata, "import_country_archive", import_country_archive)
+    return imported
+
+
+class TestResumeBuild:
+
+    def test_killed_import_is_resumed(self, build_source, monkeypatch, imports):
+        imported = kill_after(monkeypatch, imports, 3)
+        with pytest.raises(KilledImport):
+            initdata.check_and_sync(source=build_source)
+        first = list(imports)
+        with closing(sqlite3.connect(initdata.DB_PATH)) as con:
+            assert not initdata.is_build_complete(con)
+            assert set(initdata.load_sync_state(con)) == set(first)
+
+        monkeypatch.setattr(initdata, "import_country_archive", imported)
+        imports.clear()
+        assert initdata.check_and_sync(source=build_source) is True
+        assert sorted(imports) == sorted(set(COUNTRIES) - set(first))
+        with closing(sqlite3.connect(initdata.DB_PATH)) as con:
+            assert initdata.is_build_complete(con)
+            assert count_by_country(con) == {cc: 50 for cc in COUNTRIES}
+            assert index_names(con) >= set(initdata.SECONDARY_INDEXES)
+
+        imports.clear()
+        assert initdata.check_and_sync(source=build_source) is False
+        assert imports == []
+
+    def test_imported_countries_are_reported_before_the_rest(self, build_source, monkeypatch,
+                                                             imports):
+        imported = kill_after(monkeypatch, imports, 3)
+        with pytest.raises(KilledImport):
+            initdata.check_and_sync(on_ready=lambda: None, source=build_source)
+        first = list(imports)
+
+        monkeypatch.setattr(initdata, "import_country_archive", imported)
+        events = []
+        initdata.check_and_sync(on_ready=lambda: events.append("ready"),
+                                on_imported=lambda cc, total: events.append(cc),
+                                source=build_source)
+        assert events[0] == "ready"
+        assert sorted(events[1:4]) == sorted(first)
+        assert sorted(events[4:]) == sorted(set(COUNTRIES) - set(first))
+
+    def test_failed_countries_leave_the_build_incomplete(self, build_source, mirror_dir, imports):
+        (mirror_dir / "IT.zip").write_bytes(b"not a zip")
+        initdata.check_and_sync(source=build_source)
+        with closing(sqlite3.connect(initdata.DB_PATH)) as con:
+            assert not initdata.is_build_complete(con)
+
+        (mirror_dir / "IT.zip").write_bytes(country_zip("IT", 50))
+        imports.clear()
+        initdata.check_and_sync(source=build_source)
+        assert imports == ["IT"]
+        with closing(sqlite3.connect(initdata.DB_PATH)) as con:
+            assert initdata.is_build_complete(con)
+
+    def test_databases_without_the_flag_are_complete(self, con):
+        assert initdata.is_build_complete(con)
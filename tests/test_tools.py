@@ -1,11 +1,6 @@
-from collections.abc import AsyncIterator
-from contextlib import asynccontextmanager
-
 import pytest
-from mcp.server import FastMCP
-from mcp.server.lowlevel.server import Server
-from src.geonames_mcp_server.main import AppContext, \
-    get_countries  # Assumiamo che hai rinominato la funzione
+
+from services import Country, Item, countries, get_countries
 
 
 # Usiamo una classe per raggruppare i test relativi a get_countries
@@ -15,72 +10,42 @@ class TestGetCountries:
     async def test_get_all_countries(self, test_db):
         """
         Verifica che, senza filtri, la funzione restituisca tutti i paesi
-        e che la struttura dei dati sia corretta.
+        della lingua richiesta.
         """
+        result = await get_countries(test_db, search_term="", lang="en")
 
-        @asynccontextmanager
-        async def test_lifespan(server: FastMCP) -> AsyncIterator[AppContext]:
-            yield AppContext(db=test_db)
-
-        server = FastMCP("test", lifespan=test_lifespan)
-        # Chiama la funzione passando il nostro contesto di test
-        countries = await get_countries(ctx=server.get_context(), search_term="", lang="en")
-
-        # ✅ CONTROLLO SPECIFICO: Il numero di risultati è esattamente 3?
-        assert len(countries) == 3
-
-        # ✅ CONTROLLO STRUTTURA: Il primo risultato ha le chiavi 'id' e 'label'?
-        assert "id" in countries[0]
-        assert "label" in countries[0]
-        assert countries[0]["id"] == "IT"
-        assert countries[0]["label"] == "Italy"
+        assert len(result) == 3
+        assert result[0] == Country(country_code="IT", country_name="Italy")
 
     @pytest.mark.asyncio
     async def test_get_countries_with_search_term(self, test_db):
-        """
-        Verifica che il filtro di ricerca funzioni correttamente.
-        """
+        result = await get_countries(test_db, search_term="Germa", lang="en")
 
-        @asynccontextmanager
-        async def test_lifespan(server: Server) -> AsyncIterator[AppContext]:
-            yield AppContext(db=test_db)
+        assert [country.country_name for country in result] == ["Germany"]
 
-        countries = await get_countries(search_term="Germa", lang="en")
+    @pytest.mark.asyncio
+    async def test_get_countries_case_insensitive(self, test_db):
+        result = await get_countries(test_db, search_term="united STATES", lang="en")
 
-        # ✅ CONTROLLO FUNZIONALITÀ: Deve trovare solo la Germania
-        assert len(countries) == 1
-        assert countries[0]["label"] == "Germany"
+        assert [country.country_code for country in result] == ["US"]
 
     @pytest.mark.asyncio
-    async def test_get_countries_case_insensitive(self, test_db):
-        """
-        Verifica che la ricerca ignori maiuscole e minuscole.
-        """
+    async def test_get_countries_no_results(self, test_db):
+        result = await get_countries(test_db, search_term="Atlantis", lang="en")
 
-        @asynccontextmanager
-        async def test_lifespan(server: Server) -> AsyncIterator[AppContext]:
-            yield AppContext(db=test_db)
+        assert result == []
 
-        countries = await get_countries(search_term="united STATES", lang="en")
 
-        # ✅ CONTROLLO FUNZIONALITÀ: Deve trovare gli Stati Uniti
-        assert len(countries) == 1
-        assert countries[0]["id"] == "US"
+class TestCountries:
 
     @pytest.mark.asyncio
-    async def test_get_countries_no_results(self, test_db):
-        """
-        Verifica che la funzione restituisca una lista vuota se non trova nulla.
-        """
+    async def test_items_have_id_and_label(self, test_db):
+        result = await countries(test_db, "ital", "it")
 
-        @asynccontextmanager
-        async def test_lifespan(server: Server) -> AsyncIterator[AppContext]:
-            yield AppContext(db=test_db)
+        assert result == [Item(id="IT", label="Italia")]
 
-        server = Server[dict[str, bool]]("test", lifespan=test_lifespan)
-
-        countries = await get_countries(ctx=server, search_term="Atlantis", lang="en")
+    @pytest.mark.asyncio
+    async def test_language_filter(self, test_db):
+        result = await countries(test_db, None, "en")
 
-        # ✅ CONTROLLO EDGE CASE: Il risultato deve essere una lista vuota
-        assert len(countries) == 0
-        assert countries == []
+        assert {item.id for item in result} == {"IT", "DE", "US"}